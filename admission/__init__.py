@@ -0,0 +1,155 @@
+"""Cooldowns and concurrency limits, for turning away commands under load
+
+Cooldowns are token buckets: each key (a user, a channel, a guild...) gets
+`burst` tokens to start with, and earns back `rate` tokens per second, up to
+`burst`. A command takes one token from each of its keys, or is turned away if
+any of them is out. Buckets only exist for keys that used a token recently; a
+bucket that has filled back up is the same as no bucket, so those get dropped.
+
+Slots cap how many of something run at once. Rather than queueing, a full set
+of slots turns new work away straight away, so that the bot answers quickly
+(with a notice) instead of building up a backlog when it's saturated.
+"""
+
+import time
+
+
+class Cooldown:
+    """Token buckets for a set of keys that share the same rate and burst
+
+    Attributes
+    ==========
+    rate : float
+        Tokens earned back per second.
+    burst : float
+        Most tokens a key can save up.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        # (tokens, when they were counted) by key, for keys that aren't full
+        self.buckets = {}
+        self._pruned = time.monotonic()
+
+    def _tokens(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket == None:
+            return self.burst
+        tokens, then = bucket
+        return min(self.burst, tokens + (now - then) * self.rate)
+
+    def wait(self, key, now=None):
+        """Seconds until key has a token to spare (0 if it has one now)"""
+        now = time.monotonic() if now == None else now
+        tokens = self._tokens(key, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def take(self, key, now=None):
+        """Take a token from key (whether or not it has one to spare)"""
+        now = time.monotonic() if now == None else now
+        self.buckets[key] = (self._tokens(key, now) - 1, now)
+        # Every bucket that's had time to fill back up can go
+        if now - self._pruned > self.burst / self.rate:
+            self._pruned = now
+            self.buckets = {k: (tokens, then) for k, (tokens, then) in self.buckets.items()
+                if tokens + (now - then) * self.rate < self.burst}
+
+
+def take_all(cooldowns, now=None):
+    """Take a token from every (Cooldown, key) pair, but only if all have one
+
+    Parameters
+    ==========
+    cooldowns : [(Cooldown, object)]
+        The buckets to take from.
+
+    Returns
+    =======
+    (float, int)
+        Seconds to wait, and the index of the pair that has to be waited on;
+        (0.0, None) if the tokens were taken.
+    """
+    now = time.monotonic() if now == None else now
+    for i, (cooldown, key) in enumerate(cooldowns):
+        wait = cooldown.wait(key, now)
+        if wait > 0:
+            return wait, i
+    for cooldown, key in cooldowns:
+        cooldown.take(key, now)
+    return 0.0, None
+
+
+class Slot:
+    """One taken slot, given back when its `with` block ends"""
+    __slots__ = ('slots', 'key')
+
+    def __init__(self, slots, key):
+        self.slots = slots
+        self.key = key
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.slots.release(self.key)
+
+
+class Slots:
+    """A limit on how many of something run at once, that never waits
+
+    Rather than waiting for a slot, callers that can't get one are expected to
+    turn the work away:
+
+        slot = slots.try_acquire()
+        if slot == None:
+            ...turn it away...
+            return
+        with slot:
+            ...
+
+    Attributes
+    ==========
+    limit : int
+        Most that can run at once.
+    per_key : int
+        Most that can run at once for any one key (e.g. a user), None for no limit.
+    in_use : int
+        Number running now.
+    by_key : {object: int}
+        Number running now by key, for keys with any running (if per_key is set).
+    """
+    def __init__(self, limit, per_key=None):
+        self.limit = limit
+        self.per_key = per_key
+        self.in_use = 0
+        self.by_key = {}
+
+    def try_acquire(self, key=None, force=False):
+        """Take a slot for key, if one is free
+
+        Parameters
+        ==========
+        key : object
+            What the slot is for, for the per_key limit.
+        force : bool
+            Take the slot even if none are free (it still counts towards the limits).
+
+        Returns
+        =======
+        Slot
+            The slot, to be used in a `with` block; None if none were free.
+        """
+        if not force and (self.in_use >= self.limit or (self.per_key != None
+                and self.by_key.get(key, 0) >= self.per_key)):
+            return None
+        self.in_use += 1
+        if self.per_key != None:
+            self.by_key[key] = self.by_key.get(key, 0) + 1
+        return Slot(self, key)
+
+    def release(self, key=None):
+        self.in_use -= 1
+        if self.per_key != None:
+            count = self.by_key.pop(key) - 1
+            if count > 0:
+                self.by_key[key] = count
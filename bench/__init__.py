@@ -0,0 +1 @@
+"""Offline benchmarks for the bot, run from the repo root (see bench/loadtest.py)"""
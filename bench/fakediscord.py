@@ -0,0 +1,256 @@
+"""Stand-ins for the parts of discord.py that the bot uses
+
+Just enough of Client/Guild/Channel/Member/Message for the bot's handlers to
+run offline. Every call that would hit the Discord REST API goes through
+FakeREST, which adds latency and the occasional 429 (rate limit), and records
+what was sent so benchmarks can check the bot actually replied.
+"""
+
+import asyncio
+import datetime
+import random
+
+
+class FakeREST:
+    """Simulated Discord REST API timing
+
+    Attributes
+    ==========
+    latency : float
+        Mean seconds per call.
+    jitter : float
+        Calls take latency +/- up to this many seconds.
+    rate_limit_chance : float
+        Chance (0 to 1) that a call is rate limited first.
+    retry_after : float
+        Seconds a rate limited call waits before going through, like discord.py
+        does when it gets a 429.
+    calls : {str: int}
+        Number of calls made, by name.
+    rate_limited : int
+        Number of calls that were rate limited.
+    """
+    def __init__(self, latency=0.05, jitter=0.02, rate_limit_chance=0.0, retry_after=1.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_chance = rate_limit_chance
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = {}
+        self.rate_limited = 0
+
+    async def call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.rate_limit_chance > 0 and self.random.random() < self.rate_limit_chance:
+            self.rate_limited += 1
+            await asyncio.sleep(self.retry_after)
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        await asyncio.sleep(max(delay, 0))
+
+
+class FakePermissions:
+    def __init__(self, manage_guild=False):
+        self.manage_guild = manage_guild
+
+
+class FakeMember:
+    def __init__(self, member_id, bot=False, manage_guild=False):
+        self.id = member_id
+        self.name = 'user{}'.format(member_id)
+        self.nick = 'User {}'.format(member_id)
+        self.bot = bot
+        self.mention = '<@{}>'.format(member_id)
+        self.avatar_url = 'https://cdn.discordapp.com/embed/avatars/{}.png'.format(member_id % 5)
+        self.guild_permissions = FakePermissions(manage_guild)
+
+
+class FakeMessage:
+    def __init__(self, rest, message_id, content, author, channel, mentions=(), attachments=()):
+        self.rest = rest
+        self.id = message_id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.mentions = list(mentions)
+        self.attachments = list(attachments)
+        self.embeds = []
+        self.created_at = datetime.datetime(2021, 1, 1) + datetime.timedelta(seconds=message_id % 10**7)
+        self.jump_url = 'https://discord.com/channels/{}/{}/{}'.format(
+                self.guild.id, channel.id, message_id)
+
+    async def delete(self):
+        await self.rest.call('delete_message')
+
+    async def edit(self, content=None, embed=None):
+        await self.rest.call('edit_message')
+        self.embeds = [embed] if embed != None else self.embeds
+
+    async def add_reaction(self, emoji):
+        await self.rest.call('add_reaction')
+
+    async def clear_reaction(self, emoji):
+        await self.rest.call('clear_reaction')
+
+    async def clear_reactions(self):
+        await self.rest.call('clear_reactions')
+
+
+class FakeChannel:
+    def __init__(self, client, guild, channel_id):
+        self.client = client
+        self.guild = guild
+        self.id = channel_id
+        self.name = 'channel-{}'.format(channel_id)
+        self.mention = '<#{}>'.format(channel_id)
+        # Everything the bot sent here, as (content, embed, file or files)
+        self.sent = []
+
+    async def send(self, content=None, embed=None, file=None, files=None):
+        await self.client.rest.call('send_message')
+        self.sent.append((content, embed, file if files == None else files))
+        message = FakeMessage(self.client.rest, self.client.next_id(), content or '',
+                self.client.user, self)
+        message.embeds = [embed] if embed != None else []
+        self.client.last_sent[asyncio.current_task()] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.client.rest.call('fetch_message')
+        return self.client.make_message(self, message_id)
+
+
+class FakeGuild:
+    def __init__(self, client, guild_id):
+        self.client = client
+        self.id = guild_id
+        self.name = 'guild-{}'.format(guild_id)
+        self.filesize_limit = 8 * 1024 * 1024
+
+    def get_member(self, member_id):
+        # No member cache, like a bot without the members intent
+        return None
+
+    async def fetch_member(self, member_id):
+        await self.client.rest.call('fetch_member')
+        return FakeMember(member_id)
+
+
+class FakeReaction:
+    def __init__(self, emoji, message):
+        self.emoji = emoji
+        self.message = message
+
+
+class FakeRawReaction:
+    """Stand-in for discord.RawReactionActionEvent"""
+    def __init__(self, emoji, guild_id, channel_id, message_id, member):
+        self.emoji = emoji
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.member = member
+        self.user_id = member.id
+
+
+class FakeAppInfo:
+    def __init__(self, owner):
+        self.owner = owner
+        self.team = None
+
+
+class FakeClient:
+    """Stand-in for discord.Client
+
+    Attributes
+    ==========
+    rest : FakeREST
+        Timing for simulated API calls.
+    page_turns : int
+        How many times a (simulated) user pages through each quotes list before
+        letting it time out.
+    authors : int
+        Number of distinct authors that fetched messages are attributed to.
+    """
+    def __init__(self, rest, page_turns=0, authors=100, react_wait=0.0):
+        self.rest = rest
+        self.page_turns = page_turns
+        self.authors = authors
+        self.react_wait = react_wait
+        self.user = FakeMember(1, bot=True)
+        self.guilds = {}
+        self.channels = {}
+        self.last_sent = {}
+        self._turns_taken = {}
+        self._next_id = 10**15
+
+    def next_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def guild(self, guild_id):
+        guild = self.guilds.get(guild_id)
+        if guild == None:
+            guild = FakeGuild(self, guild_id)
+            self.guilds[guild_id] = guild
+        return guild
+
+    def channel(self, guild_id, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel == None:
+            channel = FakeChannel(self, self.guild(guild_id), channel_id)
+            self.channels[channel_id] = channel
+        return channel
+
+    def make_message(self, channel, message_id):
+        """Build the (deterministic) message that lives at an ID"""
+        author = FakeMember(1000 + message_id % self.authors)
+        content = 'Quote number {} about {}'.format(message_id,
+                ' '.join(('lorem', 'ipsum', 'dolor', 'sit', 'amet')[0:1 + message_id % 5]))
+        return FakeMessage(self.rest, message_id, content, author, channel)
+
+    def get_guild(self, guild_id):
+        return self.guild(guild_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def fetch_guild(self, guild_id):
+        await self.rest.call('fetch_guild')
+        return self.guild(guild_id)
+
+    async def fetch_channel(self, channel_id):
+        await self.rest.call('fetch_channel')
+        return self.channels[channel_id]
+
+    async def application_info(self):
+        # Owned by nobody who sends messages, so e.g. $debug is ignored
+        await self.rest.call('application_info')
+        return FakeAppInfo(FakeMember(0))
+
+    async def change_presence(self, activity=None):
+        await self.rest.call('change_presence')
+
+    async def wait_for(self, event, check=None, timeout=None):
+        """Turn the page page_turns times per task, then time out"""
+        task = asyncio.current_task()
+        turns = self._turns_taken.get(task, 0)
+        if event != 'reaction_add' or turns >= self.page_turns:
+            self._turns_taken.pop(task, None)
+            self.last_sent.pop(task, None)
+            raise asyncio.TimeoutError()
+        self._turns_taken[task] = turns + 1
+        await asyncio.sleep(self.react_wait)
+        # Always page right (EMOJI_RIGHT in main.py)
+        reaction = FakeReaction('▶', self.last_sent.get(task))
+        user = FakeMember(2)
+        if check != None and not check(reaction, user):
+            raise asyncio.TimeoutError()
+        return reaction, user
+
+    def user_message(self, guild_id, channel_id, content, author_id=2, mentions=()):
+        """Build a message sent by a user, to feed to on_message"""
+        channel = self.channel(guild_id, channel_id)
+        return FakeMessage(self.rest, self.next_id(), content, FakeMember(author_id),
+                channel, mentions=mentions)
+
@@ -0,0 +1,266 @@
+"""Offline load test for the bot's command and reaction handlers
+
+Drives on_message and on_raw_reaction_add with synthetic events, with the
+Discord API replaced by the stubs in bench.fakediscord and a scratch database
+standing in for the real one. The quotes table is filled to each requested size
+in turn, and every scenario is run against it.
+
+Usage (from the repo root, with a scratch MySQL DB the user can create tables in)
+    python3 -m bench.loadtest --user bench --password pw --database chrondb_bench \\
+        --sizes 1000,100000,1000000 --iterations 200 --concurrency 8
+
+or against a scratch SQLite file, with no server needed
+    python3 -m bench.loadtest --backend sqlite --sqlite-path bench.db --sizes 1000,100000
+
+Reports p50/p99 latency and throughput per scenario and size.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+
+import logpipe
+import main
+import storage
+from bench.fakediscord import FakeClient, FakeMember, FakeRawReaction, FakeREST
+
+
+# Every seeded quote lives in this guild, spread over these channels
+GUILD_ID = 500
+CHANNEL_IDS = list(range(600, 620))
+# Number of distinct quote authors (IDs 1000 and up, see FakeClient.make_message)
+AUTHORS = 100
+# ID of the user that sends commands and saves quotes
+USER_ID = 2
+
+# Rows inserted per transaction when seeding
+SEED_BATCH_SIZE = 10000
+
+
+################################################################################
+# Setup
+################################################################################
+
+async def seed(client, size, guild_id=GUILD_ID, channel_ids=CHANNEL_IDS, first_id=1):
+    """Fill a guild's quotes up to size quotes
+
+    Message IDs run from first_id to first_id + size - 1, so give each guild
+    its own range. The channels must already be registered with the client.
+    """
+    have = await main.STORE.count_quotes(guild_id)
+    if have >= size:
+        return
+    print('Seeding {} quotes...'.format(size - have))
+    stop = first_id + size
+    for start in range(first_id + have, stop, SEED_BATCH_SIZE):
+        batch = []
+        for msg_id in range(start, min(start + SEED_BATCH_SIZE, stop)):
+            channel = client.channels[channel_ids[msg_id % len(channel_ids)]]
+            message = client.make_message(channel, msg_id)
+            batch.append((message.author.id, USER_ID, msg_id, guild_id, channel.id,
+                message.content))
+        await main.STORE.import_quotes(batch)
+    main.QUOTE_CACHE.bump(guild_id)
+    await main.rebuild_stats(guild_id)
+
+
+################################################################################
+# Scenarios
+################################################################################
+
+# Each scenario builds the event for one operation and feeds it to the bot
+
+async def rquote(client, size):
+    await main.on_message(client.user_message(GUILD_ID, random.choice(CHANNEL_IDS), '$rquote'))
+
+async def rquote_user(client, size):
+    author = FakeMember(1000 + random.randrange(AUTHORS))
+    message = client.user_message(GUILD_ID, random.choice(CHANNEL_IDS),
+            '$rquote {}'.format(author.mention), mentions=[author])
+    await main.on_message(message)
+
+async def quote_n(client, size):
+    await main.on_message(client.user_message(GUILD_ID, random.choice(CHANNEL_IDS),
+            '$quote {}'.format(random.randint(1, size))))
+
+async def quotes_paging(client, size):
+    await main.on_message(client.user_message(GUILD_ID, random.choice(CHANNEL_IDS), '$quotes'))
+
+async def quotesearch(client, size):
+    await main.on_message(client.user_message(GUILD_ID, random.choice(CHANNEL_IDS),
+            '$quotesearch {}'.format(random.choice(('lorem', 'ipsum dolor', 'amet')))))
+
+async def save(client, size):
+    channel_id = random.choice(CHANNEL_IDS)
+    payload = FakeRawReaction(main.EMOJI_QUOTE, GUILD_ID, channel_id, client.next_id(),
+            FakeMember(USER_ID))
+    await main.on_raw_reaction_add(payload)
+
+SCENARIOS = {
+    'rquote': rquote,
+    'rquote_user': rquote_user,
+    'quote_n': quote_n,
+    'quotes_paging': quotes_paging,
+    'quotesearch': quotesearch,
+    'save': save
+}
+
+
+################################################################################
+# Running
+################################################################################
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if len(samples) == 0:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(samples)) - 1, 0)
+    return samples[rank]
+
+async def run_scenario(client, scenario, size, iterations, concurrency):
+    """Run one scenario iterations times, concurrency at a time
+
+    Returns
+    =======
+    dict
+        Latency percentiles (in ms), throughput (ops/s), and errors/429s seen.
+    """
+    latencies = []
+    errors = 0
+    remaining = iterations
+    rate_limited = client.rest.rate_limited
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                await scenario(client, size)
+            except Exception as err:
+                errors += 1
+                if errors == 1:
+                    print('  First error: {!r}'.format(err))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'ops_per_s': iterations / elapsed if elapsed > 0 else 0.0,
+        'errors': errors,
+        'rate_limited': client.rest.rate_limited - rate_limited
+    }
+
+async def run(args):
+    await connect(args)
+    rest = FakeREST(args.latency, args.jitter, args.rate_limit_chance, args.retry_after,
+            seed=args.seed)
+    client = FakeClient(rest, page_turns=args.page_turns, authors=AUTHORS)
+    for channel_id in CHANNEL_IDS:
+        client.channel(GUILD_ID, channel_id)
+    main.CLIENT = client
+
+    results = {}
+    print('{:>9} {:<14} {:>10} {:>10} {:>10} {:>7} {:>6}'.format(
+        'quotes', 'scenario', 'p50 ms', 'p99 ms', 'ops/s', 'errors', '429s'))
+    for size in args.sizes:
+        await seed(client, size)
+        results[size] = {}
+        for name in args.scenarios:
+            stats = await run_scenario(client, SCENARIOS[name], size,
+                    args.iterations, args.concurrency)
+            results[size][name] = stats
+            print('{:>9} {:<14} {:>10.1f} {:>10.1f} {:>10.1f} {:>7} {:>6}'.format(
+                size, name, stats['p50_ms'], stats['p99_ms'], stats['ops_per_s'],
+                stats['errors'], stats['rate_limited']))
+    await main.STORE.close()
+    return results
+
+def add_db_args(parser):
+    """Add the options for connecting to the benchmark DB to a parser"""
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'), default='mysql')
+    parser.add_argument('--sqlite-path', default='chronicler_bench.db')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--user', default='chronicler_bench')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--database', default='chrondb_bench')
+    parser.add_argument('--reset', action='store_true',
+            help='drop the benchmark tables first')
+    parser.add_argument('--no-cache', action='store_true',
+            help='run every quote list query, instead of caching them')
+    parser.add_argument('--admission', action='store_true',
+            help='turn away commands over the cooldowns and limits, like the bot does '
+            '(off by default, since every simulated command comes from the same user)')
+
+def add_rest_args(parser):
+    """Add the options for the simulated Discord API to a parser"""
+    parser.add_argument('--latency', type=float, default=0.05,
+            help='mean seconds per simulated API call')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--rate-limit-chance', type=float, default=0.0,
+            help='chance (0 to 1) of a simulated 429 per API call')
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=None)
+
+def make_store(args):
+    if args.backend == 'sqlite':
+        return storage.open_storage('sqlite', path=args.sqlite_path)
+    return storage.open_storage('mysql', host=args.host, user=args.user,
+            password=args.password, database=args.database)
+
+async def connect(args):
+    """Point the bot at the benchmark DB, with its tables created"""
+    # Only hear about problems, not every command
+    logpipe.setup('WARNING')
+    if args.no_cache:
+        main.QUOTE_CACHE.max_entries = 0
+    main.ADMISSION_CONTROL = args.admission
+    main.STORE = make_store(args)
+    if not await main.STORE.open():
+        raise SystemExit('Unable to connect to the benchmark DB')
+    if args.reset:
+        # Opening again creates the tables afresh
+        await main.STORE.drop_tables()
+        await main.STORE.close()
+        main.STORE = make_store(args)
+        await main.STORE.open()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    add_db_args(parser)
+    add_rest_args(parser)
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+            type=lambda s: [int(n) for n in s.split(',')],
+            help='comma-separated numbers of stored quotes to test at')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+            type=lambda s: s.split(','),
+            help='comma-separated scenarios to run ({})'.format(', '.join(SCENARIOS)))
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--page-turns', type=int, default=3,
+            help='pages turned per $quotes list')
+    parser.add_argument('--json', help='also write the results to this file')
+    return parser.parse_args(argv)
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            raise SystemExit('Unknown scenario {}'.format(name))
+    random.seed(args.seed)
+
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,175 @@
+"""Replay recorded gateway events against the bot, offline
+
+Feeds an event log written by eventlog.Recorder (see RECORD_EVENTS_FILE in
+main.py) back into on_message and on_raw_reaction_add, with the Discord API
+stubbed by bench.fakediscord and a scratch database (MySQL or SQLite, see
+bench.loadtest) standing in for the real one. Events are dispatched at their recorded times (optionally sped up), each
+in its own task like discord.py does, and the time to handle each one is
+reported per kind of event.
+
+Usage (from the repo root)
+    python3 -m bench.replay events.ndjson.gz --speed 10 --quotes 10000 \\
+        --user bench --password pw --database chrondb_bench --save-baseline base.json
+    python3 -m bench.replay events.ndjson.gz --speed 10 --quotes 10000 \\
+        --user bench --password pw --database chrondb_bench --baseline base.json
+
+When comparing against a baseline, exits with status 1 if any kind of event got
+slower (at p50 or p99) by more than the tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import eventlog
+import main
+from bench import loadtest
+from bench.fakediscord import FakeClient, FakeMember, FakeRawReaction, FakeREST
+
+
+# Seeded quotes for each guild get their own block of message IDs
+SEED_ID_BLOCK = 10**10
+
+
+def event_key(event):
+    """Name the kind of an event, to group timings by"""
+    if event[0] == 'm':
+        tokens = event[6].split()
+        return tokens[0] if len(tokens) > 0 else 'message'
+    if event[6] == main.EMOJI_QUOTE:
+        return 'react:save'
+    if event[6] == main.EMOJI_DELQUOTE:
+        return 'react:remove'
+    return 'react:other'
+
+def dispatch(client, event):
+    """Build the event's stand-in object and pass it to the bot's handler"""
+    if event[0] == 'm':
+        _, _, guild_id, channel_id, _, author_id, content, mention_ids = event
+        message = client.user_message(guild_id, channel_id, content, author_id,
+                mentions=[FakeMember(m) for m in mention_ids])
+        return main.on_message(message)
+    _, _, guild_id, channel_id, message_id, member_id, emoji = event
+    client.channel(guild_id, channel_id)
+    payload = FakeRawReaction(emoji, guild_id, channel_id, message_id, FakeMember(member_id))
+    return main.on_raw_reaction_add(payload)
+
+async def replay(events, args):
+    """Replay events, returning the timings (in seconds) by kind of event"""
+    await loadtest.connect(args)
+    rest = FakeREST(args.latency, args.jitter, args.rate_limit_chance, args.retry_after,
+            seed=args.seed)
+    client = FakeClient(rest, page_turns=args.page_turns)
+    main.CLIENT = client
+
+    # Register every channel up front, then give each guild some quotes to work with
+    channels = {}
+    for event in events:
+        channels.setdefault(event[2], set()).add(event[3])
+        client.channel(event[2], event[3])
+    if args.quotes > 0:
+        for i, guild_id in enumerate(sorted(channels)):
+            await loadtest.seed(client, args.quotes, guild_id, sorted(channels[guild_id]),
+                    first_id=(i + 1) * SEED_ID_BLOCK)
+
+    timings = {}
+    errors = 0
+
+    async def timed(event):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            await dispatch(client, event)
+        except Exception as err:
+            errors += 1
+            if errors == 1:
+                print('  First error: {!r}'.format(err))
+        timings.setdefault(event_key(event), []).append(time.perf_counter() - start)
+
+    print('Replaying {} events...'.format(len(events)))
+    tasks = []
+    start = time.monotonic()
+    for event in events:
+        if args.speed > 0:
+            delay = event[1] / 1000 / args.speed - (time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(timed(event)))
+    await asyncio.gather(*tasks)
+    print('Done in {:.1f}s, {} errors, {} simulated 429s'.format(
+        time.monotonic() - start, errors, rest.rate_limited))
+    await main.STORE.close()
+    return timings
+
+def summarise(timings):
+    results = {}
+    for key, samples in timings.items():
+        samples.sort()
+        results[key] = {
+            'count': len(samples),
+            'p50_ms': loadtest.percentile(samples, 50) * 1000,
+            'p99_ms': loadtest.percentile(samples, 99) * 1000
+        }
+    return results
+
+def compare(results, baseline, tolerance):
+    """Print results next to the baseline, returning the regressed event kinds"""
+    regressions = []
+    print('{:<16} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+        'event', 'count', 'p50 ms', 'base p50', 'p99 ms', 'base p99'))
+    for key in sorted(results):
+        now = results[key]
+        base = baseline.get(key)
+        if base == None:
+            print('{:<16} {:>7} {:>10.1f} {:>10} {:>10.1f} {:>10}'.format(
+                key, now['count'], now['p50_ms'], '-', now['p99_ms'], '-'))
+            continue
+        slower = [pct for pct in ('p50_ms', 'p99_ms')
+            if now[pct] > base[pct] * (1 + tolerance)]
+        if slower:
+            regressions.append(key)
+        print('{:<16} {:>7} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}{}'.format(
+            key, now['count'], now['p50_ms'], base['p50_ms'], now['p99_ms'], base['p99_ms'],
+            '  REGRESSED' if slower else ''))
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('log', help='event log recorded by the bot')
+    parser.add_argument('--speed', type=float, default=1.0,
+            help='replay this many times faster than recorded (0 for no waiting at all)')
+    parser.add_argument('--quotes', type=int, default=1000,
+            help='quotes to seed for each guild in the log')
+    parser.add_argument('--page-turns', type=int, default=0,
+            help='pages turned per $quotes list')
+    parser.add_argument('--baseline', help='compare against results saved in this file')
+    parser.add_argument('--save-baseline', help='save the results to this file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+            help='fraction slower than the baseline that counts as a regression')
+    loadtest.add_db_args(parser)
+    loadtest.add_rest_args(parser)
+    return parser.parse_args(argv)
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    events = eventlog.read(args.log)
+
+    results = summarise(asyncio.run(replay(events, args)))
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+    regressions = compare(results, baseline, args.tolerance)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as out:
+            json.dump(results, out, indent=2)
+    if regressions:
+        print('Slower than baseline: {}'.format(', '.join(regressions)))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main_cli()
@@ -1,31 +1,65 @@
+import logging
+
 import mysql.connector
 from mysql.connector import Error
 
+import metrics
+
+
+LOGGER = logging.getLogger('chronicler.db')
+
+
+# Time spent in each kind of DB call, and how many of them failed
+QUERY_SECONDS = metrics.histogram('chronicler_db_query_seconds',
+        'Time spent running DB queries', ('op',))
+QUERY_ERRORS = metrics.counter('chronicler_db_query_errors_total',
+        'DB queries that raised an error', ('op',))
+
 
 ################################################################################
 # Basic setup functions
 ################################################################################
 
-def query(conn, query, verbose=True):
+def query(conn, query, verbose=True, params=None):
     cursor = conn.cursor()
     try:
-        cursor.execute(query)
-        conn.commit()
+        with QUERY_SECONDS.time(op='query'):
+            cursor.execute(query, params)
+            conn.commit()
         if verbose:
-            print('Query successful')
+            LOGGER.debug('Query successful')
+        return 0
+    except Error as err:
+        QUERY_ERRORS.inc(op='query')
+        LOGGER.error('%s', err)
+        return 1
+
+# Run a list of (query, params) pairs as a single transaction, rolling all of
+# them back if any one fails
+def transaction(conn, queries):
+    cursor = conn.cursor()
+    try:
+        with QUERY_SECONDS.time(op='transaction'):
+            for q, params in queries:
+                cursor.execute(q, params)
+            conn.commit()
         return 0
     except Error as err:
-        print('Error: {}'.format(err))
+        QUERY_ERRORS.inc(op='transaction')
+        conn.rollback()
+        LOGGER.error('%s', err)
         return 1
 
-def read_query(conn, query):
+def read_query(conn, query, params=None):
     result = None
     cursor = conn.cursor()
     try:
-        cursor.execute(query)
-        result = cursor.fetchall()
+        with QUERY_SECONDS.time(op='read'):
+            cursor.execute(query, params)
+            result = cursor.fetchall()
     except Error as err:
-        print('Error: {}'.format(err))
+        QUERY_ERRORS.inc(op='read')
+        LOGGER.error('%s', err)
     return result
 
 def create_srv_conn(host_name, user_name, user_pw, dbname):
@@ -38,12 +72,12 @@ def create_srv_conn(host_name, user_name, user_pw, dbname):
         )
         retval = query(conn, "USE {};".format(dbname), False)
         if retval != 0:
-            print('Cannot establish MySQL DB connection.')
+            LOGGER.error('Cannot establish MySQL DB connection.')
             return None
-        print('Established MySQL DB connection.')
-        print('Database changed to {}'.format(dbname))
+        LOGGER.info('Established MySQL DB connection.')
+        LOGGER.info('Database changed to %s', dbname)
     except Error as err:
-        print('Error: {}'.format(err))
+        LOGGER.error('%s', err)
     return conn
 
 def close_srv_conn(conn):
@@ -58,18 +92,36 @@ def create_table(conn, table, columns):
     q = 'CREATE TABLE {} ({});'.format(table, columns)
     retval = query(conn, q, False)
     if retval == 0:
-        print('Created table {}'.format(table))
+        LOGGER.info('Created table %s', table)
     else:
-        print('Cannot create table {}'.format(table))
+        LOGGER.info('Cannot create table %s', table)
+    return retval
+
+def add_column(conn, table, column):
+    q = 'ALTER TABLE {} ADD COLUMN {};'.format(table, column)
+    retval = query(conn, q, False)
+    if retval == 0:
+        LOGGER.info('Added column to %s', table)
+    else:
+        LOGGER.info('Cannot add column to %s', table)
+    return retval
+
+def add_index(conn, table, name, columns, kind=''):
+    q = 'ALTER TABLE {} ADD {} INDEX {} ({});'.format(table, kind, name, columns)
+    retval = query(conn, q, False)
+    if retval == 0:
+        LOGGER.info('Added index %s to %s', name, table)
+    else:
+        LOGGER.info('Cannot add index %s to %s', name, table)
     return retval
 
 def drop_table(conn, table):
     q = 'DROP TABLE {};'.format(table)
     retval = query(conn, q, False)
     if retval == 0:
-        print('Dropped table {}'.format(table))
+        LOGGER.info('Dropped table %s', table)
     else:
-        print('Cannot drop table {}'.format(table))
+        LOGGER.info('Cannot drop table %s', table)
     return retval
 
 
@@ -81,20 +133,86 @@ def insert(conn, table, values):
     q = 'INSERT INTO {} VALUES ({});'.format(table, values)
     retval = query(conn, q, False)
     if retval == 0:
-        print('Inserted entry into {}'.format(table))
+        LOGGER.debug('Inserted entry into %s', table)
     else:
-        print('Cannot insert into {}'.format(table))
+        LOGGER.info('Cannot insert into %s', table)
     return retval
 
-def insert_partial(conn, table, columns, values):
+def insert_partial(conn, table, columns, values, params=None):
     q = 'INSERT INTO {} ({}) VALUES ({});'.format(table, columns, values)
-    retval = query(conn, q, False)
+    retval = query(conn, q, False, params)
     if retval == 0:
-        print('Inserted entry into {}'.format(table))
+        LOGGER.debug('Inserted entry into %s', table)
     else:
-        print('Cannot insert into {}'.format(table))
+        LOGGER.info('Cannot insert into %s', table)
     return retval
 
+# Insert one row into a table with an AUTO_INCREMENT key, returning the new key
+# (or None on error)
+def insert_returning_id(conn, table, columns, values, params=None):
+    q = 'INSERT INTO {} ({}) VALUES ({});'.format(table, columns, values)
+    cursor = conn.cursor()
+    try:
+        with QUERY_SECONDS.time(op='query'):
+            cursor.execute(q, params)
+            conn.commit()
+        LOGGER.debug('Inserted entry into %s', table)
+        return cursor.lastrowid
+    except Error as err:
+        QUERY_ERRORS.inc(op='query')
+        LOGGER.error('%s', err)
+        LOGGER.info('Cannot insert into %s', table)
+        return None
+
+# Insert a batch of rows (list of tuples) in a single transaction. With ignore
+# set, rows that collide with an existing key are skipped. Returns the number of
+# rows actually inserted, or -1 on error.
+def insert_many(conn, table, columns, rows, ignore=False):
+    if len(rows) == 0:
+        return 0
+    placeholders = ', '.join(['%s'] * len(rows[0]))
+    q = 'INSERT {}INTO {} ({}) VALUES ({});'.format(
+            'IGNORE ' if ignore else '', table, columns, placeholders)
+    cursor = conn.cursor()
+    try:
+        with QUERY_SECONDS.time(op='insert_many'):
+            cursor.executemany(q, rows)
+            conn.commit()
+        LOGGER.debug('Inserted %s entries into %s', cursor.rowcount, table)
+        return cursor.rowcount
+    except Error as err:
+        QUERY_ERRORS.inc(op='insert_many')
+        conn.rollback()
+        LOGGER.error('%s', err)
+        LOGGER.info('Cannot insert into %s', table)
+        return -1
+
+def update(conn, table, assignments, where, params=None):
+    q = 'UPDATE {} SET {} WHERE {};'.format(table, assignments, where)
+    retval = query(conn, q, False, params)
+    if retval == 0:
+        LOGGER.debug('Updated entry in %s', table)
+    else:
+        LOGGER.info('Cannot update %s', table)
+    return retval
+
+# Update rows, returning how many were actually changed (or -1 on error), e.g.
+# to tell whether a conditional update won
+def update_count(conn, table, assignments, where, params=None):
+    q = 'UPDATE {} SET {} WHERE {};'.format(table, assignments, where)
+    cursor = conn.cursor()
+    try:
+        with QUERY_SECONDS.time(op='query'):
+            cursor.execute(q, params)
+            conn.commit()
+        LOGGER.debug('Updated %s entries in %s', cursor.rowcount, table)
+        return cursor.rowcount
+    except Error as err:
+        QUERY_ERRORS.inc(op='query')
+        LOGGER.error('%s', err)
+        LOGGER.info('Cannot update %s', table)
+        return -1
+
 def delete(conn, table, where):
     if where == None:
         q = 'DELETE FROM {};'.format(table)
@@ -102,17 +220,35 @@ def delete(conn, table, where):
         q = 'DELETE FROM {} WHERE {};'.format(table, where)
     retval = query(conn, q, False)
     if retval == 0:
-        print('Deleted entry from {}'.format(table))
+        LOGGER.debug('Deleted entry from %s', table)
     else:
-        print('Cannot insert from {}'.format(table))
+        LOGGER.info('Cannot delete from %s', table)
     return retval
 
+# Delete rows, returning how many were actually deleted (or -1 on error), e.g.
+# to tell whether a row matching the condition existed
+def delete_count(conn, table, where, params=None):
+    q = 'DELETE FROM {} WHERE {};'.format(table, where)
+    cursor = conn.cursor()
+    try:
+        with QUERY_SECONDS.time(op='query'):
+            cursor.execute(q, params)
+            conn.commit()
+        LOGGER.debug('Deleted %s entries from %s', cursor.rowcount, table)
+        return cursor.rowcount
+    except Error as err:
+        QUERY_ERRORS.inc(op='query')
+        LOGGER.error('%s', err)
+        LOGGER.info('Cannot delete from %s', table)
+        return -1
+
 
 ################################################################################
 # Reading functions
 ################################################################################
 
-def select(conn, table, columns, where=None, orderby=None, orderasc=False):
+def select(conn, table, columns, where=None, orderby=None, orderasc=False,
+        limit=None, params=None):
     q = 'SELECT {} FROM {}'.format(columns, table)
     if where != None:
         q += ' WHERE {}'.format(where)
@@ -122,5 +258,7 @@ def select(conn, table, columns, where=None, orderby=None, orderasc=False):
             q += ' ASC'
         else:
             q += ' DESC'
+    if limit != None:
+        q += ' LIMIT {}'.format(limit)
     q += ';'
-    return read_query(conn, q)
+    return read_query(conn, q, params)
@@ -0,0 +1,124 @@
+"""Recording of the gateway events the bot handles, for replaying offline
+
+Events are appended to a gzipped file, one compact JSON array per line:
+
+    ["m", ms, guild_id, channel_id, message_id, author_id, content, [mention_ids]]
+    ["r", ms, guild_id, channel_id, message_id, member_id, emoji]
+
+where ms is the time since recording started. Each time recording starts, a
+header line ({"version": ..., "started": ...}) is written first, so a file can
+hold several sessions back to back.
+
+Message contents are scrubbed before they are written: only the command and the
+arguments the bot cares about are kept, and any other word is replaced by x's of
+the same length. Messages that aren't commands are recorded with no content.
+"""
+
+import atexit
+import datetime
+import gzip
+import json
+import re
+import time
+
+
+FORMAT_VERSION = 1
+
+# Command arguments that are kept as-is when scrubbing
+KEEP_WORDS = {
+    'help', 'export', 'import', 'rebuild', 'here', 'off', 'set', 'reset', 'on',
+    'list', 'cancel', 'snooze', 'profile',
+    'week', 'weeks', 'day', 'days', 'hour', 'hours', 'hr', 'hrs',
+    'minute', 'minutes', 'min', 'mins'
+}
+# User/channel/role mentions are kept too, since commands act on them
+MENTION_RE = re.compile(r'<[@#][!&]?\d+>')
+
+
+def scrub(content):
+    """Strip a message down to what the bot's command handling looks at
+
+    Parameters
+    ==========
+    content : str
+        The message's text.
+
+    Returns
+    =======
+    str
+        The command with its arguments scrubbed, or '' if it isn't a command.
+    """
+    tokens = content.split()
+    if len(tokens) == 0 or not tokens[0].startswith('$'):
+        return ''
+    scrubbed = [tokens[0]]
+    for token in tokens[1:]:
+        if token.isnumeric() or token in KEEP_WORDS or MENTION_RE.fullmatch(token):
+            scrubbed.append(token)
+        else:
+            scrubbed.append('x' * len(token))
+    return ' '.join(scrubbed)
+
+
+class Recorder:
+    """Appends handled events to a gzipped log file
+
+    Methods
+    =======
+    message(message)
+        Record a message that was passed to on_message.
+    reaction(payload)
+        Record a reaction that was passed to on_raw_reaction_add.
+    close()
+        Flush and close the file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._start = time.monotonic()
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._write({'version': FORMAT_VERSION,
+            'started': datetime.datetime.utcnow().isoformat()})
+        atexit.register(self.close)
+
+    def _write(self, entry):
+        if self._file != None:
+            self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    def _ms(self):
+        return int((time.monotonic() - self._start) * 1000)
+
+    def message(self, message):
+        guild_id = message.guild.id if message.guild != None else 0
+        self._write(['m', self._ms(), guild_id, message.channel.id, message.id,
+            message.author.id, scrub(message.content), [m.id for m in message.mentions]])
+
+    def reaction(self, payload):
+        self._write(['r', self._ms(), payload.guild_id or 0, payload.channel_id,
+            payload.message_id, payload.user_id, str(payload.emoji)])
+
+    def close(self):
+        if self._file != None:
+            self._file.close()
+            self._file = None
+
+
+def read(path):
+    """Read back a recorded log, as a list of events in time order
+
+    Sessions are laid end to end, so the ms of each event counts from the start
+    of the first session.
+    """
+    events = []
+    base = 0
+    last = 0
+    with gzip.open(path, 'rt', encoding='utf-8') as infile:
+        for line in infile:
+            entry = json.loads(line)
+            if isinstance(entry, dict):
+                # New session: carry on from where the last one left off
+                base = last
+                continue
+            entry[1] += base
+            last = entry[1]
+            events.append(entry)
+    return events
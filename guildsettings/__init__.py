@@ -0,0 +1,206 @@
+"""Per-guild settings, kept in the DB and cached in memory
+
+Each guild's changed settings are stored as one JSON object, along with a
+version number that every save sets one higher than any other guild's. The
+whole table is read once on startup (it only has rows for guilds that changed
+something), so looking up a setting is a dict lookup and never a query.
+
+A save updates this process's copy straight away. Other processes sharing the
+DB (e.g. a second shard) pick it up the next time they refresh(), which only
+reads the rows with a version higher than the last one they saw.
+"""
+
+import asyncio
+import json
+import logging
+
+
+LOGGER = logging.getLogger('chronicler.settings')
+
+# Words accepted for turning a yes/no setting on and off
+TRUE_WORDS = {'on', 'yes', 'true', '1'}
+FALSE_WORDS = {'off', 'no', 'false', '0'}
+
+
+class Setting:
+    """One setting that guilds can change
+
+    Attributes
+    ==========
+    name : str
+        What the setting is called in `$settings`.
+    default : bool or int
+        Value for guilds that haven't changed it. Its type is the setting's type.
+    doc : str
+        What the setting does, for `$settings`.
+    low, high : int
+        Lowest and highest allowed values, for whole number settings.
+    """
+    __slots__ = ('name', 'default', 'doc', 'low', 'high')
+
+    def __init__(self, name, default, doc, low=None, high=None):
+        self.name = name
+        self.default = default
+        self.doc = doc
+        self.low = low
+        self.high = high
+
+    def parse(self, text):
+        """Turn what a user typed into a value for this setting
+
+        Raises
+        ======
+        ValueError
+            If text isn't a valid value, with a message saying what is.
+        """
+        text = text.lower()
+        if isinstance(self.default, bool):
+            if text in TRUE_WORDS:
+                return True
+            if text in FALSE_WORDS:
+                return False
+            raise ValueError('`{}` must be `on` or `off`'.format(self.name))
+        try:
+            value = int(text)
+        except ValueError:
+            value = None
+        if value == None or value < self.low or value > self.high:
+            raise ValueError('`{}` must be a whole number from {} to {}'.format(
+                self.name, self.low, self.high))
+        return value
+
+    def valid(self, value):
+        """Whether a stored value still fits this setting (e.g. after a default changed type)"""
+        if isinstance(self.default, bool):
+            return isinstance(value, bool)
+        return (isinstance(value, int) and not isinstance(value, bool)
+            and self.low <= value <= self.high)
+
+    def format(self, value):
+        if isinstance(self.default, bool):
+            return 'on' if value else 'off'
+        return str(value)
+
+
+class GuildSettings:
+    """Every guild's settings, cached in memory
+
+    Attributes
+    ==========
+    settings : {str: Setting}
+        The settings guilds can change, by name.
+    store : storage.Storage
+        Where the settings are kept (None until load()).
+    version : int
+        Highest version seen so far.
+
+    Methods
+    =======
+    load(store)
+        Read every guild's settings.
+    refresh()
+        Read the settings saved since the last load/refresh (e.g. by another process).
+    get(guild_id, name)
+        A guild's value for a setting.
+    changed(guild_id)
+        The settings a guild has changed from their defaults.
+    set(guild_id, name, value)
+        Change (or with None, reset) a guild's setting, and save it.
+    """
+    def __init__(self, settings):
+        self.settings = {setting.name: setting for setting in settings}
+        self.store = None
+        self.version = 0
+        # Changed settings by guild ID, and the version they were saved at
+        self._values = {}
+        self._versions = {}
+        # Lock by guild ID, so that overlapping set()s for a guild each build
+        # on the last one's changes instead of losing them
+        self._locks = {}
+
+    async def load(self, store):
+        """Read every guild's settings from store, and use it from now on"""
+        self.store = store
+        self.version = 0
+        self._values = {}
+        self._versions = {}
+        await self.refresh()
+
+    async def refresh(self):
+        """Read the settings saved since the last load/refresh
+
+        Returns
+        =======
+        int
+            Number of guilds whose settings changed.
+        """
+        rows = await self.store.guild_settings(self.version)
+        for guild_id, text, version in rows:
+            self._apply(guild_id, text, version)
+        return len(rows)
+
+    def _apply(self, guild_id, text, version):
+        self.version = max(self.version, version)
+        # Already have this (or a newer) save, e.g. it was made by this process
+        if self._versions.get(guild_id, 0) >= version:
+            return
+        try:
+            stored = json.loads(text)
+        except ValueError:
+            LOGGER.error('Unreadable settings for guild %s', guild_id)
+            stored = {}
+        values = {}
+        for name, value in stored.items():
+            setting = self.settings.get(name)
+            # Skip settings that were dropped or whose rules changed since
+            if setting == None or not setting.valid(value):
+                LOGGER.warning('Ignoring setting %s = %r for guild %s', name, value, guild_id)
+                continue
+            values[name] = value
+        self._values[guild_id] = values
+        self._versions[guild_id] = version
+
+    def get(self, guild_id, name):
+        """A guild's value for a setting (the default if the guild is None)"""
+        values = self._values.get(guild_id)
+        if values != None and name in values:
+            return values[name]
+        return self.settings[name].default
+
+    def changed(self, guild_id):
+        """The settings a guild has changed, as {name: value}"""
+        return dict(self._values.get(guild_id, {}))
+
+    async def set(self, guild_id, name, value):
+        """Change a guild's setting and save it
+
+        Parameters
+        ==========
+        guild_id : int
+            The guild to change the setting for.
+        name : str
+            Name of the setting.
+        value : bool or int
+            The new value (already parsed), or None to go back to the default.
+
+        Returns
+        =======
+        bool
+            True if it was saved.
+        """
+        lock = self._locks.get(guild_id)
+        if lock == None:
+            lock = asyncio.Lock()
+            self._locks[guild_id] = lock
+        async with lock:
+            values = self.changed(guild_id)
+            if value == None or value == self.settings[name].default:
+                values.pop(name, None)
+            else:
+                values[name] = value
+            version = await self.store.save_guild_settings(guild_id, json.dumps(values))
+            if version == None:
+                return False
+            self._values[guild_id] = values
+            self._versions[guild_id] = version
+            return True
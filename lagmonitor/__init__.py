@@ -0,0 +1,177 @@
+"""Event loop lag monitor, for catching blocking calls inside coroutines
+
+A heartbeat coroutine sleeps for a fixed interval and measures how late it wakes
+up; that lateness is the time the loop spent unable to run anything else. A
+separate watcher thread notices when a heartbeat is overdue and grabs the loop
+thread's stack while it is still stuck, so the stall can be pinned on the call
+site that caused it.
+
+Both only wake up a few times a second, so this is cheap enough to leave on.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+
+LOOP_LAG_SECONDS = metrics.histogram('chronicler_loop_lag_seconds',
+        'How late the event loop heartbeat woke up',
+        buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+LOOP_STALLS = metrics.counter('chronicler_loop_stalls_total',
+        'Times the event loop was blocked for longer than the threshold')
+
+
+def format_frame(frame):
+    """Describe a traceback.FrameSummary as `file:line in function`"""
+    return '{}:{} in {}'.format(os.path.basename(frame.filename), frame.lineno, frame.name)
+
+def pick_call_site(stack, root):
+    """Pick the frame to blame for a stall
+
+    That's the innermost frame from our own code (under root) if there is one,
+    since the stdlib/library frames below it are just what it called into.
+
+    Parameters
+    ==========
+    stack : traceback.StackSummary
+        The stack, outermost frame first.
+    root : str
+        Directory of the bot's own source files.
+    """
+    for frame in reversed(stack):
+        if frame.filename.startswith(root):
+            return frame
+    return stack[-1]
+
+
+class Offender:
+    """Running totals of the stalls blamed on one call site"""
+    __slots__ = ('site', 'count', 'total', 'worst', 'stack')
+
+    def __init__(self, site):
+        self.site = site
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.stack = ''
+
+
+class LagMonitor:
+    """Measures event loop lag and blames stalls on the call site that caused them
+
+    Attributes
+    ==========
+    interval : float
+        Seconds between heartbeats.
+    threshold : float
+        Lag in seconds above which the loop is considered stalled.
+    root : str
+        Directory of the bot's own source files, to pick call sites from.
+    offenders : {str: Offender}
+        Stalls seen so far, by call site.
+
+    Methods
+    =======
+    start(loop)
+        Start the heartbeat and watcher thread on an event loop.
+    stop()
+        Stop monitoring.
+    report(top_n)
+        Summary of the worst offenders, as a string.
+    """
+    def __init__(self, interval=0.25, threshold=0.1, root=None):
+        self.interval = interval
+        self.threshold = threshold
+        if root == None:
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.root = root
+        self.offenders = {}
+        self._loop = None
+        self._loop_thread = None
+        self._task = None
+        self._stopped = threading.Event()
+        # (heartbeat number, time it is due), swapped in whole by the loop thread
+        self._beat = (0, 0.0)
+        # Stack captured by the watcher thread as (beat, site, stack text)
+        self._captured = None
+
+    def start(self, loop=None):
+        self._loop = loop if loop != None else asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        self._task = self._loop.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name='lagmonitor', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task != None:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        beat = 0
+        while True:
+            due = time.monotonic() + self.interval
+            self._beat = (beat, due)
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - due, 0.0)
+            LOOP_LAG_SECONDS.observe(lag)
+            if lag > self.threshold:
+                LOOP_STALLS.inc()
+                captured = self._captured
+                if captured != None and captured[0] == beat:
+                    self._blame(captured[1], captured[2], lag)
+                else:
+                    # Stall ended before the watcher got a look at it
+                    self._blame('<unknown>', '', lag)
+            beat += 1
+
+    def _blame(self, site, stack, lag):
+        offender = self.offenders.get(site)
+        if offender == None:
+            offender = Offender(site)
+            self.offenders[site] = offender
+        offender.count += 1
+        offender.total += lag
+        if lag >= offender.worst:
+            offender.worst = lag
+            offender.stack = stack
+
+    def _watch(self):
+        # Check a few times per threshold, so short stalls still get caught
+        poll = min(self.interval, self.threshold) / 2
+        while not self._stopped.wait(poll):
+            beat, due = self._beat
+            if time.monotonic() - due < self.threshold:
+                continue
+            if self._captured != None and self._captured[0] == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame == None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+            site = format_frame(pick_call_site(stack, self.root))
+            task = asyncio.current_task(self._loop)
+            if task != None:
+                lines = ['task: {} ({})'.format(task.get_name(), task.get_coro().__qualname__)]
+            else:
+                lines = ['task: <none>']
+            lines += ['  ' + format_frame(f) for f in stack]
+            self._captured = (beat, site, '\n'.join(lines))
+
+    def report(self, top_n=5):
+        """Summarise the call sites that stalled the loop the most, by total time"""
+        worst = sorted(self.offenders.values(), key=lambda o: o.total, reverse=True)
+        if len(worst) == 0:
+            return 'No event loop stalls over {}s'.format(self.threshold)
+        lines = ['Event loop stalls over {}s, worst first:'.format(self.threshold)]
+        for offender in worst[0:top_n]:
+            lines.append('  {}: {} stalls, {:.3f}s total, {:.3f}s worst'.format(
+                offender.site, offender.count, offender.total, offender.worst))
+            if offender.stack:
+                lines += ['    ' + line for line in offender.stack.split('\n')]
+        return '\n'.join(lines)
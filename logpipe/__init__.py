@@ -0,0 +1,142 @@
+"""Queue-backed logging, so that writing log lines never blocks the event loop
+
+Log calls only check the level and put the record on a queue; a background
+thread does all of the formatting (timestamps, message arguments, JSON) and the
+actual writing.
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+import pytz
+
+
+# Root logger for the bot; other modules log to children of it (e.g. 'chronicler.db')
+LOGGER = logging.getLogger('chronicler')
+
+# Background thread that drains the queue, once set up
+LISTENER = None
+
+
+class BraceMessage:
+    """Log message in str.format() style, only formatted when written out"""
+    __slots__ = ('fmt', 'args')
+
+    def __init__(self, fmt, args):
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self):
+        return self.fmt.format(*self.args) if self.args else self.fmt
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock handler formats the message before queueing it, which would put
+    the cost right back on the caller.
+    """
+    def prepare(self, record):
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """`[timestamp] message` lines, with the timestamp in a fixed timezone"""
+    def __init__(self, tz):
+        super().__init__()
+        self.tz = tz
+
+    def formatTime(self, record, datefmt=None):
+        ct = datetime.datetime.fromtimestamp(record.created, self.tz)
+        return ct.strftime('%Y/%m/%d %H:%M:%S')
+
+    def format(self, record):
+        msg = record.getMessage()
+        if record.levelno >= logging.WARNING:
+            # Keep any indentation in front of the level, i.e. `  ERROR: ...`
+            stripped = msg.lstrip(' ')
+            msg = '{}{}: {}'.format(msg[0:len(msg)-len(stripped)], record.levelname, stripped)
+        line = '[{}] {}'.format(self.formatTime(record), msg)
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class JSONFormatter(TextFormatter):
+    """One JSON object per line, for log shippers"""
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, self.tz).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def _no_caller(stack_info=False, stacklevel=1):
+    # What logging records when it can't find the caller
+    return '(unknown file)', 0, '(unknown function)', None
+
+def setup(level='INFO', json_output=False, path=None, tz='US/Pacific'):
+    """Route the bot's logging through a queue to a background writer thread
+
+    Parameters
+    ==========
+    level : str
+        Lowest level of message to log (DEBUG, INFO, WARNING, ...).
+    json_output : bool
+        True to write JSON lines instead of plain text.
+    path : str
+        File to append logs to. If None, logs go to stdout.
+    tz : str
+        Timezone for timestamps, looked up once here instead of on every line.
+    """
+    global LISTENER
+    if LISTENER != None:
+        return
+    # Skip looking up the caller of each record (a stack walk), since it's
+    # never printed. Only for the bot's own logger: other libraries' loggers
+    # are left as they are
+    LOGGER.findCaller = _no_caller
+
+    if path != None:
+        out = logging.FileHandler(path, encoding='utf-8')
+    else:
+        out = logging.StreamHandler(sys.stdout)
+    tzinfo = pytz.timezone(tz)
+    out.setFormatter(JSONFormatter(tzinfo) if json_output else TextFormatter(tzinfo))
+
+    log_queue = queue.SimpleQueue()
+    LOGGER.setLevel(level)
+    LOGGER.addHandler(DeferredQueueHandler(log_queue))
+    LOGGER.propagate = False
+
+    LISTENER = logging.handlers.QueueListener(log_queue, out)
+    LISTENER.start()
+    # Make sure everything queued up gets written before exiting
+    atexit.register(stop)
+
+def stop():
+    """Write out anything still queued, and stop the writer thread"""
+    global LISTENER
+    if LISTENER != None:
+        LISTENER.stop()
+        LISTENER = None
+
+def log(msg, *args, level=logging.INFO):
+    """Log a message, with str.format() style arguments
+
+    The arguments are only formatted in (by the writer thread) if the level is
+    enabled, so expensive messages should be passed this way instead of being
+    formatted up front.
+    """
+    if LOGGER.isEnabledFor(level):
+        LOGGER.log(level, BraceMessage(msg, args))
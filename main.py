@@ -16,14 +16,32 @@ __author__ = 'edgykuma'
 __license__ = 'MIT'
 
 import datetime
+import logging
 import pytz
 import random
 import asyncio
+import contextlib
+import functools
+import gzip
+import io
+import json
+import math
+import signal
+import tempfile
+import time
 from time import sleep
 
+import aiohttp
 import discord
 
-import dbhelper as db
+import admission
+import guildsettings
+import logpipe
+import metrics
+import qcache
+import scheduler
+import storage
+from logpipe import log
 
 
 ################################################################################
@@ -63,6 +81,8 @@ BOT_STATUSES = [
     'Eekum Bokum'
 ]
 
+# The next few are defaults: each server can change them with `$settings`
+
 # Percent chance that the bot rerolls its status
 STATUS_RR_CHANCE = 1
 
@@ -74,18 +94,136 @@ REPEAT_BUF_SIZE = 25
 
 # Number of quotes to display per page for `$quotes` command
 MAX_QUOTES_PER_PAGE = 5
-# Number of characters for a quoted message preview
-MESSAGE_PREVIEW_LEN = 80
 # Time in seconds for quotes list react timeout
 QUOTES_REACT_TIMEOUT = 60
 
+# Number of characters for a quoted message preview
+MESSAGE_PREVIEW_LEN = 80
+
+# Maximum number of ranked results returned by `$quotesearch`
+SEARCH_MAX_RESULTS = 50
+
+# Most quote lists (e.g. one per `$rquote @user` target) to keep in memory, so
+# repeated commands don't rerun the same query. A guild's lists are dropped
+# whenever one of its quotes is saved or removed. 0 disables the cache
+QUOTE_CACHE_MAX_LISTS = 256
+# Most quotes to keep in memory across all cached lists (each takes ~250 bytes)
+QUOTE_CACHE_MAX_ROWS = 200000
+# Time in seconds a cached list is used for at most (e.g. in case another
+# process writes to the same DB), None for no limit
+QUOTE_CACHE_TTL = 600
+
+# Number of entries to show on each `$quotestats` leaderboard
+STATS_TOP_N = 5
+
+# Hour of the day (in TIMEZONE) to start posting the quote of the day, in the
+# channels picked with `$qotd here`
+QOTD_HOUR = 9
+# Time in seconds to spread the day's posts over, so they don't all hit the
+# Discord API at once
+QOTD_WINDOW = 3600
+# Most quote of the day posts to start per second, and to have going at once
+QOTD_MAX_RATE = 5
+QOTD_CONCURRENCY = 10
+# Number of guilds to pick quotes of the day for per DB query
+QOTD_BATCH_SIZE = 200
+
+# How quickly commands can be sent, as (commands per second, burst): each user,
+# each channel and each server gets its own allowance, and a command is turned
+# away if any of them is used up. None disables that one
+COOLDOWN_USER = (0.5, 5)
+COOLDOWN_CHANNEL = (1, 10)
+COOLDOWN_GUILD = (5, 30)
+# Most `$quotesearch`/`$quotestats` commands, and quote exports/imports, to
+# run at once across all servers; past that, they're turned away with a notice
+MAX_HEAVY_COMMANDS = 4
+MAX_TRANSFERS = 2
+# Most quote list menus one user, and everyone, can have open at once. Lists
+# past that are shown as a single page that can't be paged through
+MAX_MENUS_PER_USER = 2
+MAX_MENUS = 200
+# Most pending `$remindme` reminders per user, and in total
+MAX_REMINDERS_PER_USER = 25
+MAX_REMINDERS = 10000
+# Number of reminders to show per page of `$remindme list`
+REMINDERS_PER_PAGE = 10
+# Set to False to never turn commands away (e.g. for benchmarks)
+ADMISSION_CONTROL = True
+
+# Port to serve Prometheus-style metrics on (localhost only), None to disable
+METRICS_PORT = None
+# File to periodically dump the same metrics to, None to disable
+METRICS_DUMP_FILE = None
+# Time in seconds between metrics dumps
+METRICS_DUMP_INTERVAL = 60
+
+# Set to True to watch for the event loop getting blocked (e.g. by DB calls)
+LAG_MONITOR = False
+# Loop lag in seconds that counts as the loop being blocked
+LAG_THRESHOLD = 0.1
+# Time in seconds between logging the worst blocking call sites
+LAG_REPORT_INTERVAL = 600
+
+# User IDs allowed to use `$debug` (e.g. to profile the live bot), None for the
+# owner (or team members) of the bot's Discord application
+DEBUG_USER_IDS = None
+# Default and longest time in seconds a `$debug profile` can run for
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 120
+# Time in seconds between the profiler's samples of the event loop
+PROFILE_INTERVAL = 0.005
+# Number of functions to list in each table of a profile's summary
+PROFILE_TOP_N = 25
+
+# Lowest level of log message to print (DEBUG also logs quoted message contents)
+LOG_LEVEL = 'INFO'
+# Set to True to log JSON lines instead of plain text
+LOG_JSON = False
+# File to write logs to, None to print them
+LOG_FILE = None
+
+# File to record handled events to (scrubbed), for replaying with
+# bench/replay.py; None to disable
+RECORD_EVENTS_FILE = None
+
+# Number of rows to pull from the DB at a time when exporting quotes
+EXPORT_CHUNK_SIZE = 1000
+# Number of rows to insert per transaction when importing quotes
+IMPORT_BATCH_SIZE = 1000
+
+# Where to keep quotes, reminders and stats: 'mysql' for a MySQL server, or
+# 'sqlite' for a file next to the bot (no server needed)
+DB_BACKEND = 'mysql'
+# MySQL server to use. If None, the user is "chronicler", the DB is "chrondb"
+# (both with "_DBG" in debug mode), and the password is the bot's token
+DB_HOST = 'localhost'
+DB_USER = None
+DB_PASSWORD = None
+DB_NAME = None
+# SQLite file to use
+SQLITE_PATH = 'chronicler.db'
+
+# Time in seconds between checks for settings changed by another process using
+# the same DB, None to never check
+SETTINGS_REFRESH_INTERVAL = 60
+
+# Time in seconds that commands, reactions and reminders already underway get
+# to finish when the bot is stopped (e.g. with SIGTERM), before they're dropped
+SHUTDOWN_TIMEOUT = 20
+
 
 ################################################################################
 # Globals used by bot, DO NOT EDIT!
 ################################################################################
 
-# Name of the quotes table
-QUOTES_TABLE = 'quotes_DBG' if BOT_DEBUGMODE else 'quotes'
+# Timezone that quote timestamps are shown in
+TIMEZONE = pytz.timezone('US/Pacific')
+
+# Suffix on the names of the bot's tables
+TABLE_SUFFIX = '_DBG' if BOT_DEBUGMODE else ''
+
+# Columns of a quote, in the order they are exported/imported
+QUOTE_FIELDS = storage.QUOTE_FIELDS
 
 # Strings of all the supported commands
 BOT_COMMAND_NAMES = [
@@ -93,20 +231,119 @@ BOT_COMMAND_NAMES = [
     '`$quotes`',
     '`$quote`',
     '`$rquote`',
-    '`$remindme`'
+    '`$quotesearch`',
+    '`$quotestats`',
+    '`$remindme`',
+    '`$qotd`',
+    '`$settings`'
 ]
 
-# (Revolving) list of messages to not repeat
-REPEAT_BUF = []
+# First words of the messages that count as commands, for the cooldowns
+COMMAND_WORDS = {name.strip('`') for name in BOT_COMMAND_NAMES} | {'$hello', '$debug'}
+
+# (Revolving) lists of messages to not repeat, by guild
+REPEAT_BUFS = {}
+
+# What each server can change with `$settings`, and what they changed it to
+SETTINGS = guildsettings.GuildSettings([
+    guildsettings.Setting('cross_channel', ALLOW_XCHAN,
+        'Whether `$rquote` and `$quotes` pick from every channel, or only the one they are sent in'),
+    guildsettings.Setting('page_size', MAX_QUOTES_PER_PAGE,
+        'Number of quotes on each page of `$quotes`', 1, 20),
+    guildsettings.Setting('menu_timeout', QUOTES_REACT_TIMEOUT,
+        'Seconds a `$quotes` list can be paged through', 10, 600),
+    guildsettings.Setting('repeat_buffer', REPEAT_BUF_SIZE,
+        'Number of recent `$rquote` picks that won\'t be picked again', 0, 100),
+    guildsettings.Setting('status_chance', STATUS_RR_CHANCE,
+        'Percent chance of a message changing the bot\'s status', 0, 100)
+])
 
 # Bot's private token, to be read from the .token file (DO NOT PUT IN REPO)
 TOKEN = ''
 
-# Global instance of the bot's Discord client
-CLIENT = None
 
-# Connection to the bot's MySQL DB
-CONN = None
+# The bot's storage backend (see DB_BACKEND)
+STORE = None
+
+# Done once the bot starts shutting down (None until the App starts)
+SHUTDOWN = None
+
+# Quote lists that were already selected, by guild
+QUOTE_CACHE = qcache.ResultCache('quotes', QUOTE_CACHE_MAX_LISTS, QUOTE_CACHE_MAX_ROWS,
+        QUOTE_CACHE_TTL)
+
+# Pending `$remindme` reminders by ID, all waited on by a single timer
+REMINDERS = scheduler.Scheduler(lambda key, reminder: reminder_due(reminder))
+# Work that shutdown waits for (event handlers, reminders and quotes of the day
+# being sent), by task; also keeps a reference to the tasks until they finish
+IN_FLIGHT = {}
+# Whether the reminders saved by a previous run were picked back up
+REMINDERS_LOADED = False
+
+# Pending reminders by user ID, for MAX_REMINDERS_PER_USER
+USER_REMINDERS = {}
+
+# Command allowances (see COOLDOWN_*), as (what they're per, Cooldown)
+COOLDOWNS = [(scope, admission.Cooldown(*limit)) for scope, limit in (
+    ('user', COOLDOWN_USER), ('channel', COOLDOWN_CHANNEL), ('guild', COOLDOWN_GUILD))
+    if limit != None]
+# At most one "slow down"/"busy" notice per channel every 10 seconds, so that
+# turning commands away stays cheap however fast they come in
+NOTICE_COOLDOWN = admission.Cooldown(0.1, 1)
+# Expensive commands running, and quote list menus open (by user ID)
+HEAVY_SLOTS = admission.Slots(MAX_HEAVY_COMMANDS)
+TRANSFER_SLOTS = admission.Slots(MAX_TRANSFERS)
+MENU_SLOTS = admission.Slots(MAX_MENUS, per_key=MAX_MENUS_PER_USER)
+
+# The quote of the day loop, once started
+QOTD_TASK = None
+
+# Whether settings are being refreshed from the DB
+SETTINGS_REFRESHING = False
+
+# Whether the metrics exporters were started (on_ready can fire again on reconnect)
+METRICS_STARTED = False
+
+# Event loop lag monitor, if LAG_MONITOR is enabled
+LAG = None
+
+# IDs of the bot application's owners, once looked up (for $debug)
+OWNER_IDS = None
+
+# Whether a $debug profile is running
+PROFILING = False
+
+# Event recorder, if RECORD_EVENTS_FILE is set
+RECORDER = None
+
+# Metrics for the hot paths
+COMMAND_SECONDS = metrics.histogram('chronicler_command_seconds',
+        'Time spent handling a command (for paginated lists, until the menu closes)',
+        ('command',))
+COMMANDS_IN_FLIGHT = metrics.gauge('chronicler_commands_in_flight',
+        'Commands currently being handled', ('command',))
+QUOTE_PAGE_SECONDS = metrics.histogram('chronicler_quote_page_seconds',
+        'Time spent rendering one page of a quotes list')
+PAGINATORS_OPEN = metrics.gauge('chronicler_paginators_open',
+        'Quote list menus still waiting for reactions')
+REMINDERS_PENDING = metrics.gauge('chronicler_reminders_pending',
+        'Reminders waiting to be sent')
+REST_SECONDS = metrics.histogram('chronicler_rest_seconds',
+        'Time spent in Discord API calls', ('call',))
+REACTION_SECONDS = metrics.histogram('chronicler_reaction_seconds',
+        'Time spent handling a quote/unquote reaction')
+REACTIONS_IN_FLIGHT = metrics.gauge('chronicler_reactions_in_flight',
+        'Quote/unquote reactions currently being handled')
+REACTIONS_TOTAL = metrics.counter('chronicler_reactions_total',
+        'Quote/unquote reactions handled', ('action',))
+QOTD_POSTS = metrics.counter('chronicler_qotd_posts_total',
+        'Quote of the day deliveries, by how they went', ('result',))
+COMMANDS_REJECTED = metrics.counter('chronicler_commands_rejected_total',
+        'Commands turned away (or lists shown without paging) by the cooldowns and limits',
+        ('command', 'reason'))
+STARTUP_SECONDS = metrics.gauge('chronicler_startup_seconds',
+        'Time taken by each part of the last startup (storage overlaps login/gateway)',
+        ('phase',))
 
 
 
@@ -114,57 +351,244 @@ CONN = None
 # Initialization
 ################################################################################
 
-# Attempt to open and read the bot's .token file
-try:
-    token_file = open('.token', 'r')
-    TOKEN = token_file.read().strip()
-    token_file.close()
-    if len(TOKEN) < 1:
-        print('ERROR: .token file appears to be empty.')
-        exit(1)
-except FileNotFoundError:
-    print('ERROR: Unable to read a .token file. Please make sure it exists.')
-    exit(1)
-
-# Create new instance of Discord client
+# Create new instance of Discord client (no connection is made until it is run)
 CLIENT = discord.Client()
-# Create connection to Chronicler's MySQL DB
-if BOT_DEBUGMODE:
-    CONN = db.create_srv_conn('localhost', 'chronicler_DBG', TOKEN, 'chrondb_DBG')
-else:
-    CONN = db.create_srv_conn('localhost', 'chronicler', TOKEN, 'chrondb')
-if CONN == None:
-    print('ERROR: Unable to connect to DB.')
-    exit(1)
-
-# Try to create the 'quotes' table--ignore the error if it exists
-# TODO: a more elegant way to check if table exists in SQL?
-table_cols = """
-    author_id BIGINT NOT NULL,
-    quoter_id BIGINT,
-    message_id BIGINT PRIMARY KEY,
-    guild_id BIGINT NOT NULL,
-    channel_id BIGINT NOT NULL
-"""
-db.create_table(CONN, QUOTES_TABLE, table_cols)
 
+def make_store():
+    """Create (but don't open) the storage backend picked by DB_BACKEND"""
+    if DB_BACKEND == 'sqlite':
+        return storage.open_storage('sqlite', path=SQLITE_PATH, suffix=TABLE_SUFFIX)
+    user = DB_USER if DB_USER != None else 'chronicler' + TABLE_SUFFIX
+    password = DB_PASSWORD if DB_PASSWORD != None else TOKEN
+    database = DB_NAME if DB_NAME != None else 'chrondb' + TABLE_SUFFIX
+    return storage.open_storage('mysql', host=DB_HOST, user=user, password=password,
+            database=database, suffix=TABLE_SUFFIX)
 
-################################################################################
-# Misc helper functions
-################################################################################
+def read_token():
+    """Read the bot's token from the .token file
 
-def log(msg):
-    """Helpful log printing, with timestamp (in PST)
+    Returns
+    =======
+    str
+        The token, or None if it couldn't be read.
+    """
+    try:
+        token_file = open('.token', 'r')
+        token = token_file.read().strip()
+        token_file.close()
+    except FileNotFoundError:
+        log('Unable to read a .token file. Please make sure it exists.', level=logging.ERROR)
+        return None
+    if len(token) < 1:
+        log('.token file appears to be empty.', level=logging.ERROR)
+        return None
+    return token
+
+
+class App:
+    """Starts and stops the bot, and everything it depends on
+
+    Nothing is read, opened or connected to until start(), so the bot's code
+    can be imported (e.g. by the benchmarks in bench/) without a token or a DB.
+    Opening the DB (connecting, checking the schema) is the slow part of a cold
+    start, so it runs alongside logging in to Discord rather than before it.
+    Events that arrive before the DB is open wait for it (see wait_for_store()).
+
+    Stopping (on SIGTERM/SIGINT) first stops taking new events and closes open
+    menus, then gives the work already underway SHUTDOWN_TIMEOUT seconds to
+    finish, before disconnecting and closing the DB. Pending reminders are
+    already saved, so they're left for the next start.
 
-    Parameters
+    Attributes
     ==========
-    msg : str
-        Message to print with timestamp.
+    client : discord.Client
+        The client to run.
+    store_opened : asyncio.Future
+        Done once STORE is open.
+    phases : dict
+        Time in seconds taken by each part of startup.
+
+    Methods
+    =======
+    start()
+        Open the DB and log in together, then stay connected until closed.
+    stop()
+        Finish what's underway, then disconnect and close the DB.
+    run()
+        Blocking entry point: start(), then stop() once closed or signalled.
+    report_startup()
+        Log and export how long startup took, once the bot is ready.
     """
-    ct = datetime.datetime.now()
-    ct_pst = ct.astimezone(pytz.timezone('US/Pacific'))
-    cts = ct_pst.strftime("%Y/%m/%d %H:%M:%S")
-    print("[{}] {}".format(cts, msg))
+    def __init__(self, client):
+        self.client = client
+        self.store_opened = None
+        self.phases = {}
+        self.failed = False
+        self._started = None
+        self._gateway_start = None
+        self._reported = False
+        self._stopping = None
+
+    async def _open_store(self):
+        global STORE
+        start = time.perf_counter()
+        store = make_store()
+        opened = False
+        try:
+            opened = await store.open()
+            if not opened:
+                log('Unable to connect to DB.', level=logging.ERROR)
+            else:
+                # Commands need the settings, so they count as part of opening the store
+                await SETTINGS.load(store)
+        except Exception as err:
+            log('Unable to open DB: {!r}', err, level=logging.ERROR)
+            if opened:
+                # Don't leave its connection and threads running
+                try:
+                    await store.close()
+                except Exception as err:
+                    log('Unable to close DB: {!r}', err, level=logging.ERROR)
+            opened = False
+        if not opened:
+            # Disconnect, or every event would wait for the store forever
+            self.failed = True
+            await self.client.close()
+            return
+        STORE = store
+        self.phases['storage'] = time.perf_counter() - start
+        self.store_opened.set_result(None)
+
+    async def start(self):
+        global TOKEN, RECORDER, SHUTDOWN
+        self._started = time.perf_counter()
+        SHUTDOWN = asyncio.get_event_loop().create_future()
+        # Start up logging first, so everything below can use it
+        logpipe.setup(LOG_LEVEL, LOG_JSON, LOG_FILE)
+
+        TOKEN = read_token()
+        if TOKEN == None:
+            self.failed = True
+            return
+
+        if RECORD_EVENTS_FILE != None:
+            # Only needed when recording, so not imported otherwise
+            import eventlog
+            RECORDER = eventlog.Recorder(RECORD_EVENTS_FILE)
+            log('Recording events to {}', RECORD_EVENTS_FILE)
+
+        self.store_opened = asyncio.get_event_loop().create_future()
+        opening = asyncio.ensure_future(self._open_store())
+        login_start = time.perf_counter()
+        try:
+            await self.client.login(TOKEN)
+        except discord.LoginFailure:
+            log('Unable to log in, check the token in .token.', level=logging.ERROR)
+            self.failed = True
+            opening.cancel()
+            return
+        self.phases['login'] = time.perf_counter() - login_start
+        self._gateway_start = time.perf_counter()
+        await self.client.connect()
+        await opening
+
+    async def stop(self):
+        # Can be called again (e.g. by run() after a signal already stopped
+        # the bot), but only shuts down once
+        if self._stopping == None:
+            self._stopping = asyncio.ensure_future(self._shutdown())
+        await self._stopping
+
+    async def _shutdown(self):
+        start = time.perf_counter()
+        # Stop taking new events, and close open menus
+        if SHUTDOWN != None and not SHUTDOWN.done():
+            SHUTDOWN.set_result(None)
+        # Reminders that come due from here on are sent on the next start
+        REMINDERS.stop()
+        if QOTD_TASK != None:
+            QOTD_TASK.cancel()
+
+        dropped = {}
+        tasks = list(IN_FLIGHT)
+        finished = len(tasks)
+        if len(tasks) > 0:
+            log('Waiting up to {}s for {} tasks to finish...', SHUTDOWN_TIMEOUT, len(tasks))
+            _, pending = await asyncio.wait(tasks, timeout=SHUTDOWN_TIMEOUT)
+            finished -= len(pending)
+            for task in pending:
+                kind = IN_FLIGHT.get(task, 'task')
+                dropped[kind] = dropped.get(kind, 0) + 1
+                task.cancel()
+            if len(pending) > 0:
+                await asyncio.wait(pending, timeout=1)
+
+        if not self.client.is_closed():
+            await self.client.close()
+        # Writes that were queued still get committed
+        if STORE != None:
+            await STORE.close()
+        if RECORDER != None:
+            RECORDER.close()
+        if METRICS_DUMP_FILE != None:
+            await metrics.dump(METRICS_DUMP_FILE)
+
+        # Reminders that couldn't be saved only ever existed in memory
+        unsaved = sum(1 for reminder in REMINDERS.items() if reminder[0] == None)
+        if unsaved > 0:
+            dropped['unsaved reminder'] = unsaved
+        log('Shut down in {:.2f}s: {} tasks finished, {} reminders left for the next start, dropped {}',
+            time.perf_counter() - start, finished, len(REMINDERS) - unsaved, ', '.join('{} {}'.format(count, kind)
+                for kind, count in dropped.items()) or 'nothing',
+            level=logging.WARNING if len(dropped) > 0 else logging.INFO)
+
+    def _on_signal(self, signum):
+        log('Got {}, shutting down...', signal.Signals(signum).name)
+        asyncio.ensure_future(self.stop())
+
+    def run(self):
+        loop = self.client.loop
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self._on_signal, signum)
+            except NotImplementedError:
+                # e.g. on Windows, where Ctrl+C still raises KeyboardInterrupt
+                pass
+        try:
+            loop.run_until_complete(self.start())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.stop())
+            # Background loops (quote of the day, settings refresh...) are all
+            # that's left, and they can just stop
+            leftover = [task for task in asyncio.all_tasks(loop) if not task.done()]
+            for task in leftover:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*leftover, return_exceptions=True))
+            logpipe.stop()
+        if self.failed:
+            exit(1)
+
+    def report_startup(self):
+        if self._reported or self._gateway_start == None:
+            return
+        self._reported = True
+        self.phases['gateway'] = time.perf_counter() - self._gateway_start
+        self.phases['total'] = time.perf_counter() - self._started
+        for phase, seconds in self.phases.items():
+            STARTUP_SECONDS.set(seconds, phase=phase)
+        log('Started up in {:.2f}s ({})', self.phases['total'], ', '.join(
+            '{} {:.2f}s'.format(phase, seconds) for phase, seconds in self.phases.items()
+            if phase != 'total'))
+
+# Set when run as a script
+APP = None
+
+
+################################################################################
+# Misc helper functions
+################################################################################
 
 def startswith_word(phrase, startswith):
     """Check if a string starts with a word
@@ -192,25 +616,159 @@ async def set_rand_status():
             name=random.choice(BOT_STATUSES))
     await CLIENT.change_presence(activity=activity)
 
-async def roll_rand_status():
+async def roll_rand_status(guild_id):
     """Roll for a chance to set the bot's status to a random one
 
     Will be used to periodically change statuses.
 
     TODO: Might adversely affect performance, investigate at some point.
+
+    Parameters
+    ==========
+    guild_id : int
+        ID of the guild whose chance to use (None for the default).
     """
     num = random.randint(1, 100)
-    if (num <= STATUS_RR_CHANCE):
+    if (num <= SETTINGS.get(guild_id, 'status_chance')):
         await set_rand_status()
 
-def reset_sql_conn():
-    log('Resetting DB connection...')
-    global CONN
-    db.close_srv_conn(CONN)
-    CONN = db.create_srv_conn('localhost', 'chronicler', TOKEN, 'chrondb')
+async def wait_for_store():
+    """Wait for the DB to finish opening, if the bot is still starting up"""
+    if STORE == None:
+        await APP.store_opened
+
+def shutting_down():
+    """Whether the bot is shutting down, and so shouldn't start anything new"""
+    return SHUTDOWN != None and SHUTDOWN.done()
 
-def add_to_repeat_buf(msg_id):
-    """Add a message ID to the repeat buffer, kicking out oldest ID if full
+def track_task(task, kind):
+    """Keep a task in IN_FLIGHT until it's done, so shutdown waits for it
+
+    Parameters
+    ==========
+    task : asyncio.Task
+        The task.
+    kind : str
+        What the task is doing, for reporting it if it gets dropped.
+    """
+    # Already tracked, e.g. a benchmark calling handlers in a loop from one task
+    if task in IN_FLIGHT:
+        return
+    IN_FLIGHT[task] = kind
+    task.add_done_callback(lambda t: IN_FLIGHT.pop(t, None))
+
+def draining(kind):
+    """Decorator for event handlers: ignore events once shutting down, and have
+    shutdown wait for the ones already being handled"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            if shutting_down():
+                return
+            track_task(asyncio.current_task(), kind)
+            return await handler(*args, **kwargs)
+        return wrapper
+    return decorator
+
+async def wait_for_reaction(check, timeout):
+    """Wait for a reaction to a menu, like CLIENT.wait_for('reaction_add')
+
+    Raises asyncio.TimeoutError on timeout like wait_for() does, but also as
+    soon as the bot starts shutting down, so open menus close (and clean up
+    their reactions) instead of holding up shutdown.
+    """
+    if SHUTDOWN == None:
+        return await CLIENT.wait_for('reaction_add', check=check, timeout=timeout)
+    waiter = asyncio.ensure_future(CLIENT.wait_for('reaction_add', check=check, timeout=timeout))
+    try:
+        await asyncio.wait([waiter, SHUTDOWN], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        closed = not waiter.done()
+        if closed:
+            waiter.cancel()
+    if closed:
+        raise asyncio.TimeoutError()
+    return waiter.result()
+
+async def send_notice(channel, text):
+    """Send a notice that a command was turned away, unless one was sent there just now"""
+    if NOTICE_COOLDOWN.wait(channel.id) > 0:
+        return
+    NOTICE_COOLDOWN.take(channel.id)
+    await channel.send(text)
+
+async def admit(message, command):
+    """Check a command against the cooldowns, using up its allowance if it's let through
+
+    Parameters
+    ==========
+    message : discord.Message
+        The message with the command.
+    command : str
+        The command, without the '$'.
+
+    Returns
+    =======
+    bool
+        True if the command should be handled.
+    """
+    if not ADMISSION_CONTROL:
+        return True
+    keys = {
+        'user': message.author.id,
+        'channel': message.channel.id,
+        'guild': message.guild.id if message.guild != None else None
+    }
+    wait, index = admission.take_all([(cooldown, keys[scope]) for scope, cooldown in COOLDOWNS])
+    if index == None:
+        return True
+    scope = COOLDOWNS[index][0]
+    COMMANDS_REJECTED.inc(command=command, reason='{}_cooldown'.format(scope))
+    log('  Turned away ${} from {} ({} cooldown)', command, message.author.name, scope)
+    await send_notice(message.channel, 'Slow down, {}! Try again in {}s.'.format(
+        message.author.mention, math.ceil(wait)))
+    return False
+
+async def take_slot(slots, message, command):
+    """Take one of slots for a command, or turn the command away if they're all in use
+
+    Parameters
+    ==========
+    slots : admission.Slots
+        The slots the command needs one of.
+    message : discord.Message
+        The message with the command.
+    command : str
+        The command, without the '$'.
+
+    Returns
+    =======
+    admission.Slot
+        The slot, to hold for as long as the command runs; None if the command
+        was turned away.
+    """
+    slot = slots.try_acquire(force=not ADMISSION_CONTROL)
+    if slot == None:
+        COMMANDS_REJECTED.inc(command=command, reason='busy')
+        log('  Turned away ${} from {} (busy)', command, message.author.name)
+        await send_notice(message.channel, 'I\'m a bit busy right now, {}! Try again in a moment.'.format(
+            message.author.mention))
+    return slot
+
+async def report_lag():
+    """Periodically log the call sites that blocked the event loop the most"""
+    reported = 0
+    while True:
+        await asyncio.sleep(LAG_REPORT_INTERVAL)
+        stalls = sum(offender.count for offender in LAG.offenders.values())
+        # Nothing new to say
+        if stalls == reported:
+            continue
+        reported = stalls
+        log(LAG.report())
+
+def add_to_repeat_buf(guild_id, msg_id):
+    """Add a message ID to a guild's repeat buffer, kicking out oldest ID if full
 
     The point of the repeat buffer is to prevent the bot from picking the same
     set of quotes. If a quote (identified by message ID) is in the buffer, then
@@ -218,15 +776,21 @@ def add_to_repeat_buf(msg_id):
 
     Parameters
     ==========
+    guild_id : int
+        The ID of the guild the message is from
     msg_id : int
         The ID of the message to add
     """
-    # Pop off front of buffer if full
-    if len(REPEAT_BUF) >= REPEAT_BUF_SIZE:
-        removed = REPEAT_BUF.pop(0)
-        log('  Removed {} from repeat buffer'.format(removed))
-    REPEAT_BUF.append(msg_id)
-    log('  Added {} to repeat buffer'.format(msg_id))
+    repeat_buf = REPEAT_BUFS.setdefault(guild_id, [])
+    # Pop off front of buffer if full (or if the guild made it smaller since)
+    size = SETTINGS.get(guild_id, 'repeat_buffer')
+    while len(repeat_buf) > 0 and len(repeat_buf) >= size:
+        removed = repeat_buf.pop(0)
+        log('  Removed {} from repeat buffer', removed, level=logging.DEBUG)
+    if size == 0:
+        return
+    repeat_buf.append(msg_id)
+    log('  Added {} to repeat buffer', msg_id, level=logging.DEBUG)
 
 def convert_index(index, total):
     """Flip an index to its reverse (i.e., make index 0 become the last index, and vice versa).
@@ -248,30 +812,43 @@ def convert_index(index, total):
 class Quote:
     """Class that tracks everything we need for a quote.
 
+    A Quote is either made from the Members and Message at hand (when a quote
+    is being saved or removed), or from a row out of the DB with from_row()
+    (when a quote is being shown). A Quote from the DB starts out as just IDs
+    and the stored text, and only makes API calls for the Discord objects that
+    are asked for, so e.g. a page of previews never fetches any messages.
+
     Attributes
     ==========
+    row : storage.QuoteRow
+        The quote's IDs and stored text (None for a Quote that isn't saved yet).
     author : discord.Member
-        The Member that wrote the quote.
+        The Member that wrote the quote (None until fetch_author()).
     quoter : discord.Member
-        The Member that saved the quote.
+        The Member that saved the quote (None for a Quote from the DB).
     message : discord.Message
-        The Message to quote.
-
-    Note: Could have performance issues since we pass around the entire Member
-    and Message objects, rather than the ID. However since this avoids future
-    API calls to match ID->object, this is probably fine.
+        The Message to quote (None until fetch_message()).
 
     Methods
     =======
+    from_row(row)
+        Make a Quote out of a row from the DB, without any API calls.
     save_to_db()
         Save a quote to the database.
     remove_from_db()
         Remove a quote from the database.
-    fill_from_entry(entry)
-        Takes an entry that was taken from the database, and makes the necessary
-        API calls to populate a Quote's attributes.
+    fetch_author(members)
+        Look up the Member that wrote the quote.
+    fetch_message()
+        Look up the quoted Message.
+    fetch_content()
+        The quote's text, using the stored copy if there is one.
+    fetch_channel_name()
+        The name of the channel the quote is from.
     """
-    def __init__(self, author=None, quoter=None, message=None):
+    __slots__ = ('row', 'author', 'quoter', 'message')
+
+    def __init__(self, author=None, quoter=None, message=None, row=None):
         """
         Parameters
         ==========
@@ -281,18 +858,33 @@ class Quote:
             The Member that saved the quote.
         message : discord.Message
             The Message to quote.
-
-        Note: We allow None for the attributes so a blank Quote can be made
-        with the intent to fill it out later.
+        row : storage.QuoteRow
+            The quote as stored in the DB.
         """
         self.author = author
         self.quoter = quoter
         self.message= message
+        self.row = row
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row=row)
+
+    @property
+    def jump_url(self):
+        """Link to the quoted message, built without fetching it"""
+        return 'https://discord.com/channels/{}/{}/{}'.format(
+            self.row.guild_id, self.row.channel_id, self.row.message_id)
+
+    @property
+    def created_at(self):
+        """When the quoted message was sent, read off of its ID"""
+        return discord.utils.snowflake_time(self.row.message_id)
 
     async def save_to_db(self):
         """Save a quote to the database"""
         if (self.author == None or self.quoter == None or self.message == None):
-            log('ERROR: Tried to call save_to_db() on a blank Quote')
+            log('Tried to call save_to_db() on a blank Quote', level=logging.ERROR)
             return
 
         author_id = self.author.id
@@ -303,13 +895,13 @@ class Quote:
         is_bot = self.author.bot
 
         # Debug logging
-        log('Member {} is trying to save a quote:'.format(self.quoter.name))
+        log('Member {} is trying to save a quote:', self.quoter.name)
         if is_bot:
             log('  Request denied: tried to save a bot quote')
         else:
-            log('  Author       :{}'.format(self.author.name))
-            log('  Channel      :#{}'.format(self.message.channel.name))
-            log('  Message      :{}'.format(self.message.content))
+            log('  Author       :{}', self.author.name, level=logging.DEBUG)
+            log('  Channel      :#{}', self.message.channel.name, level=logging.DEBUG)
+            log('  Message      :{}', self.message.content, level=logging.DEBUG)
 
         # Don't accept if the quote author is a bot
         if (is_bot):
@@ -318,14 +910,10 @@ class Quote:
                 'Sorry {}, I don\'t save quotes from non-humans!'.format(member_saver.nick))
             return
 
-        cols = 'author_id, quoter_id, message_id, guild_id, channel_id'
-        vals = '{}, {}, {}, {}, {}'.format(
-                author_id, quoter_id, message_id, guild_id, channel_id)
-        try:
-            db.insert_partial(CONN, QUOTES_TABLE, cols, vals)
-        except:
-            reset_sql_conn()
-            db.insert_partial(CONN, QUOTES_TABLE, cols, vals)
+        # Store the message text too, so that it can be searched
+        await STORE.save_quote((author_id, quoter_id, message_id, guild_id, channel_id,
+                self.message.content))
+        QUOTE_CACHE.bump(guild_id)
 
         # Acknowledge save with check mark emoji
         await self.message.clear_reaction(EMOJI_QUOTE)
@@ -334,59 +922,88 @@ class Quote:
     async def remove_from_db(self):
         """Remove a quote from the database"""
         if (self.author == None or self.quoter == None or self.message == None):
-            log('ERROR: Tried to call remove_from_db() on a blank Quote')
+            log('Tried to call remove_from_db() on a blank Quote', level=logging.ERROR)
             return
 
-        log('Member {} is trying to delete a quote:'.format(self.quoter.name))
-        log('  Author       :{}'.format(self.author.name))
-        log('  Channel      :#{}'.format(self.message.channel.name))
-        log('  Message      :{}'.format(self.message.content))
+        log('Member {} is trying to delete a quote:', self.quoter.name)
+        log('  Author       :{}', self.author.name, level=logging.DEBUG)
+        log('  Channel      :#{}', self.message.channel.name, level=logging.DEBUG)
+        log('  Message      :{}', self.message.content, level=logging.DEBUG)
 
-        try:
-            retval = db.delete(CONN, QUOTES_TABLE, 'message_id={}'.format(self.message.id))
-        except:
-            reset_sql_conn()
-            retval = db.delete(CONN, QUOTES_TABLE, 'message_id={}'.format(self.message.id))
-        if retval != 0:
-            log('  Error: Unable to delete message')
+        if not await STORE.remove_quote(self.message.id):
+            log('  Unable to delete message', level=logging.ERROR)
         else:
+            QUOTE_CACHE.bump(self.message.guild.id)
             # Acknowledge deletee with removing check mark emoji
             await self.message.clear_reaction(EMOJI_DELQUOTE)
             await self.message.clear_reaction(EMOJI_BOT_CONFIRM)
 
-    async def fill_from_entry(self, entry):
-        """Populate Quote attributes from a database entry
+    async def fetch_author(self, members=None):
+        """Look up the Member that wrote the quote, from the cache if possible
 
         Parameters
         ==========
-        entry : (int, int, int, int, int)
-            A tuple describing a quote's
-            (author_id, quoter_id, msg_id, guild_id, channel_id)
-            This is an entry that would be taken directly from the database.
+        members : dict
+            Members that were already looked up, by ID (e.g. for earlier pages
+            of a list). The author is taken from here if present, and added if not.
         """
-        # Assumes that entry is tuple of:
-        #   (author_id, quoter_id, message_id, guild_id, channel_id)
-        if len(entry) < 5:
-            log('ERROR: Tried to populate quote object with invalid entry')
-            return
-        author_id = int(entry[0])
-        quoter_id = int(entry[1])
-        msg_id = int(entry[2])
-        guild_id = int(entry[3])
-        channel_id = int(entry[4])
-
-        guild = await CLIENT.fetch_guild(guild_id)
-        channel = await CLIENT.fetch_channel(channel_id)
-        self.author = await guild.fetch_member(author_id)
-        self.quoter = await guild.fetch_member(quoter_id)
-        self.message = await channel.fetch_message(msg_id)
+        if self.author != None:
+            return self.author
+        author_id = self.row.author_id
+        if members != None and author_id in members:
+            self.author = members[author_id]
+            return self.author
+        guild = CLIENT.get_guild(self.row.guild_id)
+        if guild == None:
+            with REST_SECONDS.time(call='fetch_guild'):
+                guild = await CLIENT.fetch_guild(self.row.guild_id)
+        self.author = guild.get_member(author_id)
+        if self.author == None:
+            with REST_SECONDS.time(call='fetch_member'):
+                self.author = await guild.fetch_member(author_id)
+        if members != None:
+            members[author_id] = self.author
+        return self.author
+
+    async def _fetch_channel(self):
+        channel = CLIENT.get_channel(self.row.channel_id)
+        if channel == None:
+            with REST_SECONDS.time(call='fetch_channel'):
+                channel = await CLIENT.fetch_channel(self.row.channel_id)
+        return channel
+
+    async def fetch_message(self):
+        """Look up the quoted Message"""
+        if self.message != None:
+            return self.message
+        channel = await self._fetch_channel()
+        with REST_SECONDS.time(call='fetch_message'):
+            self.message = await channel.fetch_message(self.row.message_id)
+        # Quotes saved before search existed have no stored text, so index them
+        # now that we have the message on hand
+        if self.row.content == None:
+            await STORE.update_quote_content(self.row.message_id, self.message.content)
+        return self.message
+
+    async def fetch_content(self):
+        """The quote's text: the stored copy, or else the message's"""
+        if self.message != None:
+            return self.message.content
+        if self.row.content != None:
+            return self.row.content
+        return (await self.fetch_message()).content
+
+    async def fetch_channel_name(self):
+        if self.message != None:
+            return self.message.channel.name
+        return (await self._fetch_channel()).name
 
 
 ################################################################################
 # Main helper functions
 ################################################################################
 
-async def repeat_quote(channel, quote):
+async def repeat_quote(channel, quote, title='Quotes from the Chronicler!'):
     """Send a selected quote to a specific channel.
 
     Quotes are formatted with Discord's embed.
@@ -397,28 +1014,35 @@ async def repeat_quote(channel, quote):
         The channel that the bot should send the quote to.
     quote : Quote
         The quote that the bot should send.
+    title : str
+        Title of the embed.
     """
+    # Only the author needs an API call (and only if they aren't cached); the
+    # rest comes from the DB, the quote's IDs, or the channel cache
+    content = await quote.fetch_content()
+    author = await quote.fetch_author()
+    channel_name = await quote.fetch_channel_name()
+
     # Add a quote formatter (>) to start of each line
-    fmt_content = quote.message.content.replace('\n', '\n > ')
+    fmt_content = content.replace('\n', '\n > ')
     embed = discord.Embed(
-        title='Quotes from the Chronicler!',
+        title=title,
         color=discord.Color.red(),
         # Markdown-esque formatting, for a quote
         # User can click on quote to jump to it
         description='> {}'.format(fmt_content)
     )
     # But thumbnail should be avatar of the quote's author
-    embed.set_thumbnail(url=quote.author.avatar_url)
+    embed.set_thumbnail(url=author.avatar_url)
     # Clickable link to jump to message
     embed.add_field(name='View context...?', inline=False,
-        value='[{}]({})'.format('Click here to jump', quote.message.jump_url))
+        value='[{}]({})'.format('Click here to jump', quote.jump_url))
 
     # Construct footer
-    ctime = quote.message.created_at
-    ctime_pst = ctime.astimezone(pytz.timezone('US/Pacific'))
+    ctime = quote.created_at
+    ctime_pst = ctime.astimezone(TIMEZONE)
     ctime_str = ctime_pst.strftime('%b %-d, %Y at %H:%M (%Z)')
-    footer = 'posted in #{} by {} on {}'.format(
-        quote.message.channel.name, quote.author.nick, ctime_str)
+    footer = 'posted in #{} by {} on {}'.format(channel_name, author.nick, ctime_str)
     embed.set_footer(text=footer)
 
     await channel.send(embed=embed)
@@ -453,10 +1077,19 @@ async def rquote_help(channel):
         value='`$quotes` to list all quotes saved by the bot')
     embed.add_field(name='Listing all quotes from a user', inline=False,
         value='`$quotes @user` to list all quotes saved by the bot, made by `user`')
+    embed.add_field(name='Searching quotes', inline=False,
+        value='`$quotesearch <words>` to list the quotes that best match `words`')
+    embed.add_field(name='Quote leaderboards', inline=False,
+        value='`$quotestats` to see who is quoted (and who quotes) the most')
+    embed.add_field(name='Backing up quotes', inline=False,
+        value='`$quotes export` to download all of this server\'s quotes as a file')
+    embed.add_field(name='Restoring quotes', inline=False,
+        value='`$quotes import` with an exported file attached (requires **Manage Server**)')
     embed.set_footer(text='Run `$quote help` to display this message again')
 
     await channel.send(embed=embed)
 
+@metrics.timed(COMMAND_SECONDS, COMMANDS_IN_FLIGHT, command='rquote')
 async def rquote(message):
     """Handle a user's request to use the $rquote command
 
@@ -465,7 +1098,7 @@ async def rquote(message):
     message : discord.Message
         User message that triggered the command.
     """
-    log('$rquote request from {}'.format(message.author.name))
+    log('$rquote request from {}', message.author.name)
 
     # Asking for help will override any tokens
     if 'help' in message.content.split():
@@ -476,7 +1109,7 @@ async def rquote(message):
     tagged_member = None
     mentions = message.mentions
     if len(mentions) > 1:
-        log('  ERROR: more than one user is tagged')
+        log('  More than one user is tagged', level=logging.ERROR)
         await message.delete()
         await message.channel.send(
             'You cannot tag more than one user for `$rquote`!')
@@ -484,23 +1117,12 @@ async def rquote(message):
     elif len(mentions) == 1:
         tagged_member = mentions[0]
 
+    author_id = tagged_member.id if tagged_member != None else None
     # Filter by channel ID, if cross-channel setting is disabled
-    if ALLOW_XCHAN:
-        if tagged_member != None:
-            where = 'author_id = {}'.format(tagged_member.id)
-        else:
-            where = None
-    else:
-        where = 'channel_id = {}'.format(message.channel.id)
-        if tagged_member != None:
-            where += ' AND author_id = {}'.format(tagged_member.id)
+    channel_id = None if SETTINGS.get(message.guild.id, 'cross_channel') else message.channel.id
 
     # Grab all results that match our criteria
-    try:
-        results = db.select(CONN, QUOTES_TABLE, '*', where)
-    except:
-        reset_sql_conn()
-        results = db.select(CONN, QUOTES_TABLE, '*', where)
+    results = await select_quotes(message.guild.id, author_id, channel_id)
     if len(results) == 0:
         log('  No quotes found.')
         await message.channel.send(
@@ -509,47 +1131,82 @@ async def rquote(message):
     # Pick a random quote from the bunch
     result = random.choice(results)
     # Reroll if the result is in the repeat buffer
+    #   Pick from the ones that aren't, or from all of them if there are none
+    #   (the results may be cached, so leave them as they are)
     #   Message ID is Index 2 of the results tuple
-    #   If there is only one result remaining, then pick that anyway
-    while (len(results) > 1 and result[2] in REPEAT_BUF):
-        results.remove(result)
-        result = random.choice(results)
+    repeat_buf = REPEAT_BUFS.get(message.guild.id, ())
+    if result[2] in repeat_buf:
+        fresh = [row for row in results if row[2] not in repeat_buf]
+        result = random.choice(fresh if len(fresh) > 0 else results)
     # If the final chosen one isn't in repeat buffer, then add it
-    if result[2] not in REPEAT_BUF:
-        add_to_repeat_buf(result[2])
-
-    quote = Quote()
-    await quote.fill_from_entry(result)
-    log('  Author       :{}'.format(quote.author.name))
-    log('  Channel      :#{}'.format(quote.message.channel.name))
-    log('  Message      :{}'.format(quote.message.content))
+    if result[2] not in repeat_buf:
+        add_to_repeat_buf(message.guild.id, result[2])
 
+    quote = (await quotes_from_rows([result]))[0]
     await repeat_quote(message.channel, quote)
+    log('  Author       :{}', quote.author.name, level=logging.DEBUG)
+    log('  Message      :{}', await quote.fetch_content(), level=logging.DEBUG)
+
+async def select_quotes(guild_id, author_id=None, channel_id=None, newest_first=False):
+    """All of a guild's quotes (without their text), optionally filtered
 
-async def list_quotes(invoke_message, quote_list, quote_index=-1):
+    Served from QUOTE_CACHE when the guild's quotes haven't changed since the
+    same list was last selected, so the rows are shared: don't modify them.
+
+    Returns
+    =======
+    tuple
+        The quotes, each a tuple in QUOTE_FIELDS order.
+    """
+    key = (author_id, channel_id, newest_first)
+    return await QUOTE_CACHE.get(guild_id, key,
+            lambda: STORE.select_quotes(guild_id, author_id, channel_id, newest_first))
+
+async def quotes_from_rows(rows):
+    """Make Quotes out of rows from the DB, loading the text of any selected without it
+
+    Only the rows passed in get made into QuoteRows, so a list of thousands of
+    quotes stays plain tuples until a page of it is shown.
+
+    Parameters
+    ==========
+    rows : [tuple]
+        The rows to make Quotes of (e.g. one page of a list), in QUOTE_FIELDS order.
+    """
+    rows = [storage.QuoteRow._make(row) for row in rows]
+    missing = [row.message_id for row in rows if row.content == None]
+    contents = await STORE.quote_contents(missing) if len(missing) > 0 else {}
+    return [Quote.from_row(row._replace(content=contents[row.message_id])
+        if contents.get(row.message_id) != None else row) for row in rows]
+
+async def list_quotes(invoke_message, quote_list, quote_index=-1, ranked=False):
     """List out the quotes provided in a list to the user, with interactible menu
 
     Parameters
     ==========
     invoke_message : discord.Message
         The invoking message.
-    quote_list : sql.results[]
-        List of SQL query results.
+    quote_list : [tuple]
+        The quotes to list, as rows from the DB (with or without their text).
     quote_index : int
         Specify one quote to repeat. If this is negative, then this function will only list the quotes.
+    ranked : bool
+        True if quote_list is ordered by relevance (i.e. search results), so
+        quotes are numbered by rank and link to the original message instead.
     """
     # Store length of list once so we don't have to do O(n) operation every time
     listlen = len(quote_list)
     if listlen < 1:
         return
+    page_size = SETTINGS.get(invoke_message.guild.id, 'page_size')
+    react_timeout = SETTINGS.get(invoke_message.guild.id, 'menu_timeout')
     # Number of pages for given list length
-    max_pages = listlen // MAX_QUOTES_PER_PAGE
+    max_pages = listlen // page_size
 
     # quote_index is indexed starting at 1, so need to -1 later
     if quote_index > 0 and quote_index <= listlen:
-        chosen_quote = Quote()
         chosen_index = convert_index(quote_index-1, listlen)
-        await chosen_quote.fill_from_entry(quote_list[chosen_index])
+        chosen_quote = (await quotes_from_rows([quote_list[chosen_index]]))[0]
         await repeat_quote(invoke_message.channel, chosen_quote)
         return
     elif quote_index == 0 or quote_index > listlen:
@@ -560,70 +1217,94 @@ async def list_quotes(invoke_message, quote_list, quote_index=-1):
 
     # We iterate backwards, as we want to display the most recent quotes first
     pageno      = 0
-    quote       = Quote()
-    log('    Formatting quote list embed...')
+    # Authors already looked up, so paging back and forth doesn't fetch them again
+    members     = {}
+    log('    Formatting quote list embed...', level=logging.DEBUG)
     # We only have to send the embed once, so use this bool to note that
     embed_sent = False
     sent_message = None
 
+    if ranked:
+        description = 'Quotes are listed from best to worst match. Click the link under a quote to view it in context.'
+    else:
+        description = 'View the whole quote with `$quote` command using the number of the quote (i.e. `$quote 3` for quote #3)\n\nIf a user is mentioned, don\'t forget to include that mention as well in `$quote` command.'
     embed = discord.Embed(
         title='Quotes from the Chronicler!',
         color=discord.Color.red(),
-        description='View the whole quote with `$quote` command using the number of the quote (i.e. `$quote 3` for quote #3)\n\nIf a user is mentioned, don\'t forget to include that mention as well in `$quote` command.'
+        description=description
     )
     footertext = 'Use the left/right emoji reactions to page through the list.\nPaging may be slow due to Discord API calls, so please be patient.'
 
+    # Past the menu limits, only the first page is shown, without paging
+    menu = MENU_SLOTS.try_acquire(invoke_message.author.id, force=not ADMISSION_CONTROL)
+    if menu == None:
+        COMMANDS_REJECTED.inc(command='quotesearch' if ranked else 'quotes', reason='menus')
+        footertext = 'Too many lists are open right now to page through this one.'
+
     # This function is to check if any user responds with left/right arrow emoji
     def check_reaction(reaction, user):
         return (not user.bot) and (reaction.emoji == EMOJI_LEFT or reaction.emoji == EMOJI_RIGHT) and reaction.message == sent_message
 
-    while True:
-        embed.set_footer(text='{}\n\nPage {} of {}'.format(footertext, pageno+1, max_pages+1))
-        start_idx   = min(pageno * MAX_QUOTES_PER_PAGE, listlen-1)
-        end_idx     = min((pageno+1) * MAX_QUOTES_PER_PAGE, listlen)
-        for i in range(start_idx, end_idx):
-            # fill_from_entry() calls API to retrieve message info, so should only call when we need the info
-            await quote.fill_from_entry(quote_list[i])
-            # Only take the first MESSAGE_PREVIEW_LEN characters
-            if len(quote.message.content) > MESSAGE_PREVIEW_LEN:
-                message = '> {}\n...'.format(discord.utils.escape_markdown(quote.message.content[0:MESSAGE_PREVIEW_LEN]))
-            else:
-                message = '> {}'.format(discord.utils.escape_markdown(quote.message.content))
-            # Replace newlines with spaces to clean output
-            message = message.replace('\n', ' ')
-            embed.add_field(inline=False, name='{}'.format(convert_index(i, listlen)+1), value='{}\n*by **{}***'.format(message, discord.utils.escape_markdown(quote.author.nick)))
-        if not embed_sent:
-            sent_message = await invoke_message.channel.send(embed=embed)
-            embed_sent = True
-        else:
-            await sent_message.edit(embed=embed)
-        await sent_message.add_reaction(EMOJI_LEFT)
-        await sent_message.add_reaction(EMOJI_RIGHT)
-        log('    Sent quotes list to #{}.'.format(invoke_message.channel.name))
-
-        try:
-            reaction, user = await CLIENT.wait_for('reaction_add', check=check_reaction, timeout=QUOTES_REACT_TIMEOUT)
-            if reaction.emoji == EMOJI_LEFT:
-                if pageno == 0:             # Wrap around to last page (lowest message IDs)
-                    pageno = max_pages
+    with menu if menu != None else contextlib.nullcontext(), PAGINATORS_OPEN.track():
+        while True:
+            page_start = time.perf_counter()
+            embed.set_footer(text='{}\n\nPage {} of {}'.format(footertext, pageno+1, max_pages+1))
+            start_idx   = min(pageno * page_size, listlen-1)
+            end_idx     = min((pageno+1) * page_size, listlen)
+            # Only this page's quotes get their text loaded, and only their
+            # authors are looked up (messages are never fetched for previews)
+            page = await quotes_from_rows(quote_list[start_idx:end_idx])
+            for i, quote in enumerate(page, start_idx):
+                content = await quote.fetch_content()
+                author = await quote.fetch_author(members)
+                # Only take the first MESSAGE_PREVIEW_LEN characters
+                if len(content) > MESSAGE_PREVIEW_LEN:
+                    message = '> {}\n...'.format(discord.utils.escape_markdown(content[0:MESSAGE_PREVIEW_LEN]))
                 else:
-                    pageno -= 1
-            elif reaction.emoji == EMOJI_RIGHT:
-                if pageno == max_pages:   # Wrap around to first page (highest message IDs)
-                    pageno = 0
+                    message = '> {}'.format(discord.utils.escape_markdown(content))
+                # Replace newlines with spaces to clean output
+                message = message.replace('\n', ' ')
+                if ranked:
+                    embed.add_field(inline=False, name='{}'.format(i+1), value='{}\n*by **{}*** - [jump]({})'.format(message, discord.utils.escape_markdown(author.nick), quote.jump_url))
                 else:
-                    pageno += 1
-            # Reset the embed
-            await sent_message.clear_reactions()
-            embed.clear_fields()
-            continue
-        except asyncio.TimeoutError:
-            #log('    User timed out.')
-            #message = 'Too slow to respond, {}!'.format(invoke_message.author.mention)
-            #await invoke_message.channel.send(message)
-            await sent_message.clear_reactions()
-            break
+                    embed.add_field(inline=False, name='{}'.format(convert_index(i, listlen)+1), value='{}\n*by **{}***'.format(message, discord.utils.escape_markdown(author.nick)))
+            if not embed_sent:
+                sent_message = await invoke_message.channel.send(embed=embed)
+                embed_sent = True
+            else:
+                await sent_message.edit(embed=embed)
+            if menu != None:
+                await sent_message.add_reaction(EMOJI_LEFT)
+                await sent_message.add_reaction(EMOJI_RIGHT)
+            QUOTE_PAGE_SECONDS.observe(time.perf_counter() - page_start)
+            log('    Sent quotes list to #{}.', invoke_message.channel.name, level=logging.DEBUG)
+            if menu == None:
+                break
+
+            try:
+                reaction, user = await wait_for_reaction(check_reaction, react_timeout)
+                if reaction.emoji == EMOJI_LEFT:
+                    if pageno == 0:             # Wrap around to last page (lowest message IDs)
+                        pageno = max_pages
+                    else:
+                        pageno -= 1
+                elif reaction.emoji == EMOJI_RIGHT:
+                    if pageno == max_pages:   # Wrap around to first page (highest message IDs)
+                        pageno = 0
+                    else:
+                        pageno += 1
+                # Reset the embed
+                await sent_message.clear_reactions()
+                embed.clear_fields()
+                continue
+            except asyncio.TimeoutError:
+                #log('    User timed out.')
+                #message = 'Too slow to respond, {}!'.format(invoke_message.author.mention)
+                #await invoke_message.channel.send(message)
+                await sent_message.clear_reactions()
+                break
 
+@metrics.timed(COMMAND_SECONDS, COMMANDS_IN_FLIGHT, command='quotes')
 async def quotes(message, pick_quote=False):
     """List all quotes saved by the bot
 
@@ -635,25 +1316,39 @@ async def quotes(message, pick_quote=False):
         True if the user is trying to pick a specific quote to repeat.
     """
     if pick_quote:
-        log('$quote request from {}'.format(message.author.name))
+        log('$quote request from {}', message.author.name)
     else:
-        log('$quotes request from {}'.format(message.author.name))
+        log('$quotes request from {}', message.author.name)
 
     # Asking for help will override any tokens
     if 'help' in message.content.split():
         await rquote_help(message.channel)
         return
 
+    # Exporting/importing the quote archive are subcommands of `$quotes`
+    if not pick_quote:
+        token_arr = message.content.split()
+        if len(token_arr) > 1 and token_arr[1] in ('export', 'import'):
+            slot = await take_slot(TRANSFER_SLOTS, message, 'quotes')
+            if slot == None:
+                return
+            with slot:
+                if token_arr[1] == 'export':
+                    await export_quotes(message)
+                else:
+                    await import_quotes(message)
+            return
+
     # If picking a quote, parse out the numerical token (choosing the first number we find)
     quotenum = -1
     if pick_quote:
         for word in message.content.split():
             if word.isnumeric():
                 quotenum = int(word)
-                log('    Choosing Quote #{}'.format(quotenum))
+                log('    Choosing Quote #{}', quotenum)
                 break
         if quotenum < 0:    # User didn't specify an argument
-            log('    ERROR: Did not specify number for $quote command')
+            log('    Did not specify number for $quote command', level=logging.ERROR)
             await message.channel.send('You must specify a valid, positive number for `$quote`, {}!'.format(message.author.mention))
             await message.delete()
             return
@@ -662,7 +1357,7 @@ async def quotes(message, pick_quote=False):
     tagged_member = None
     mentions = message.mentions
     if len(mentions) > 1:
-        log('  ERROR: more than one user is tagged')
+        log('  More than one user is tagged', level=logging.ERROR)
         await message.delete()
         await message.channel.send(
             'You cannot tag more than one user for `$rquote`!')
@@ -670,26 +1365,15 @@ async def quotes(message, pick_quote=False):
     elif len(mentions) == 1:
         tagged_member = mentions[0]
 
+    author_id = tagged_member.id if tagged_member != None else None
     # Filter by channel ID, if cross-channel setting is disabled
-    if ALLOW_XCHAN:
-        if tagged_member != None:
-            where = 'author_id = {}'.format(tagged_member.id)
-        else:
-            where = None
-    else:
-        where = 'channel_id = {}'.format(message.channel.id)
-        if tagged_member != None:
-            where += ' AND author_id = {}'.format(tagged_member.id)
+    channel_id = None if SETTINGS.get(message.guild.id, 'cross_channel') else message.channel.id
 
     # Grab all results that match our criteria
-    orderby = 'message_id'
     log('    Pulling list of quotes...')
-    try:
-        # Rely on discord message ID being sequential, and order with highest ID first
-        results = db.select(CONN, QUOTES_TABLE, '*', where, orderby, orderasc=False)
-    except:
-        reset_sql_conn()
-        results = db.select(CONN, QUOTES_TABLE, '*', where, orderby, orderasc=False)
+    # Rely on discord message ID being sequential, and order with highest ID first
+    results = await select_quotes(message.guild.id, author_id, channel_id,
+            newest_first=True)
     if len(results) == 0:
         log('  No quotes found.')
         await message.channel.send('No quotes found! Use `$quote help` for usage information.')
@@ -697,6 +1381,258 @@ async def quotes(message, pick_quote=False):
 
     await list_quotes(message, results, quote_index=quotenum)
 
+@metrics.timed(COMMAND_SECONDS, COMMANDS_IN_FLIGHT, command='quotesearch')
+async def quotesearch(message):
+    """Search a guild's quotes by their text
+
+    Matching is done by the storage backend's full-text index on the stored
+    quote text, and the best SEARCH_MAX_RESULTS matches are paged through with the quotes menu.
+
+    Parameters
+    ==========
+    message : discord.Message
+        User message that triggered the command.
+    """
+    log('$quotesearch request from {}', message.author.name)
+
+    token_arr = message.content.split()
+    # Asking for help will override any tokens
+    if len(token_arr) == 2 and token_arr[1] == 'help':
+        await rquote_help(message.channel)
+        return
+    if len(token_arr) < 2:
+        await message.channel.send('You must give some words to search for, {}!'.format(message.author.mention))
+        return
+    terms = ' '.join(token_arr[1:])
+    log('    Searching for: {}', terms, level=logging.DEBUG)
+
+    # Only the search itself holds a slot, not the menu that shows the results
+    slot = await take_slot(HEAVY_SLOTS, message, 'quotesearch')
+    if slot == None:
+        return
+    with slot:
+        results = await STORE.search_quotes(message.guild.id, terms, SEARCH_MAX_RESULTS)
+    if not results:
+        log('  No quotes found.')
+        await message.channel.send('No quotes found! Use `$quote help` for usage information.')
+        return
+
+    await list_quotes(message, results, ranked=True)
+
+async def rebuild_stats(guild_id):
+    """Recount a guild's counters from its quotes
+
+    Parameters
+    ==========
+    guild_id : int
+        Guild to recount.
+
+    Returns
+    =======
+    bool
+        True on success.
+    """
+    log('  Rebuilding stats for guild {}...', guild_id)
+    return await STORE.rebuild_stats(guild_id)
+
+@metrics.timed(COMMAND_SECONDS, COMMANDS_IN_FLIGHT, command='quotestats')
+async def quotestats(message):
+    """Show a guild's quote leaderboards
+
+    Everything is read from the stored counters, which are kept up to
+    date as quotes are saved and removed, so this never has to count quotes.
+
+    Parameters
+    ==========
+    message : discord.Message
+        User message that triggered the command.
+    """
+    log('$quotestats request from {}', message.author.name)
+
+    token_arr = message.content.split()
+    if 'help' in token_arr:
+        await rquote_help(message.channel)
+        return
+    slot = await take_slot(HEAVY_SLOTS, message, 'quotestats')
+    if slot == None:
+        return
+    with slot:
+        if len(token_arr) > 1 and token_arr[1] == 'rebuild':
+            if not message.author.guild_permissions.manage_guild:
+                await message.channel.send('You need the **Manage Server** permission to rebuild stats, {}!'.format(message.author.mention))
+                return
+            if not await rebuild_stats(message.guild.id):
+                await message.channel.send('Sorry, I couldn\'t rebuild the stats right now. Try again later!')
+                return
+            await message.add_reaction(EMOJI_BOT_CONFIRM)
+            return
+
+        total = await STORE.top_stats(message.guild.id, storage.STATS_TOTAL, 1)
+        if len(total) == 0:
+            log('  No quotes found.')
+            await message.channel.send('No quotes found! Use `$quote help` for usage information.')
+            return
+
+        embed = discord.Embed(
+            title='Quote stats from the Chronicler!',
+            color=discord.Color.red(),
+            description='**{}** quotes saved in this server'.format(total[0][1])
+        )
+        # Mentions render as names without needing any API calls
+        boards = [
+            ('Most quoted', storage.STATS_AUTHOR, '<@{}>'),
+            ('Top quoters', storage.STATS_QUOTER, '<@{}>'),
+            ('Most quoted channels', storage.STATS_CHANNEL, '<#{}>')
+        ]
+        for name, kind, mention in boards:
+            rows = await STORE.top_stats(message.guild.id, kind, STATS_TOP_N)
+            if len(rows) == 0:
+                continue
+            lines = ['{}. {} - {}'.format(i+1, mention.format(key_id), count)
+                for i, (key_id, count) in enumerate(rows)]
+            embed.add_field(name=name, inline=False, value='\n'.join(lines))
+        await message.channel.send(embed=embed)
+
+async def export_quotes(message):
+    """Send a guild's whole quote archive as a compressed NDJSON attachment
+
+    Rows are pulled in keyset chunks of EXPORT_CHUNK_SIZE (ordered by message
+    ID) and streamed straight into a gzipped temporary file, so memory use stays
+    constant no matter how many quotes the guild has.
+
+    Parameters
+    ==========
+    message : discord.Message
+        User message that triggered the command.
+    """
+    log('  Exporting quotes for guild {}...', message.guild.id)
+    exported = 0
+    last_id = 0
+    with tempfile.TemporaryFile() as tmp:
+        with gzip.GzipFile(fileobj=tmp, mode='wb') as gz:
+            while True:
+                rows = await STORE.quote_chunk(message.guild.id, last_id, EXPORT_CHUNK_SIZE)
+                if rows == None:
+                    log('  Export query failed', level=logging.ERROR)
+                    await message.channel.send('Sorry, I couldn\'t read the quotes right now. Try again later!')
+                    return
+                if len(rows) == 0:
+                    break
+                for row in rows:
+                    gz.write((json.dumps(dict(zip(QUOTE_FIELDS, row))) + '\n').encode('utf-8'))
+                exported += len(rows)
+                # Message ID is Index 2 of the results tuple
+                last_id = rows[-1][2]
+        log('  Exported {} quotes ({} bytes)', exported, tmp.tell())
+
+        if exported == 0:
+            await message.channel.send('No quotes found! Use `$quote help` for usage information.')
+            return
+        if tmp.tell() > message.guild.filesize_limit:
+            await message.channel.send('Sorry, the export is too large to upload here!')
+            return
+        tmp.seek(0)
+        filename = 'quotes-{}-{}.ndjson.gz'.format(
+                message.guild.id, datetime.date.today().isoformat())
+        await message.channel.send(
+                'Exported {} quotes, {}!'.format(exported, message.author.mention),
+                file=discord.File(tmp, filename=filename))
+
+async def import_quotes(message):
+    """Bulk-load quotes from an attached export file
+
+    The attachment is downloaded to a temporary file in chunks, then read back
+    line by line and inserted in transactions of IMPORT_BATCH_SIZE rows. Quotes
+    whose message ID already exists are skipped, as are quotes that belong to a
+    different guild.
+
+    Parameters
+    ==========
+    message : discord.Message
+        User message that triggered the command, with the export attached.
+    """
+    if not message.author.guild_permissions.manage_guild:
+        log('  {} lacks permission to import', message.author.name, level=logging.ERROR)
+        await message.channel.send('You need the **Manage Server** permission to import quotes, {}!'.format(message.author.mention))
+        return
+    if len(message.attachments) != 1:
+        await message.channel.send('Attach exactly one file from `$quotes export` to import, {}!'.format(message.author.mention))
+        return
+
+    attachment = message.attachments[0]
+    log('  Importing quotes from {} ({} bytes)...', attachment.filename, attachment.size)
+    imported = 0
+    skipped = 0
+    invalid = 0
+    failed = 0
+    batch = []
+
+    # Insert the pending batch in one transaction and tally up the results
+    async def flush_batch():
+        nonlocal imported, skipped, failed, batch
+        if len(batch) == 0:
+            return
+        inserted = await STORE.import_quotes(batch)
+        if inserted < 0:
+            failed += len(batch)
+        else:
+            if inserted > 0:
+                QUOTE_CACHE.bump(message.guild.id)
+            imported += inserted
+            skipped += len(batch) - inserted
+        batch = []
+
+    with tempfile.TemporaryFile() as tmp:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(attachment.url) as resp:
+                if resp.status != 200:
+                    log('  Attachment download failed ({})', resp.status, level=logging.ERROR)
+                    await message.channel.send('Sorry, I couldn\'t download that file. Try again later!')
+                    return
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    tmp.write(chunk)
+        tmp.seek(0)
+        # Exports are gzipped, but accept plain NDJSON too
+        is_gzip = tmp.read(2) == b'\x1f\x8b'
+        tmp.seek(0)
+        infile = gzip.GzipFile(fileobj=tmp, mode='rb') if is_gzip else tmp
+        try:
+            for line in infile:
+                try:
+                    entry = json.loads(line)
+                    row = tuple(None if entry.get(field) == None else int(entry[field])
+                            for field in QUOTE_FIELDS[0:5])
+                    content = entry.get('content')
+                    if content != None:
+                        row += (str(content),)
+                    else:
+                        row += (None,)
+                except (ValueError, TypeError, AttributeError):
+                    invalid += 1
+                    continue
+                # quoter_id (and the text) are the only columns allowed to be NULL
+                if None in row[0:1] + row[2:5] or row[3] != message.guild.id:
+                    invalid += 1
+                    continue
+                batch.append(row)
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    await flush_batch()
+        except (OSError, EOFError):
+            log('  Attachment is not a valid export', level=logging.ERROR)
+            invalid += 1
+        await flush_batch()
+
+    log('  Imported {}, skipped {} duplicates, {} invalid, {} failed',
+        imported, skipped, invalid, failed)
+    # Bulk inserts skip the per-quote counter updates, so recount the guild
+    if imported > 0:
+        await rebuild_stats(message.guild.id)
+    reply = 'Imported {} quotes ({} already saved, {} invalid), {}!'.format(
+        imported, skipped, invalid, message.author.mention)
+    if failed > 0:
+        reply += ' {} quotes could not be saved, try importing again later.'.format(failed)
+    await message.channel.send(reply)
+
 async def remindme_help(channel):
     """Send a help message for usage of the $remindme command
 
@@ -712,17 +1648,19 @@ async def remindme_help(channel):
     embed.set_author(name=CLIENT.user, icon_url=CLIENT.user.avatar_url)
 
     embed.add_field(name='Usage', inline=False,
-        value='`$remindme <time> <memo>`')
+        value='`$remindme <time> <memo>`\n`$remindme list`\n`$remindme cancel <id>`\n`$remindme snooze <id> <time>`')
     embed.add_field(name='What it does', inline = False,
         value='Get a reminder in the channel some time later')
     embed.add_field(name='Memo', inline=False,
         value='**[Optional]** Memo is the message that will be repeated to you')
     embed.add_field(name='Valid time units', inline=False,
         value='`weeks`, `days`, `hours`, `minutes`')
+    embed.add_field(name='Managing reminders', inline=False,
+        value='`list` pages through your pending reminders in this server. Use the ID shown there to `cancel` one, or `snooze` it to push it back by some time')
     embed.add_field(name='Example', inline=False,
-        value='`$remindme 1 minute A reminder 1 minute from now!`')
+        value='`$remindme 1 minute A reminder 1 minute from now!`\n`$remindme snooze 12 1 hour`')
     embed.add_field(name='Notes', inline=False,
-        value='Note that if the bot dies, all pending reminders are lost!')
+        value='Pending reminders are kept if the bot restarts')
     embed.set_footer(text='Run `$remindme help` to display this message again')
 
     await channel.send(embed=embed)
@@ -735,32 +1673,25 @@ async def remindme_errmsg(message):
     message : discord.Message
         The calling message.
     """
-    log('  ERROR: invalid args for {}'.format(message.content))
+    log('  Invalid args for {}', message.content, level=logging.ERROR)
     await message.channel.send(
         'Invalid arguments for `$remindme`! Use `$remindme help` for help.')
 
-async def remindme(message):
-    """Set and send a reminder for a user.
+def parse_remind_time(tokens):
+    """Parse a time like `1 day 3 hours`, and the memo after it (if any)
 
     Parameters
     ==========
-    message : discord.Message
-        The calling message, starting with `$remindme`
-    """
-    log('$remindme request from {}'.format(message.author.name))
+    tokens : [str]
+        The words of the command after `$remindme` (or after the reminder ID,
+        for `snooze`).
 
-    # Asking for help will override any tokens
-    if 'help' in message.content.split():
-        await remindme_help(message.channel)
-        return
-
-    token_arr = message.content.split()
-    # Error out if there are no arguments
-    if len(token_arr) <= 1:
-        await remindme_errmsg(message)
-        return
-
-    # Parse the time
+    Returns
+    =======
+    ((int, int, int, int), str)
+        (weeks, days, hours, minutes), and the memo ('' if there isn't one).
+        None if the time isn't valid.
+    """
     weeks = 0
     days = 0
     hours = 0
@@ -768,42 +1699,36 @@ async def remindme(message):
     memo = ''
     was_number = False
     set_time = False
-    # 0th index of this array should be '$remindme'
-    for i in range(1, len(token_arr)):
+    for i in range(len(tokens)):
         # Skip token if it's a number
-        if token_arr[i].isnumeric():
+        if tokens[i].isnumeric():
             if was_number:
-                await remindme_errmsg(message)
-                return
+                return None
             was_number = True
             continue
-        if token_arr[i] == 'week' or token_arr[i] == 'weeks':
+        if tokens[i] == 'week' or tokens[i] == 'weeks':
             # If there was no number before, then it's invalid
             if not was_number:
-                await remindme_errmsg(message)
-                return
-            weeks = int(token_arr[i-1])
+                return None
+            weeks = int(tokens[i-1])
             was_number = False
             set_time = True
-        elif token_arr[i] == 'day' or token_arr[i] == 'days':
+        elif tokens[i] == 'day' or tokens[i] == 'days':
             if not was_number:
-                await remindme_errmsg(message)
-                return
-            days = int(token_arr[i-1])
+                return None
+            days = int(tokens[i-1])
             was_number = False
             set_time = True
-        elif token_arr[i] == 'hour' or token_arr[i] == 'hours' or token_arr[i] == 'hr' or token_arr[i] == 'hrs':
+        elif tokens[i] == 'hour' or tokens[i] == 'hours' or tokens[i] == 'hr' or tokens[i] == 'hrs':
             if not was_number:
-                await remindme_errmsg(message)
-                return
-            hours = int(token_arr[i-1])
+                return None
+            hours = int(tokens[i-1])
             was_number = False
             set_time = True
-        elif token_arr[i] == 'minute' or token_arr[i] == 'minutes' or token_arr[i] == 'min' or token_arr[i] == 'mins':
+        elif tokens[i] == 'minute' or tokens[i] == 'minutes' or tokens[i] == 'min' or tokens[i] == 'mins':
             if not was_number:
-                await remindme_errmsg(message)
-                return
-            minutes = int(token_arr[i-1])
+                return None
+            minutes = int(tokens[i-1])
             was_number = False
             set_time = True
         # Otherwise, the rest of the message is the memo
@@ -812,58 +1737,660 @@ async def remindme(message):
         else:
             # Error if no time was set
             if not set_time:
-                await remindme_errmsg(message)
-                return
-            memo = ' '.join(token_arr[i:len(token_arr)])
+                return None
+            memo = ' '.join(tokens[i:len(tokens)])
             break
+    return (weeks, days, hours, minutes), memo
+
+def format_remind_time(weeks, days, hours, minutes):
+    """Spell out a time, e.g. ' 1 day 3 hours' (with a leading space)"""
+    text = ''
+    for count, unit in ((weeks, 'week'), (days, 'day'), (hours, 'hour'), (minutes, 'minute')):
+        if count > 1:
+            text += ' {} {}s'.format(count, unit)
+        elif count > 0:
+            text += ' {} {}'.format(count, unit)
+    return text
+
+@metrics.timed(COMMAND_SECONDS, COMMANDS_IN_FLIGHT, command='remindme')
+async def remindme(message):
+    """Set and send a reminder for a user.
+
+    Parameters
+    ==========
+    message : discord.Message
+        The calling message, starting with `$remindme`
+    """
+    log('$remindme request from {}', message.author.name)
+
+    # Asking for help will override any tokens
+    if 'help' in message.content.split():
+        await remindme_help(message.channel)
+        return
+
+    token_arr = message.content.split()
+    # Error out if there are no arguments
+    if len(token_arr) <= 1:
+        await remindme_errmsg(message)
+        return
+    if token_arr[1] == 'list':
+        await list_reminders(message)
+        return
+    if token_arr[1] == 'cancel':
+        await cancel_reminder(message, token_arr)
+        return
+    if token_arr[1] == 'snooze':
+        await snooze_reminder(message, token_arr)
+        return
+
+    # Parse the time
+    parsed = parse_remind_time(token_arr[1:])
+    if parsed == None:
+        await remindme_errmsg(message)
+        return
+    (weeks, days, hours, minutes), memo = parsed
     # If the memo is empty, then make it '`<none>`'
     if len(memo) == 0:
         memo = '`<none>`'
     # Log the operation
-    log('  wk|d|h|m: {}|{}|{}|{}'.format(weeks, days, hours, minutes))
-    log('  Memo: {}'.format(memo))
+    log('  wk|d|h|m: {}|{}|{}|{}', weeks, days, hours, minutes, level=logging.DEBUG)
+    log('  Memo: {}', memo, level=logging.DEBUG)
+
+    # Every pending reminder is kept in memory, so cap how many there are
+    if ADMISSION_CONTROL and USER_REMINDERS.get(message.author.id, 0) >= MAX_REMINDERS_PER_USER:
+        COMMANDS_REJECTED.inc(command='remindme', reason='reminders')
+        await message.channel.send('You already have {} reminders waiting, {}! Wait for some of them to go off first.'.format(
+            MAX_REMINDERS_PER_USER, message.author.mention))
+        return
+    if ADMISSION_CONTROL and len(REMINDERS) >= MAX_REMINDERS:
+        COMMANDS_REJECTED.inc(command='remindme', reason='busy')
+        await message.channel.send('I\'m holding too many reminders right now, {}! Try again later.'.format(
+            message.author.mention))
+        return
+
+    delta = datetime.timedelta(weeks=weeks, days=days, hours=hours, minutes=minutes)
+    due_at = int(time.time() + delta.total_seconds())
+    # Save the reminder first, so it survives the bot restarting before it's due
+    reminder_id = await STORE.add_reminder(message.guild.id, message.channel.id,
+            message.author.id, message.id, due_at, memo)
+    if reminder_id == None:
+        log('  Unable to save reminder', level=logging.ERROR)
+    schedule_reminder((reminder_id, message.guild.id, message.channel.id,
+        message.author.id, message.id, due_at, memo))
 
     # Construct the confirmation message
-    conf = 'Okay! I\'ll remind you in this channel in**'
-    if weeks > 0:
-        if weeks > 1:
-            conf += ' {} weeks'.format(weeks)
-        else:
-            conf += ' {} week'.format(weeks)
-    if days > 0:
-        if days > 1:
-            conf += ' {} days'.format(days)
-        else:
-            conf += ' {} day'.format(days)
-    if hours > 0:
-        if hours > 1:
-            conf += ' {} hours'.format(hours)
-        else:
-            conf += ' {} hour'.format(hours)
-    if minutes > 0:
-        if minutes > 1:
-            conf += ' {} minutes'.format(minutes)
-        else:
-            conf += ' {} minute'.format(minutes)
-    conf += '**.'
+    conf = 'Okay! I\'ll remind you in this channel in**{}**.'.format(
+        format_remind_time(weeks, days, hours, minutes))
+    if reminder_id != None:
+        conf += ' (Reminder #{})'.format(reminder_id)
     await message.channel.send(conf)
 
-    curr_time = datetime.datetime.now()
-    target_time = curr_time + datetime.timedelta(weeks=weeks, days=days, hours=hours, minutes=minutes)
-    # NOTE: If the bot is killed, all pending reminders are lost...at this point
-    # I have no obvious solution so consider it a beta
-    log('  Awaiting time...')
-    await discord.utils.sleep_until(target_time)
+def parse_reminder_id(token):
+    """Read a reminder ID as typed by a user (e.g. `12` or `#12`), None if it isn't one"""
+    token = token.lstrip('#')
+    return int(token) if token.isnumeric() else None
+
+async def list_reminders(message):
+    """Page through a user's pending reminders in a guild, with an interactible menu
+
+    Each page is its own keyset query on the (guild, user, due time) index, so
+    paging costs the same however many reminders the user has. Where each page
+    seen so far starts is remembered, for paging back.
+
+    Parameters
+    ==========
+    message : discord.Message
+        The calling message, `$remindme list`.
+    """
+    guild_id = message.guild.id
+    user_id = message.author.id
+    react_timeout = SETTINGS.get(guild_id, 'menu_timeout')
+    # (due_at, id) of the last reminder before each page seen so far
+    starts = [None]
+    pageno = 0
+    sent_message = None
+    footertext = 'Use `$remindme cancel <id>` to cancel a reminder, or `$remindme snooze <id> <time>` to push it back.'
+
+    # Past the menu limits, only the first page is shown, without paging
+    menu = MENU_SLOTS.try_acquire(user_id, force=not ADMISSION_CONTROL)
+    if menu == None:
+        COMMANDS_REJECTED.inc(command='remindme', reason='menus')
+
+    # This function is to check if any user responds with left/right arrow emoji
+    def check_reaction(reaction, user):
+        return (not user.bot) and (reaction.emoji == EMOJI_LEFT or reaction.emoji == EMOJI_RIGHT) and reaction.message == sent_message
+
+    with menu if menu != None else contextlib.nullcontext(), PAGINATORS_OPEN.track():
+        while True:
+            # One extra row, to tell whether there's a next page
+            rows = await STORE.user_reminders(guild_id, user_id, starts[pageno],
+                    REMINDERS_PER_PAGE + 1)
+            if rows == None:
+                await message.channel.send('Sorry, I couldn\'t read your reminders right now. Try again later!')
+                return
+            if len(rows) == 0 and pageno == 0:
+                await message.channel.send('You have no pending reminders here, {}!'.format(message.author.mention))
+                return
+            has_next = len(rows) > REMINDERS_PER_PAGE
+            rows = rows[0:REMINDERS_PER_PAGE]
+            if has_next and len(starts) == pageno + 1:
+                # due_at is Index 5 and ID is Index 0 of the results tuple
+                starts.append((rows[-1][5], rows[-1][0]))
+
+            embed = discord.Embed(
+                title='Your reminders!',
+                color=discord.Color.red(),
+                description='Soonest first.' if len(rows) > 0 else 'No more reminders.'
+            )
+            for reminder_id, _, channel_id, _, message_id, due_at, memo in rows:
+                if len(memo) > MESSAGE_PREVIEW_LEN:
+                    memo = memo[0:MESSAGE_PREVIEW_LEN] + '...'
+                jump_url = 'https://discord.com/channels/{}/{}/{}'.format(guild_id, channel_id, message_id)
+                embed.add_field(inline=False, name='#{}'.format(reminder_id),
+                    value='{}\nDue <t:{}:R> - [jump]({})'.format(memo.replace('\n', ' '), due_at, jump_url))
+            embed.set_footer(text='{}\n\nPage {}'.format(footertext, pageno+1))
+            if sent_message == None:
+                sent_message = await message.channel.send(embed=embed)
+            else:
+                await sent_message.edit(embed=embed)
+            # Nothing to page to
+            if menu == None or (pageno == 0 and not has_next):
+                break
+            await sent_message.add_reaction(EMOJI_LEFT)
+            await sent_message.add_reaction(EMOJI_RIGHT)
+
+            try:
+                reaction, user = await wait_for_reaction(check_reaction, react_timeout)
+                if reaction.emoji == EMOJI_LEFT and pageno > 0:
+                    pageno -= 1
+                elif reaction.emoji == EMOJI_RIGHT and has_next:
+                    pageno += 1
+                await sent_message.clear_reactions()
+                continue
+            except asyncio.TimeoutError:
+                await sent_message.clear_reactions()
+                break
+
+async def cancel_reminder(message, token_arr):
+    """Cancel one of a user's pending reminders in this guild
+
+    Parameters
+    ==========
+    message : discord.Message
+        The calling message, `$remindme cancel <id>`.
+    token_arr : [str]
+        The words of the message.
+    """
+    reminder_id = parse_reminder_id(token_arr[2]) if len(token_arr) == 3 else None
+    if reminder_id == None:
+        await remindme_errmsg(message)
+        return
+    if not await STORE.cancel_reminder(reminder_id, message.guild.id, message.author.id):
+        await message.channel.send('You have no pending reminder #{}, {}! Use `$remindme list` to see yours.'.format(
+            reminder_id, message.author.mention))
+        return
+    unschedule_reminder(reminder_id)
+    log('  Cancelled reminder {}', reminder_id)
+    await message.add_reaction(EMOJI_BOT_CONFIRM)
+
+async def snooze_reminder(message, token_arr):
+    """Push one of a user's pending reminders in this guild back by some time
+
+    Parameters
+    ==========
+    message : discord.Message
+        The calling message, `$remindme snooze <id> <time>`.
+    token_arr : [str]
+        The words of the message.
+    """
+    reminder_id = parse_reminder_id(token_arr[2]) if len(token_arr) > 3 else None
+    parsed = parse_remind_time(token_arr[3:]) if reminder_id != None else None
+    # Snoozing takes a time, but no memo
+    if parsed == None or parsed[1] != '' or sum(parsed[0]) == 0:
+        await remindme_errmsg(message)
+        return
+    weeks, days, hours, minutes = parsed[0]
+    delta = datetime.timedelta(weeks=weeks, days=days, hours=hours, minutes=minutes)
+    seconds = int(delta.total_seconds())
+    if not await STORE.snooze_reminder(reminder_id, message.guild.id, message.author.id, seconds):
+        await message.channel.send('You have no pending reminder #{}, {}! Use `$remindme list` to see yours.'.format(
+            reminder_id, message.author.mention))
+        return
+    reminder = unschedule_reminder(reminder_id)
+    if reminder != None:
+        # due_at is Index 5 of the reminder tuple
+        schedule_reminder(reminder[0:5] + (reminder[5] + seconds,) + reminder[6:])
+    log('  Snoozed reminder {} by {}s', reminder_id, seconds)
+    await message.channel.send('Okay! I pushed reminder #{} back by**{}**.'.format(
+        reminder_id, format_remind_time(weeks, days, hours, minutes)))
+
+def schedule_reminder(reminder):
+    """Add a reminder to the scheduler, to be sent once it's due
+
+    Parameters
+    ==========
+    reminder : tuple
+        The reminder, in storage.REMINDER_FIELDS order.
+    """
+    reminder_id, user_id, due_at = reminder[0], reminder[3], reminder[5]
+    # A reminder that couldn't be saved has no ID, so key it by its message instead
+    key = reminder_id if reminder_id != None else ('unsaved', reminder[4])
+    # Already scheduled (e.g. by $remindme before load_reminders() ran), so
+    # it's replaced rather than counted again
+    if key not in REMINDERS:
+        USER_REMINDERS[user_id] = USER_REMINDERS.get(user_id, 0) + 1
+    REMINDERS.add(key, due_at, reminder)
+    REMINDERS_PENDING.set(len(REMINDERS))
+
+def unschedule_reminder(reminder_id):
+    """Take a reminder off of the scheduler (if it's on it)
+
+    Returns
+    =======
+    tuple
+        The reminder, or None if it wasn't scheduled.
+    """
+    reminder = REMINDERS.remove(reminder_id)
+    if reminder != None:
+        reminder_unscheduled(reminder)
+    return reminder
+
+def reminder_unscheduled(reminder):
+    """Stop counting a reminder as pending"""
+    # User ID is Index 3 of the reminder tuple
+    user_id = reminder[3]
+    count = USER_REMINDERS.pop(user_id) - 1
+    if count > 0:
+        USER_REMINDERS[user_id] = count
+    REMINDERS_PENDING.set(len(REMINDERS))
+
+def reminder_due(reminder):
+    """Start sending a reminder, once the scheduler finds it's due"""
+    reminder_unscheduled(reminder)
+    track_task(asyncio.ensure_future(send_reminder(reminder)), 'reminder')
+
+async def load_reminders():
+    """Pick back up the reminders that were pending when the bot last stopped
+
+    Reminders that came due while the bot was down are sent right away.
+    """
+    reminders = await STORE.pending_reminders()
+    for reminder in reminders:
+        schedule_reminder(reminder)
+    log('Loaded {} pending reminders', len(reminders))
+
+async def send_reminder(reminder):
+    """Send a reminder that's due
+
+    Parameters
+    ==========
+    reminder : tuple
+        The reminder, in storage.REMINDER_FIELDS order. The ID is None if the
+        reminder couldn't be saved.
+    """
+    reminder_id, guild_id, channel_id, user_id, message_id, due_at, memo = reminder
+    mention = '<@{}>'.format(user_id)
+    jump_url = 'https://discord.com/channels/{}/{}/{}'.format(guild_id, channel_id, message_id)
 
     # Send the reminder as an embed
     embed = discord.Embed(title='Your reminder!', color=discord.Color.red())
     embed.set_author(name=CLIENT.user, icon_url=CLIENT.user.avatar_url)
-    embed.add_field(name='Requestor', inline=False, value=message.author.mention)
+    embed.add_field(name='Requestor', inline=False, value=mention)
     embed.add_field(name='Reminder', inline=False, value=memo)
     embed.add_field(name='Jump to message', inline=False,
-        value='[{}]({})'.format('Click here', message.jump_url))
-    await message.channel.send(content=message.author.mention, embed=embed)
-    log('  Reminder sent!')
+        value='[{}]({})'.format('Click here', jump_url))
+    try:
+        channel = CLIENT.get_channel(channel_id)
+        if channel == None:
+            with REST_SECONDS.time(call='fetch_channel'):
+                channel = await CLIENT.fetch_channel(channel_id)
+        await channel.send(content=mention, embed=embed)
+        log('  Reminder sent!')
+    except discord.HTTPException as err:
+        # E.g. the channel was deleted or the bot lost access to it. discord.py
+        # already retried server errors, so this won't go through on a later
+        # try either; drop it rather than failing again on every start
+        log('  Unable to send reminder {} in {}, dropping it: {}', reminder_id, channel_id, err,
+            level=logging.ERROR)
+    if reminder_id != None:
+        await STORE.remove_reminder(reminder_id)
+
+async def qotd_help(channel):
+    """Send a help message for usage of the $qotd command
+
+    Parameters
+    ==========
+    channel : discord.Channel
+        Channel to send the help message to.
+    """
+    embed = discord.Embed(
+        title='How to get a Quote of the Day!',
+        color=discord.Color.red()
+    )
+    embed.set_author(name=CLIENT.user, icon_url=CLIENT.user.avatar_url)
+
+    embed.add_field(name='Turning it on', inline=False,
+        value='`$qotd here` to get a random quote in this channel every day')
+    embed.add_field(name='Turning it off', inline=False,
+        value='`$qotd off` to stop the quote of the day')
+    embed.add_field(name='Notes', inline=False,
+        value='Both require **Manage Server**. Each server gets one quote of the day, '
+              'posted some time after {}:00 ({})'.format(QOTD_HOUR, TIMEZONE.zone))
+    embed.set_footer(text='Run `$qotd help` to display this message again')
+
+    await channel.send(embed=embed)
+
+@metrics.timed(COMMAND_SECONDS, COMMANDS_IN_FLIGHT, command='qotd')
+async def qotd(message):
+    """Turn a guild's quote of the day on (in the calling channel) or off
+
+    Parameters
+    ==========
+    message : discord.Message
+        The calling message, starting with `$qotd`
+    """
+    log('$qotd request from {}', message.author.name)
+
+    token_arr = message.content.split()
+    if len(token_arr) < 2 or token_arr[1] not in ('here', 'off'):
+        await qotd_help(message.channel)
+        return
+    if not message.author.guild_permissions.manage_guild:
+        await message.channel.send('You need the **Manage Server** permission to set up the quote of the day, {}!'.format(message.author.mention))
+        return
+
+    if token_arr[1] == 'here':
+        if not await STORE.set_qotd_channel(message.guild.id, message.channel.id):
+            await message.channel.send('Sorry, I couldn\'t save that right now. Try again later!')
+            return
+        await message.channel.send('Okay! I\'ll post a quote of the day in this channel.')
+    else:
+        await STORE.remove_qotd_channel(message.guild.id)
+        await message.channel.send('Okay! No more quotes of the day.')
+
+async def qotd_loop():
+    """Post the quote of the day at QOTD_HOUR every day, forever
+
+    If the bot starts after QOTD_HOUR, the channels that haven't been posted
+    in yet today (e.g. because the bot restarted in the middle of the window)
+    are posted to right away.
+    """
+    while True:
+        now = datetime.datetime.now(TIMEZONE)
+        start = TIMEZONE.localize(datetime.datetime.combine(now.date(),
+            datetime.time(QOTD_HOUR)))
+        if now < start:
+            await discord.utils.sleep_until(start)
+        try:
+            await broadcast_qotd(start.date().toordinal())
+        except Exception as err:
+            log('Quote of the day failed: {!r}', err, level=logging.ERROR)
+        tomorrow = start.date() + datetime.timedelta(days=1)
+        await discord.utils.sleep_until(TIMEZONE.localize(datetime.datetime.combine(tomorrow,
+            datetime.time(QOTD_HOUR))))
+
+async def broadcast_qotd(day):
+    """Post a day's quote of the day in every channel that hasn't had it yet
+
+    The quotes for every guild are picked up front, QOTD_BATCH_SIZE guilds per
+    query. Posting is then spread evenly over QOTD_WINDOW seconds (but no faster
+    than QOTD_MAX_RATE per second), with at most QOTD_CONCURRENCY posts being
+    looked up and sent at once.
+
+    Parameters
+    ==========
+    day : int
+        The day to post for, as date.toordinal().
+    """
+    due = await STORE.qotd_channels_due(day)
+    if len(due) == 0:
+        return
+    log('Posting the quote of the day in {} channels...', len(due))
+
+    picks = {}
+    for i in range(0, len(due), QOTD_BATCH_SIZE):
+        guild_ids = [guild_id for guild_id, _ in due[i:i + QOTD_BATCH_SIZE]]
+        picks.update(await STORE.random_quotes(guild_ids))
+
+    # Don't always post to the same guilds first
+    random.shuffle(due)
+    interval = max(QOTD_WINDOW / len(due), 1 / QOTD_MAX_RATE)
+    slots = asyncio.Semaphore(QOTD_CONCURRENCY)
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    tasks = []
+    for i, (guild_id, channel_id) in enumerate(due):
+        await asyncio.sleep(max(start + i * interval - loop.time(), 0))
+        await slots.acquire()
+        task = asyncio.ensure_future(post_qotd(day, guild_id, channel_id, picks.get(guild_id)))
+        task.add_done_callback(lambda t: slots.release())
+        track_task(task, 'quote of the day')
+        tasks.append(task)
+    # A post that was started may have claimed the day already, so it gets to
+    # finish even if the broadcast is cancelled (e.g. on shutdown)
+    posted = sum(await asyncio.gather(*(asyncio.shield(task) for task in tasks)))
+    log('Posted the quote of the day in {} of {} channels', posted, len(due))
+
+async def post_qotd(day, guild_id, channel_id, row):
+    """Post one guild's quote of the day, unless it already was
+
+    The day is claimed before posting, so a restart (or a second copy of the
+    bot) never posts it twice; a post that fails after that is skipped for the
+    day rather than retried.
+
+    Parameters
+    ==========
+    day : int
+        The day to post for, as date.toordinal().
+    guild_id, channel_id : int
+        Where to post it.
+    row : tuple
+        The quote to post, in QUOTE_FIELDS order (None if the guild has none).
+
+    Returns
+    =======
+    bool
+        True if it was posted.
+    """
+    if row == None:
+        QOTD_POSTS.inc(result='no_quotes')
+        return False
+    if not await STORE.claim_qotd(guild_id, day):
+        QOTD_POSTS.inc(result='already_posted')
+        return False
+    try:
+        channel = CLIENT.get_channel(channel_id)
+        if channel == None:
+            with REST_SECONDS.time(call='fetch_channel'):
+                channel = await CLIENT.fetch_channel(channel_id)
+        quote = (await quotes_from_rows([row]))[0]
+        await repeat_quote(channel, quote, title='Quote of the day!')
+    except discord.HTTPException as err:
+        log('  Unable to post the quote of the day in {}: {}', channel_id, err,
+            level=logging.ERROR)
+        QOTD_POSTS.inc(result='failed')
+        return False
+    QOTD_POSTS.inc(result='posted')
+    return True
+
+async def settings_help(channel):
+    """Send a help message for usage of the $settings command
+
+    Parameters
+    ==========
+    channel : discord.Channel
+        Channel to send the help message to.
+    """
+    embed = discord.Embed(
+        title='How to change Settings!',
+        color=discord.Color.red()
+    )
+    embed.set_author(name=CLIENT.user, icon_url=CLIENT.user.avatar_url)
+
+    embed.add_field(name='Seeing the settings', inline=False,
+        value='`$settings` to list this server\'s settings')
+    embed.add_field(name='Changing a setting', inline=False,
+        value='`$settings set <name> <value>`')
+    embed.add_field(name='Going back to the default', inline=False,
+        value='`$settings reset <name>`')
+    embed.add_field(name='Example', inline=False,
+        value='`$settings set page_size 10`')
+    embed.add_field(name='Notes', inline=False,
+        value='Changing settings requires **Manage Server**')
+    embed.set_footer(text='Run `$settings help` to display this message again')
+
+    await channel.send(embed=embed)
+
+@metrics.timed(COMMAND_SECONDS, COMMANDS_IN_FLIGHT, command='settings')
+async def settings(message):
+    """List, change or reset a guild's settings
+
+    Parameters
+    ==========
+    message : discord.Message
+        The calling message, starting with `$settings`
+    """
+    log('$settings request from {}', message.author.name)
+
+    token_arr = message.content.split()
+    guild_id = message.guild.id
+    if len(token_arr) == 1:
+        changed = SETTINGS.changed(guild_id)
+        embed = discord.Embed(title='Settings for this server', color=discord.Color.red())
+        for name, setting in SETTINGS.settings.items():
+            value = setting.format(SETTINGS.get(guild_id, name))
+            if name not in changed:
+                value += ' (default)'
+            embed.add_field(name='{}: {}'.format(name, value), inline=False, value=setting.doc)
+        embed.set_footer(text='Run `$settings help` to see how to change them')
+        await message.channel.send(embed=embed)
+        return
+    if token_arr[1] not in ('set', 'reset') or len(token_arr) != (4 if token_arr[1] == 'set' else 3):
+        await settings_help(message.channel)
+        return
+    if not message.author.guild_permissions.manage_guild:
+        await message.channel.send('You need the **Manage Server** permission to change settings, {}!'.format(message.author.mention))
+        return
+
+    name = token_arr[2].lower()
+    setting = SETTINGS.settings.get(name)
+    if setting == None:
+        await message.channel.send('There is no `{}` setting! Send `$settings` to list them.'.format(name))
+        return
+    value = None
+    if token_arr[1] == 'set':
+        try:
+            value = setting.parse(token_arr[3])
+        except ValueError as err:
+            await message.channel.send('{}, {}!'.format(err, message.author.mention))
+            return
+    if not await SETTINGS.set(guild_id, name, value):
+        await message.channel.send('Sorry, I couldn\'t save that right now. Try again later!')
+        return
+    log('  Set {} to {}', name, setting.format(SETTINGS.get(guild_id, name)))
+    await message.add_reaction(EMOJI_BOT_CONFIRM)
+
+async def refresh_settings():
+    """Periodically pick up settings that another process saved to the DB"""
+    while True:
+        await asyncio.sleep(SETTINGS_REFRESH_INTERVAL)
+        try:
+            changed = await SETTINGS.refresh()
+        except Exception as err:
+            log('Unable to refresh settings: {!r}', err, level=logging.ERROR)
+            continue
+        if changed > 0:
+            log('Picked up new settings for {} servers', changed)
+
+async def is_debug_user(user):
+    """Whether a user may use $debug (see DEBUG_USER_IDS)"""
+    if DEBUG_USER_IDS != None:
+        return user.id in DEBUG_USER_IDS
+    global OWNER_IDS
+    if OWNER_IDS == None:
+        info = await CLIENT.application_info()
+        if info.team != None:
+            OWNER_IDS = {member.id for member in info.team.members}
+        else:
+            OWNER_IDS = {info.owner.id}
+    return user.id in OWNER_IDS
+
+@metrics.timed(COMMAND_SECONDS, COMMANDS_IN_FLIGHT, command='debug')
+async def debug(message):
+    """Diagnostics for whoever runs the bot, e.g. `$debug profile 30s`
+
+    Everyone else is ignored, without a reply, so the command stays out of sight.
+
+    Parameters
+    ==========
+    message : discord.Message
+        The calling message, starting with `$debug`
+    """
+    if not await is_debug_user(message.author):
+        log('  Ignored $debug from {} (not allowed)', message.author.name)
+        return
+    log('$debug request from {}', message.author.name)
+
+    token_arr = message.content.split()
+    if len(token_arr) in (2, 3) and token_arr[1] == 'profile':
+        await debug_profile(message, token_arr[2:])
+        return
+    await message.channel.send('Usage: `$debug profile [seconds]`, e.g. `$debug profile 30s` '
+        '(up to {}s)'.format(PROFILE_MAX_SECONDS))
+
+async def debug_profile(message, token_arr):
+    """Sample what the event loop is doing for a while, and send back the results
+
+    A sampling profiler records the event loop thread's stack (and the asyncio
+    task it's running) every PROFILE_INTERVAL seconds, for the requested time.
+    It's only loaded and started for the profile, so the bot runs exactly as
+    usual otherwise. Two files are sent back: the samples as collapsed stacks
+    (for flamegraph.pl, speedscope, etc.), and a summary of the busiest tasks
+    and hottest functions.
+
+    Parameters
+    ==========
+    message : discord.Message
+        The calling message.
+    token_arr : [str]
+        What followed `$debug profile`: nothing, or a time like `30s` or `30`.
+    """
+    seconds = PROFILE_DEFAULT_SECONDS
+    if len(token_arr) > 0:
+        text = token_arr[0].lower()
+        text = text[:-1] if text.endswith('s') else text
+        if not text.isnumeric() or int(text) < 1 or int(text) > PROFILE_MAX_SECONDS:
+            await message.channel.send('Profiles can run for 1 to {} seconds, e.g. `$debug profile 30s`'.format(
+                PROFILE_MAX_SECONDS))
+            return
+        seconds = int(text)
+    global PROFILING
+    if PROFILING:
+        await message.channel.send('A profile is already running!')
+        return
+
+    # Only needed when asked for, so not imported otherwise
+    import profiler
+    prof = profiler.Profile(interval=PROFILE_INTERVAL)
+    PROFILING = True
+    try:
+        log('  Profiling the event loop for {}s', seconds)
+        await message.channel.send('Profiling for {}s...'.format(seconds))
+        await prof.run(seconds)
+    finally:
+        PROFILING = False
+
+    collapsed = prof.collapsed().encode('utf-8')
+    summary = prof.summary(PROFILE_TOP_N).encode('utf-8')
+    log('  Profiled {} samples ({} distinct stacks)', sum(prof.samples.values()), len(prof.samples))
+    limit = message.guild.filesize_limit if message.guild != None else 8 * 1024 * 1024
+    if len(collapsed) + len(summary) > limit:
+        await message.channel.send('Sorry, the profile is too large to upload here!')
+        return
+    stamp = datetime.datetime.now(TIMEZONE).strftime('%Y%m%d-%H%M%S')
+    await message.channel.send('Done profiling, {}!'.format(message.author.mention), files=[
+        discord.File(io.BytesIO(collapsed), filename='profile-{}.collapsed.txt'.format(stamp)),
+        discord.File(io.BytesIO(summary), filename='profile-{}-summary.txt'.format(stamp))])
 
 async def helpcmd(channel):
     """List all of the available commands.
@@ -888,10 +2415,46 @@ async def helpcmd(channel):
 @CLIENT.event
 async def on_ready():
     """Bot routines to run once it's up and ready"""
-    log('BEEP BEEP. Logged in as <{0.user}>'.format(CLIENT))
+    log('BEEP BEEP. Logged in as <{0.user}>', CLIENT)
+    if APP != None:
+        APP.report_startup()
     await set_rand_status()
 
+    global METRICS_STARTED
+    if not METRICS_STARTED:
+        METRICS_STARTED = True
+        if METRICS_PORT != None:
+            await metrics.serve('127.0.0.1', METRICS_PORT)
+            log('Serving metrics on port {}', METRICS_PORT)
+        if METRICS_DUMP_FILE != None:
+            asyncio.ensure_future(metrics.dump_every(METRICS_DUMP_FILE, METRICS_DUMP_INTERVAL))
+
+    global REMINDERS_LOADED
+    if not REMINDERS_LOADED:
+        REMINDERS_LOADED = True
+        await wait_for_store()
+        await load_reminders()
+
+    global QOTD_TASK
+    if QOTD_TASK == None:
+        QOTD_TASK = asyncio.ensure_future(qotd_loop())
+
+    global SETTINGS_REFRESHING
+    if not SETTINGS_REFRESHING and SETTINGS_REFRESH_INTERVAL != None:
+        SETTINGS_REFRESHING = True
+        asyncio.ensure_future(refresh_settings())
+
+    global LAG
+    if LAG_MONITOR and LAG == None:
+        # Only needed when enabled, so not imported otherwise
+        import lagmonitor
+        LAG = lagmonitor.LagMonitor(threshold=LAG_THRESHOLD)
+        LAG.start()
+        asyncio.ensure_future(report_lag())
+        log('Watching for event loop stalls over {}s', LAG_THRESHOLD)
+
 @CLIENT.event
+@draining('message')
 async def on_message(message):
     """Bot routines to run whenever a new message is sent
 
@@ -905,6 +2468,12 @@ async def on_message(message):
     # Ignore the message if it's from a bot
     if message.author.bot:
         return
+    if RECORDER != None:
+        RECORDER.message(message)
+    words = message.content.split()
+    if len(words) > 0 and words[0] in COMMAND_WORDS and not await admit(message, words[0][1:]):
+        return
+    await wait_for_store()
     if startswith_word(message.content, '$help'):
         await helpcmd(message.channel)
     if startswith_word(message.content, '$hello'):
@@ -915,13 +2484,51 @@ async def on_message(message):
         await quotes(message)
     if startswith_word(message.content, '$quote'):
         await quotes(message, pick_quote=True)
+    if startswith_word(message.content, '$quotesearch'):
+        await quotesearch(message)
+    if startswith_word(message.content, '$quotestats'):
+        await quotestats(message)
     if startswith_word(message.content, '$remindme'):
         await remindme(message)
+    if startswith_word(message.content, '$qotd'):
+        await qotd(message)
+    if startswith_word(message.content, '$settings'):
+        await settings(message)
+    if startswith_word(message.content, '$debug'):
+        await debug(message)
 
     # Chance to change the bot status on new message
-    await roll_rand_status()
+    await roll_rand_status(message.guild.id if message.guild != None else None)
 
 @CLIENT.event
+@draining('message edit')
+async def on_raw_message_edit(payload):
+    """Bot routine to run whenever any message is edited
+
+    Keeps the stored text of saved quotes in sync, so search finds the edited
+    version. Uses the raw event for the same reason as on_raw_reaction_add.
+
+    Parameters
+    ==========
+    payload : discord.RawMessageUpdateEvent
+        The payload of the edit event.
+    """
+    # Embed-only updates don't carry any content, and quotes are never from
+    # bots (or webhooks) or outside of a guild
+    data = payload.data
+    if ('content' not in data or payload.guild_id == None or 'webhook_id' in data
+            or data.get('author', {}).get('bot', False)):
+        return
+    await wait_for_store()
+    # Almost no edited message is a quote, so look it up (a primary key read)
+    # rather than queueing a write for every edit
+    stored = await STORE.quote_contents([payload.message_id])
+    if payload.message_id not in stored or stored[payload.message_id] == data['content']:
+        return
+    await STORE.update_quote_content(payload.message_id, data['content'])
+
+@CLIENT.event
+@draining('reaction')
 async def on_raw_reaction_add(payload):
     """Bot routine to run whenever a reaction is added to any message
 
@@ -933,29 +2540,48 @@ async def on_raw_reaction_add(payload):
     payload : discord.RawReactionActionEvent
         The payload of the reaction event.
     """
+    if RECORDER != None:
+        RECORDER.reaction(payload)
     # Need to cast to string, since Discord emoji not really an emoji
     emoji = str(payload.emoji)
     # Exit early if not reacting with what we want
     if emoji not in KEY_REACTS:
         return
+    await wait_for_store()
+    await handle_quote_react(payload, emoji)
 
+@metrics.timed(REACTION_SECONDS, REACTIONS_IN_FLIGHT)
+async def handle_quote_react(payload, emoji):
+    """Save or remove a quote, depending on which emoji was reacted with
+
+    Parameters
+    ==========
+    payload : discord.RawReactionActionEvent
+        The payload of the reaction event.
+    emoji : str
+        The reacted emoji, one of KEY_REACTS.
+    """
     # Need these for future ops
     guild = CLIENT.get_guild(payload.guild_id)
     channel = CLIENT.get_channel(payload.channel_id)
 
     # Get message, quoter, and quote author
-    message = await channel.fetch_message(payload.message_id)
+    with REST_SECONDS.time(call='fetch_message'):
+        message = await channel.fetch_message(payload.message_id)
     member_saver = payload.member
     user_author = message.author
-    member_author = await guild.fetch_member(user_author.id)
+    with REST_SECONDS.time(call='fetch_member'):
+        member_author = await guild.fetch_member(user_author.id)
 
     # Construct new quote object
     quote = Quote(member_author, member_saver, message)
 
     # Ugh, why doesn't Python have switch statements...?
     if (emoji == EMOJI_QUOTE):
+        REACTIONS_TOTAL.inc(action='save')
         await quote.save_to_db()
     elif (emoji == EMOJI_DELQUOTE):
+        REACTIONS_TOTAL.inc(action='remove')
         await quote.remove_from_db()
 
 
@@ -963,5 +2589,7 @@ async def on_raw_reaction_add(payload):
 # Run the bot
 ################################################################################
 
-# Wow, so elegant!
-CLIENT.run(TOKEN)
+if __name__ == '__main__':
+    APP = App(CLIENT)
+    # Wow, so elegant!
+    APP.run()
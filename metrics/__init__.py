@@ -0,0 +1,243 @@
+"""Lightweight in-process metrics, exported in the Prometheus text format
+
+Counters, gauges and histograms are registered once at import time and updated
+from the hot paths; rendering only happens when the metrics are scraped or
+dumped, so updates are just a dict lookup and an add under a lock.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+
+################################################################################
+# Metric types
+################################################################################
+
+# Default histogram buckets (in seconds), from a fast DB query up to a slow page
+# of Discord API calls
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+# Every metric that has been created, by name
+REGISTRY = {}
+
+
+class Metric:
+    """Base class for a metric with an optional set of label names
+
+    Each distinct combination of label values is tracked as its own series.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _fmt_labels(self, key, extra=None):
+        pairs = list(zip(self.labels, key))
+        if extra != None:
+            pairs.append(extra)
+        if len(pairs) == 0:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(k, v) for k, v in pairs) + '}'
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.doc),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            series = list(self._series.items())
+        for key, value in series:
+            lines.append('{}{} {}'.format(self.name, self._fmt_labels(key), value))
+        return lines
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._series.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    """A value that can go up and down"""
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the enclosed block as in flight while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    """Distribution of observed values, in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series == None:
+                # Per-bucket counts, then the total count and sum
+                series = [0] * (len(self.buckets) + 2)
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the enclosed block takes (works around awaits too)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.doc),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            series = [(key, list(counts)) for key, counts in self._series.items()]
+        for key, counts in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name,
+                    self._fmt_labels(key, ('le', bound)), cumulative))
+            lines.append('{}_bucket{} {}'.format(self.name,
+                self._fmt_labels(key, ('le', '+Inf')), counts[-2]))
+            lines.append('{}_count{} {}'.format(self.name, self._fmt_labels(key), counts[-2]))
+            lines.append('{}_sum{} {}'.format(self.name, self._fmt_labels(key), counts[-1]))
+        return lines
+
+
+################################################################################
+# Registration
+################################################################################
+
+def _register(cls, name, doc, labels, **kwargs):
+    metric = REGISTRY.get(name)
+    if metric == None:
+        metric = cls(name, doc, labels, **kwargs)
+        REGISTRY[name] = metric
+    return metric
+
+def counter(name, doc, labels=()):
+    return _register(Counter, name, doc, labels)
+
+def gauge(name, doc, labels=()):
+    return _register(Gauge, name, doc, labels)
+
+def histogram(name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, doc, labels, buckets=buckets)
+
+def timed(hist, inflight=None, **labels):
+    """Decorator to time a coroutine function with a histogram
+
+    Parameters
+    ==========
+    hist : Histogram
+        Histogram to observe the coroutine's run time with.
+    inflight : Gauge
+        If given, counts how many calls are running at once.
+    labels
+        Label values to record the coroutine's metrics under.
+    """
+    def decorator(coro):
+        @functools.wraps(coro)
+        async def wrapper(*args, **kwargs):
+            if inflight != None:
+                inflight.inc(**labels)
+            try:
+                with hist.time(**labels):
+                    return await coro(*args, **kwargs)
+            finally:
+                if inflight != None:
+                    inflight.dec(**labels)
+        return wrapper
+    return decorator
+
+
+################################################################################
+# Exporting
+################################################################################
+
+def render():
+    """Render every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in list(REGISTRY.values()):
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+async def _handle_scrape(reader, writer):
+    try:
+        # We serve the same page for any path, so just drain the request
+        await reader.readuntil(b'\r\n\r\n')
+        body = render().encode('utf-8')
+        writer.write(b'HTTP/1.0 200 OK\r\n'
+            b'Content-Type: text/plain; version=0.0.4\r\n'
+            + 'Content-Length: {}\r\n\r\n'.format(len(body)).encode('ascii') + body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(host, port):
+    """Serve the metrics over plain HTTP, for a Prometheus scraper
+
+    Returns the asyncio server, which is already listening.
+    """
+    return await asyncio.start_server(_handle_scrape, host, port)
+
+def _write_file(path, text):
+    with open(path, 'w') as out:
+        out.write(text)
+
+async def dump(path):
+    """Write the metrics to a file, replacing its contents
+
+    They're rendered on the event loop, so no metric changes halfway through,
+    and the file is written from the default executor, so the loop isn't held
+    up by the disk.
+    """
+    text = render()
+    await asyncio.get_event_loop().run_in_executor(None, _write_file, path, text)
+
+async def dump_every(path, interval):
+    """Periodically write the metrics to a file, replacing its contents"""
+    while True:
+        await asyncio.sleep(interval)
+        await dump(path)
@@ -0,0 +1,221 @@
+"""Sampling profiler for the event loop, for diagnosing the live bot
+
+While a profile runs, the stack the event loop is in is recorded every
+`interval` seconds, under the asyncio task it's running (or as idle, if the
+loop is just waiting for something to happen). Samples are counted up as
+they're taken, so memory is bounded by the number of distinct stacks rather
+than by how long the profile runs.
+
+Where it can, the profiler samples with an interval timer (SIGALRM), whose
+handler runs on the loop's thread with the exact frame that was interrupted.
+A background thread reading sys._current_frames() would be biased: it only
+gets the GIL when the loop gives it up, which is mostly when it goes idle, so
+short bursts of work would go unseen. That is only used as a fallback, when
+the loop isn't on the main thread or there are no interval timers (Windows).
+
+Nothing here is imported or started until a profile is asked for, and the
+timer is stopped (or the thread exits) once the profile is done, so the bot
+pays nothing for it between profiles.
+"""
+
+import asyncio
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+
+
+# Label for samples taken while the loop had nothing to run
+IDLE = '<idle>'
+# Label for samples taken while the loop ran a plain callback, not a task
+NO_TASK = '<callbacks>'
+
+
+class Profile:
+    """One run of the sampler, and what it found
+
+    Attributes
+    ==========
+    interval : float
+        Seconds between samples.
+    root : str
+        Directory of the bot's own source files, whose functions get their own
+        table in the summary.
+    samples : collections.Counter
+        Number of samples by stack, as a tuple of frame labels (the task first,
+        then the outermost frame).
+    elapsed : float
+        Seconds the profile actually ran for.
+
+    Methods
+    =======
+    run(seconds)
+        Sample the loop this is called on for some seconds.
+    collapsed()
+        The samples in the collapsed-stack format, for flame graph tools.
+    summary(top_n)
+        A text summary of where the loop spent its time.
+    """
+    def __init__(self, interval=0.005, root=None):
+        self.interval = interval
+        if root == None:
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.root = root
+        self.samples = collections.Counter()
+        self.elapsed = 0.0
+        self._loop = None
+        self._stopped = threading.Event()
+        # Frame labels by code object, so each function is only described once
+        self._labels = {}
+        # Labels of functions in the bot's own code
+        self._own = set()
+
+    async def run(self, seconds):
+        """Sample the event loop this is awaited on, for some seconds"""
+        self._loop = asyncio.get_event_loop()
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, 'setitimer'):
+            await self._run_timer(seconds)
+        else:
+            await self._run_thread(seconds)
+
+    async def _run_timer(self, seconds):
+        sampling = False
+
+        def on_alarm(signum, frame):
+            nonlocal sampling
+            # Skip an alarm that went off while the last sample was being taken
+            if sampling:
+                return
+            sampling = True
+            try:
+                self.samples[self._stack(frame)] += 1
+            finally:
+                sampling = False
+
+        previous = signal.signal(signal.SIGALRM, on_alarm)
+        start = time.monotonic()
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            # A handler set from outside of Python reads as None
+            signal.signal(signal.SIGALRM, previous if previous != None else signal.SIG_DFL)
+            self.elapsed = time.monotonic() - start
+
+    async def _run_thread(self, seconds):
+        loop_thread = threading.get_ident()
+        done = self._loop.create_future()
+
+        def finished():
+            if not done.done():
+                done.set_result(None)
+
+        def sample():
+            start = time.monotonic()
+            try:
+                while not self._stopped.wait(self.interval):
+                    if time.monotonic() - start >= seconds:
+                        break
+                    frame = sys._current_frames().get(loop_thread)
+                    if frame == None:
+                        continue
+                    stack = self._stack(frame)
+                    del frame
+                    self.samples[stack] += 1
+            finally:
+                self.elapsed = time.monotonic() - start
+                self._loop.call_soon_threadsafe(finished)
+
+        threading.Thread(target=sample, name='profiler', daemon=True).start()
+        try:
+            await done
+        finally:
+            # Also stops the thread early if this is cancelled (e.g. on shutdown)
+            self._stopped.set()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label == None:
+            path = code.co_filename
+            own = path.startswith(self.root + os.sep)
+            if own:
+                path = os.path.relpath(path, self.root)
+            else:
+                # The package is enough to tell e.g. asyncio/events.py apart
+                path = os.path.join(os.path.basename(os.path.dirname(path)),
+                        os.path.basename(path))
+            label = '{}:{}'.format(path, code.co_name)
+            self._labels[code] = label
+            if own:
+                self._own.add(label)
+        return label
+
+    def _stack(self, frame):
+        codes = []
+        while frame != None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        # Everything outside of the loop's _run_once() is the same every time
+        for i, code in enumerate(codes):
+            if code.co_name == '_run_once':
+                codes = codes[i:]
+                break
+        task = asyncio.current_task(self._loop)
+        if task == None:
+            # Waiting in select()/poll() for I/O or timers
+            if os.path.basename(codes[-1].co_filename) == 'selectors.py':
+                return (IDLE,)
+            return (NO_TASK,) + tuple(self._label(code) for code in codes)
+        coro = task.get_coro()
+        name = getattr(coro, '__qualname__', type(coro).__name__)
+        return ('task:' + name,) + tuple(self._label(code) for code in codes)
+
+    def collapsed(self):
+        """The samples as `frame;frame;... count` lines, most common first
+
+        This is the format flamegraph.pl, speedscope and inferno read.
+        """
+        return ''.join('{} {}\n'.format(';'.join(stack), count)
+            for stack, count in self.samples.most_common())
+
+    def summary(self, top_n=25):
+        """Where the loop spent its time: by task, and by function
+
+        Functions are ranked by self time (samples where they were the
+        innermost frame) and, for the bot's own code, by total time (samples
+        where they were anywhere on the stack).
+        """
+        total = sum(self.samples.values())
+        idle = self.samples.get((IDLE,), 0)
+        busy = total - idle
+        lines = ['Sampled the event loop every {:.1f}ms for {:.1f}s: {} samples, {} busy ({:.1%})'.format(
+            self.interval * 1000, self.elapsed, total, busy, busy / total if total > 0 else 0)]
+        if busy == 0:
+            return '\n'.join(lines) + '\n'
+
+        tasks = collections.Counter()
+        own = collections.Counter()
+        inner = collections.Counter()
+        for stack, count in self.samples.items():
+            if stack == (IDLE,):
+                continue
+            tasks[stack[0]] += count
+            inner[stack[-1]] += count
+            # Count each function once per sample, even if it recursed
+            for label in self._own.intersection(stack):
+                own[label] += count
+
+        def table(title, counter):
+            lines.append('')
+            lines.append(title)
+            for label, count in counter.most_common(top_n):
+                lines.append('  {:6.1%} {:7d}  {}'.format(count / busy, count, label))
+
+        table('Busy time by task:', tasks)
+        table('Hottest functions (self time):', inner)
+        table('Hottest functions in the bot\'s own code (total time):', own)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,181 @@
+"""Per-guild result cache for the quote list queries
+
+A guild's quotes only change when one is saved, removed or imported, so the
+same `$rquote @user` or `$quotes` list can be served from memory until then.
+Every guild has a version number that each of those writes bumps, dropping all
+of the guild's results at once without having to know which queries it
+affected. A result whose query was still running during a write was loaded at
+the old version, so it's handed back to its callers but never cached.
+
+The cache holds at most max_entries results and max_rows rows in total, evicting
+the least recently used result first. Results are stored as tuples, since they
+are shared between every caller that asks for them.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+CACHE_REQUESTS = metrics.counter('chronicler_cache_requests_total',
+        'Lookups in a result cache, by whether they were served from it',
+        ('cache', 'result'))
+CACHE_EVICTIONS = metrics.counter('chronicler_cache_evictions_total',
+        'Results dropped from a result cache, and why', ('cache', 'reason'))
+CACHE_ENTRIES = metrics.gauge('chronicler_cache_entries',
+        'Results held in a result cache', ('cache',))
+CACHE_ROWS = metrics.gauge('chronicler_cache_rows',
+        'Rows held in a result cache, across all of its results', ('cache',))
+
+
+class Entry:
+    """One cached result"""
+    __slots__ = ('guild_id', 'rows', 'loaded_at')
+
+    def __init__(self, guild_id, rows, loaded_at):
+        self.guild_id = guild_id
+        self.rows = rows
+        self.loaded_at = loaded_at
+
+
+class ResultCache:
+    """Caches query results per guild, invalidated by bumping the guild's version
+
+    Attributes
+    ==========
+    name : str
+        Name to report metrics under.
+    max_entries : int
+        Most results to hold at once. 0 disables the cache.
+    max_rows : int
+        Most rows to hold at once, across all results; a result bigger than this
+        isn't cached at all. 0 disables the cache.
+    ttl : float
+        Seconds a result may be served for, even if its guild is never written
+        to (e.g. to pick up writes made by another process). None for no limit.
+
+    Methods
+    =======
+    get(guild_id, key, load)
+        A guild's result for key, loading it with load() if it isn't cached.
+    bump(guild_id)
+        Invalidate all of a guild's results, after a write.
+    clear()
+        Drop every cached result.
+    """
+    def __init__(self, name, max_entries, max_rows, ttl=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.rows = 0
+        # Version by guild ID, for guilds that were written to at least once
+        self.versions = {}
+        # Cached keys by guild ID, so bumping only touches that guild's results
+        self.guild_keys = {}
+        # Loads still running, by (key, version), for callers to share
+        self.loading = {}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_rows > 0
+
+    async def get(self, guild_id, key, load):
+        """A guild's result for key, loading it if it isn't cached
+
+        If the same result is already being loaded, that load is waited on
+        rather than starting another one.
+
+        Parameters
+        ==========
+        guild_id : int
+            ID of the guild the result belongs to.
+        key : tuple
+            Identifies the query (and its arguments) within the guild.
+        load : coroutine function
+            Called with no arguments to run the query on a miss.
+
+        Returns
+        =======
+        tuple
+            The result's rows.
+        """
+        if not self.enabled:
+            return tuple(await load())
+        key = (guild_id, key)
+        version = self.versions.get(guild_id, 0)
+        entry = self.entries.get(key)
+        if entry != None:
+            if self.ttl == None or time.monotonic() - entry.loaded_at < self.ttl:
+                self.entries.move_to_end(key)
+                CACHE_REQUESTS.inc(cache=self.name, result='hit')
+                return entry.rows
+            self._drop(key, 'expired')
+
+        task = self.loading.get((key, version))
+        if task != None:
+            CACHE_REQUESTS.inc(cache=self.name, result='shared')
+        else:
+            CACHE_REQUESTS.inc(cache=self.name, result='miss')
+            task = asyncio.ensure_future(self._load(guild_id, key, version, load))
+            self.loading[(key, version)] = task
+            task.add_done_callback(lambda t: self._loaded(key, version, t))
+        # A caller giving up (e.g. being cancelled) shouldn't cancel the load
+        # for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def _load(self, guild_id, key, version, load):
+        loaded_at = time.monotonic()
+        rows = tuple(await load())
+        # Only keep it if no write happened while it was loading
+        if self.versions.get(guild_id, 0) == version and len(rows) <= self.max_rows:
+            self._put(key, Entry(guild_id, rows, loaded_at))
+        return rows
+
+    def _loaded(self, key, version, task):
+        del self.loading[(key, version)]
+        # Mark a failure as seen, in case every caller gave up waiting on it
+        if not task.cancelled():
+            task.exception()
+
+    def _put(self, key, entry):
+        if key in self.entries:
+            self._drop(key, None)
+        self.entries[key] = entry
+        self.guild_keys.setdefault(entry.guild_id, set()).add(key)
+        self.rows += len(entry.rows)
+        while len(self.entries) > self.max_entries or self.rows > self.max_rows:
+            self._drop(next(iter(self.entries)), 'evicted')
+        self._report()
+
+    def _drop(self, key, reason):
+        entry = self.entries.pop(key)
+        self.rows -= len(entry.rows)
+        keys = self.guild_keys[entry.guild_id]
+        keys.discard(key)
+        if len(keys) == 0:
+            del self.guild_keys[entry.guild_id]
+        if reason != None:
+            CACHE_EVICTIONS.inc(cache=self.name, reason=reason)
+            self._report()
+
+    def _report(self):
+        CACHE_ENTRIES.set(len(self.entries), cache=self.name)
+        CACHE_ROWS.set(self.rows, cache=self.name)
+
+    def bump(self, guild_id):
+        """Invalidate all of a guild's results
+
+        Call this after anything that changes what the guild's queries return.
+        """
+        self.versions[guild_id] = self.versions.get(guild_id, 0) + 1
+        for key in list(self.guild_keys.get(guild_id, ())):
+            self._drop(key, 'invalidated')
+
+    def clear(self):
+        """Drop every cached result"""
+        for key in list(self.entries):
+            self._drop(key, 'invalidated')
@@ -0,0 +1,144 @@
+"""Runs a callback for each entry when it comes due, from a single timer
+
+Entries (e.g. reminders) are kept in a heap ordered by due time, and only the
+earliest one has a timer on the event loop. That is much cheaper than a
+sleeping task per entry, and entries can be looked up and removed by key.
+
+Removing an entry only marks it as removed where it sits in the heap, which is
+O(1); removed entries are skipped when they reach the top. Once more than half
+of the heap is removed entries it's rebuilt without them, so removals stay
+amortized O(log n) and the heap never grows past twice the pending entries.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+
+
+# Longest time in seconds to leave the timer set for, so that due times (which
+# are wall clock times) don't drift from the loop's clock over long waits
+MAX_TIMER = 3600
+
+# Marks a removed entry in the heap
+_REMOVED = object()
+
+
+class Scheduler:
+    """Entries to run a callback for at given UNIX timestamps
+
+    Attributes
+    ==========
+    callback : function
+        Called on the event loop as callback(key, item) when an entry is due.
+        It must not block; start a task for anything that awaits.
+
+    Methods
+    =======
+    add(key, due_at, item)
+        Schedule an entry, replacing any other with the same key.
+    remove(key)
+        Unschedule an entry, returning its item.
+    get(key)
+        An entry's item, without unscheduling it.
+    items()
+        Every pending entry's item, in no particular order.
+    stop()
+        Stop running entries for good (they stay pending, and so do new ones).
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        # Heap of [due_at, tiebreak, key, item]
+        self._heap = []
+        # Heap entries by key, for the entries that weren't removed
+        self._entries = {}
+        self._removed = 0
+        self._count = itertools.count()
+        self._timer = None
+        self._timer_due = None
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def add(self, key, due_at, item):
+        """Schedule item to be run at due_at (a UNIX timestamp) under key"""
+        if key in self._entries:
+            self.remove(key)
+        entry = [due_at, next(self._count), key, item]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._arm()
+
+    def remove(self, key):
+        """Unschedule the entry under key
+
+        Returns
+        =======
+        object
+            The entry's item, or None if nothing is scheduled under key.
+        """
+        entry = self._entries.pop(key, None)
+        if entry == None:
+            return None
+        item = entry[3]
+        entry[2] = _REMOVED
+        entry[3] = None
+        self._removed += 1
+        if self._removed * 2 > len(self._heap):
+            self._heap = [entry for entry in self._heap if entry[2] is not _REMOVED]
+            heapq.heapify(self._heap)
+            self._removed = 0
+        return item
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        return entry[3] if entry != None else None
+
+    def items(self):
+        return [entry[3] for entry in self._entries.values()]
+
+    def stop(self):
+        """Stop running entries, e.g. on shutdown
+
+        This is permanent: entries added afterwards are kept, but never run.
+        """
+        self._stopped = True
+        if self._timer != None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _arm(self):
+        """Set the timer for the earliest entry, if it isn't already"""
+        while len(self._heap) > 0 and self._heap[0][2] is _REMOVED:
+            heapq.heappop(self._heap)
+            self._removed -= 1
+        if len(self._heap) == 0 or self._stopped:
+            return
+        due_at = self._heap[0][0]
+        if self._timer != None:
+            if self._timer_due <= due_at:
+                return
+            self._timer.cancel()
+        delay = min(max(due_at - time.time(), 0), MAX_TIMER)
+        self._timer = asyncio.get_event_loop().call_later(delay, self._fire)
+        self._timer_due = due_at
+
+    def _fire(self):
+        self._timer = None
+        now = time.time()
+        try:
+            while len(self._heap) > 0 and not self._stopped and self._heap[0][0] <= now:
+                due_at, _, key, item = heapq.heappop(self._heap)
+                if key is _REMOVED:
+                    self._removed -= 1
+                    continue
+                del self._entries[key]
+                self.callback(key, item)
+        finally:
+            # Even if a callback failed, the rest still have to run
+            self._arm()
@@ -0,0 +1,31 @@
+"""Storage for the bot's quotes, reminders and stats
+
+Every backend implements storage.base.Storage:
+
+    'mysql'     A MySQL server, through dbhelper (storage.mysqlstore)
+    'sqlite'    An embedded SQLite file in WAL mode (storage.sqlitestore)
+
+Only the chosen backend's module (and its dependencies) gets imported.
+"""
+
+from storage.base import (Storage, QuoteRow, QUOTE_FIELDS, REMINDER_FIELDS,
+    STATS_TOTAL, STATS_AUTHOR, STATS_QUOTER, STATS_CHANNEL)
+
+
+def open_storage(backend, **options):
+    """Create a storage backend (call open() on it before use)
+
+    Parameters
+    ==========
+    backend : str
+        'mysql' or 'sqlite'.
+    options
+        Passed on to the backend's constructor.
+    """
+    if backend == 'mysql':
+        from storage.mysqlstore import MySQLStorage
+        return MySQLStorage(**options)
+    if backend == 'sqlite':
+        from storage.sqlitestore import SQLiteStorage
+        return SQLiteStorage(**options)
+    raise ValueError('Unknown storage backend {}'.format(backend))
@@ -0,0 +1,350 @@
+"""The interface every storage backend implements"""
+
+from collections import namedtuple
+
+# Columns of a quote, in the order backends return them (and the order quotes
+# are exported/imported in)
+QUOTE_FIELDS = ('author_id', 'quoter_id', 'message_id', 'guild_id', 'channel_id',
+    'content')
+
+# Named access to a quote tuple, for the few rows that actually get shown.
+# Backends hand back plain tuples: a guild's whole list can be tens of thousands
+# of rows, and plain tuples of ints are both smaller and cheaper to build (the
+# garbage collector stops tracking them)
+QuoteRow = namedtuple('QuoteRow', QUOTE_FIELDS)
+
+# Columns of a pending reminder, in the order backends return them
+REMINDER_FIELDS = ('id', 'guild_id', 'channel_id', 'user_id', 'message_id', 'due_at',
+    'memo')
+
+# Kinds of per-guild counters kept for stats (key_id is what is being counted)
+STATS_TOTAL     = 0     # Quotes in the guild (key_id is always 0)
+STATS_AUTHOR    = 1     # Quotes written by a user
+STATS_QUOTER    = 2     # Quotes saved by a user
+STATS_CHANNEL   = 3     # Quotes from a channel
+
+
+class Storage:
+    """Where the bot keeps its quotes, reminders and stats
+
+    All of the operations are coroutines, so backends are free to do their
+    blocking I/O off of the event loop. Quotes are passed around as tuples in
+    QUOTE_FIELDS order, and reminders as tuples in REMINDER_FIELDS order.
+
+    Methods
+    =======
+    open()
+        Connect, and create any missing tables.
+    close()
+        Finish any queued writes and disconnect.
+    drop_tables()
+        Delete every table (for benchmarks and tests).
+    save_quote(quote)
+        Save a quote and count it in the stats.
+    remove_quote(message_id)
+        Remove a quote and take it off of the stats.
+    select_quotes(guild_id, author_id, channel_id, newest_first)
+        All of a guild's quotes (without their text), optionally filtered.
+    quote_contents(message_ids)
+        The stored text of some quotes.
+    count_quotes(guild_id)
+        Number of quotes a guild has.
+    search_quotes(guild_id, terms, limit)
+        A guild's quotes that best match some words, best first.
+    update_quote_content(message_id, content)
+        Update the (searchable) text of a quote.
+    quote_chunk(guild_id, after_id, limit)
+        The next chunk of a guild's quotes, for keyset paging by message ID.
+    import_quotes(quotes)
+        Bulk-insert quotes, skipping ones that are already saved.
+    top_stats(guild_id, kind, limit)
+        A guild's highest counters of one kind.
+    rebuild_stats(guild_id)
+        Recount a guild's counters from its quotes.
+    add_reminder(guild_id, channel_id, user_id, message_id, due_at, memo)
+        Save a pending reminder.
+    remove_reminder(reminder_id)
+        Remove a sent (or cancelled) reminder.
+    pending_reminders()
+        Every reminder that hasn't been sent yet.
+    user_reminders(guild_id, user_id, after, limit)
+        The next page of a user's pending reminders in a guild.
+    cancel_reminder(reminder_id, guild_id, user_id)
+        Remove one of a user's pending reminders in a guild.
+    snooze_reminder(reminder_id, guild_id, user_id, seconds)
+        Push one of a user's pending reminders in a guild back.
+    set_qotd_channel(guild_id, channel_id)
+        Post a guild's quote of the day in a channel.
+    remove_qotd_channel(guild_id)
+        Stop posting a guild's quote of the day.
+    qotd_channels_due(day)
+        The quote of the day channels that haven't been posted in for a day.
+    claim_qotd(guild_id, day)
+        Mark a guild's quote of the day as posted, unless it already was.
+    random_quotes(guild_ids)
+        One random quote from each of some guilds.
+    guild_settings(after_version)
+        The guilds' saved settings, optionally only the ones saved recently.
+    save_guild_settings(guild_id, settings)
+        Save a guild's settings.
+    """
+    async def open(self):
+        """Connect, and create any missing tables
+
+        Returns
+        =======
+        bool
+            True if the storage is ready to use.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    async def drop_tables(self):
+        raise NotImplementedError
+
+    async def save_quote(self, quote):
+        """Save a quote, and bump its counters in the same transaction
+
+        Parameters
+        ==========
+        quote : tuple
+            The quote, in QUOTE_FIELDS order.
+
+        Returns
+        =======
+        bool
+            False if the quote couldn't be saved (e.g. it was already saved).
+        """
+        raise NotImplementedError
+
+    async def remove_quote(self, message_id):
+        """Remove a quote, and take it off of its counters in the same transaction
+
+        Returns
+        =======
+        bool
+            False if the DB couldn't be updated. Removing a quote that isn't
+            saved counts as success.
+        """
+        raise NotImplementedError
+
+    async def select_quotes(self, guild_id, author_id=None, channel_id=None, newest_first=False):
+        """All of a guild's quotes, optionally filtered by author and/or channel
+
+        The text is left out (content is None), since a guild's whole list can
+        be large and only a page of it is ever shown; see quote_contents().
+
+        Returns
+        =======
+        [tuple]
+            The quotes, in QUOTE_FIELDS order. Ordered by message ID (newest
+            first) if newest_first is set, otherwise in no particular order.
+        """
+        raise NotImplementedError
+
+    async def quote_contents(self, message_ids):
+        """The stored text of some quotes
+
+        Returns
+        =======
+        {int: str}
+            Text by message ID. Quotes saved before their text was stored map
+            to None, and IDs that aren't saved are left out.
+        """
+        raise NotImplementedError
+
+    async def count_quotes(self, guild_id):
+        raise NotImplementedError
+
+    async def search_quotes(self, guild_id, terms, limit):
+        """A guild's quotes whose text best matches terms, best match first"""
+        raise NotImplementedError
+
+    async def update_quote_content(self, message_id, content):
+        raise NotImplementedError
+
+    async def quote_chunk(self, guild_id, after_id, limit):
+        """Up to limit of a guild's quotes with message IDs above after_id, in ID order
+
+        Returns None if the DB couldn't be read.
+        """
+        raise NotImplementedError
+
+    async def import_quotes(self, quotes):
+        """Insert a batch of quotes in one transaction, skipping saved message IDs
+
+        Counters are not updated; call rebuild_stats() when done importing.
+
+        Returns
+        =======
+        int
+            Number of quotes actually inserted, or -1 if the batch failed.
+        """
+        raise NotImplementedError
+
+    async def top_stats(self, guild_id, kind, limit):
+        """A guild's highest counters of one kind (one of the STATS_* kinds)
+
+        Returns
+        =======
+        [(int, int)]
+            List of (key_id, count), highest count first.
+        """
+        raise NotImplementedError
+
+    async def rebuild_stats(self, guild_id=None):
+        """Recount a guild's counters (or every guild's, if None) from its quotes
+
+        Returns
+        =======
+        bool
+            True on success.
+        """
+        raise NotImplementedError
+
+    async def add_reminder(self, guild_id, channel_id, user_id, message_id, due_at, memo):
+        """Save a pending reminder, due at due_at (a UNIX timestamp)
+
+        Returns
+        =======
+        int
+            The new reminder's ID, or None if it couldn't be saved.
+        """
+        raise NotImplementedError
+
+    async def remove_reminder(self, reminder_id):
+        raise NotImplementedError
+
+    async def pending_reminders(self):
+        """Every reminder that hasn't been sent yet, soonest first"""
+        raise NotImplementedError
+
+    async def user_reminders(self, guild_id, user_id, after=None, limit=10):
+        """Up to limit of a user's pending reminders in a guild, soonest first
+
+        Pages are read by keyset, from the (guild_id, user_id, due_at, id) index:
+        pass the due_at and id of the last reminder on one page to get the next.
+
+        Parameters
+        ==========
+        after : (int, int)
+            (due_at, id) of the last reminder already shown, None for the first page.
+
+        Returns
+        =======
+        [tuple]
+            The reminders, in REMINDER_FIELDS order, ordered by due_at then id.
+            None if the DB couldn't be read.
+        """
+        raise NotImplementedError
+
+    async def cancel_reminder(self, reminder_id, guild_id, user_id):
+        """Remove a pending reminder, if it belongs to user_id in guild_id
+
+        Scoped like user_reminders(), so users can only change the reminders
+        they can list.
+
+        Returns
+        =======
+        bool
+            True if it was removed, False if there's no such reminder of the
+            user's (or the DB couldn't be updated).
+        """
+        raise NotImplementedError
+
+    async def snooze_reminder(self, reminder_id, guild_id, user_id, seconds):
+        """Make a pending reminder due seconds later, if it belongs to user_id in guild_id
+
+        Returns
+        =======
+        bool
+            True if it was updated, False if there's no such reminder of the
+            user's (or the DB couldn't be updated).
+        """
+        raise NotImplementedError
+
+    async def set_qotd_channel(self, guild_id, channel_id):
+        """Post a guild's quote of the day in a channel, replacing any other one
+
+        Moving the quote of the day to another channel doesn't post it again
+        on a day it was already posted.
+
+        Returns
+        =======
+        bool
+            True on success.
+        """
+        raise NotImplementedError
+
+    async def remove_qotd_channel(self, guild_id):
+        raise NotImplementedError
+
+    async def qotd_channels_due(self, day):
+        """The quote of the day channels not yet claimed for a day
+
+        Parameters
+        ==========
+        day : int
+            The day, as a proleptic Gregorian ordinal (date.toordinal()).
+
+        Returns
+        =======
+        [(int, int)]
+            List of (guild_id, channel_id).
+        """
+        raise NotImplementedError
+
+    async def claim_qotd(self, guild_id, day):
+        """Record that a guild's quote of the day is being posted for a day
+
+        This is done in a single conditional update, so only one caller (even
+        across processes) gets to post each guild's quote of the day.
+
+        Returns
+        =======
+        bool
+            True if the caller should post it, or False if it was already
+            claimed (or the guild no longer has a quote of the day channel).
+        """
+        raise NotImplementedError
+
+    async def random_quotes(self, guild_ids):
+        """Pick one random quote from each of some guilds, in two queries
+
+        The number of quotes to pick from comes from the STATS_TOTAL counters,
+        so call this with no more guilds than the backend can put in one query
+        (a few hundred).
+
+        Returns
+        =======
+        {int: tuple}
+            Quote (in QUOTE_FIELDS order) by guild ID. Guilds without quotes are
+            left out.
+        """
+        raise NotImplementedError
+
+    async def guild_settings(self, after_version=0):
+        """The settings of every guild saved with a version above after_version
+
+        Returns
+        =======
+        [(int, str, int)]
+            List of (guild_id, settings, version), where settings is the JSON
+            text passed to save_guild_settings().
+        """
+        raise NotImplementedError
+
+    async def save_guild_settings(self, guild_id, settings):
+        """Save a guild's settings (JSON text), replacing what was saved before
+
+        The save gets a version one higher than any saved so far (for any
+        guild), so other processes can find it with guild_settings().
+
+        Returns
+        =======
+        int
+            The save's version, or None if it couldn't be saved.
+        """
+        raise NotImplementedError
@@ -0,0 +1,453 @@
+"""Storage on a MySQL server, through dbhelper"""
+
+import asyncio
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import dbhelper as db
+from mysql.connector import Error
+from storage.base import (Storage, QUOTE_FIELDS, REMINDER_FIELDS,
+    STATS_TOTAL, STATS_AUTHOR, STATS_QUOTER, STATS_CHANNEL)
+
+
+LOGGER = logging.getLogger('chronicler.db')
+
+
+class MySQLStorage(Storage):
+    """Storage on a MySQL server
+
+    mysql.connector blocks, and a connection can't be shared between threads,
+    so every call runs on one dedicated worker thread. If a call raises a
+    mysql.connector error (most likely because the server dropped the
+    connection), the connection is reset and the call is tried once more. Calls
+    look up self.conn when they run, so the retry uses the new connection. If
+    reconnecting fails, the call raises, and the next call tries to connect
+    again first.
+
+    Parameters
+    ==========
+    host, user, password, database : str
+        Where to connect to.
+    suffix : str
+        Appended to every table name (e.g. '_DBG' for debug mode).
+    """
+    def __init__(self, host, user, password, database, suffix=''):
+        self.args = (host, user, password, database)
+        self.quotes_table = 'quotes' + suffix
+        self.stats_table = 'quote_stats' + suffix
+        self.reminders_table = 'reminders' + suffix
+        self.qotd_table = 'qotd_channels' + suffix
+        self.settings_table = 'guild_settings' + suffix
+        self.conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mysql')
+
+    async def _run(self, func, *args):
+        """Run func(*args) on the worker thread (func must use self.conn itself)"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, args)
+
+    async def _query(self, func, *args):
+        """Run a dbhelper function on the worker thread, as func(connection, *args)"""
+        return await self._run(lambda: func(self.conn, *args))
+
+    def _call(self, func, args):
+        if self.conn == None:
+            # The last reconnect failed, so try again before anything else
+            self._reset()
+            return func(*args)
+        try:
+            return func(*args)
+        except Error:
+            self._reset()
+            return func(*args)
+
+    def _reset(self):
+        """Replace the connection with a new one, raising Error if that fails"""
+        LOGGER.info('Resetting DB connection...')
+        if self.conn != None:
+            try:
+                db.close_srv_conn(self.conn)
+            except Error:
+                # Most likely it was already dropped
+                pass
+        self.conn = db.create_srv_conn(*self.args)
+        if self.conn == None:
+            raise Error('Unable to reconnect to the DB')
+
+    ############################################################################
+    # Setup
+    ############################################################################
+
+    async def open(self):
+        loop = asyncio.get_event_loop()
+        self.conn = await loop.run_in_executor(self._executor, db.create_srv_conn, *self.args)
+        if self.conn == None:
+            return False
+        await self._run(self._create_tables)
+        return True
+
+    async def close(self):
+        def close():
+            if self.conn != None:
+                db.close_srv_conn(self.conn)
+                self.conn = None
+        await asyncio.get_event_loop().run_in_executor(self._executor, close)
+        self._executor.shutdown()
+
+    def _create_tables(self):
+        # Try to create the 'quotes' table--ignore the error if it exists
+        table_cols = """
+            author_id BIGINT NOT NULL,
+            quoter_id BIGINT,
+            message_id BIGINT PRIMARY KEY,
+            guild_id BIGINT NOT NULL,
+            channel_id BIGINT NOT NULL,
+            content TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
+            INDEX by_guild (guild_id, message_id),
+            FULLTEXT INDEX ft_content (content)
+        """
+        db.create_table(self.conn, self.quotes_table, table_cols)
+        # Tables made before quote search existed don't store the quote text, so add it
+        # (again, ignore the errors if the column/index already exist)
+        db.add_column(self.conn, self.quotes_table,
+                'content TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci')
+        db.add_index(self.conn, self.quotes_table, 'ft_content', 'content', 'FULLTEXT')
+        db.add_index(self.conn, self.quotes_table, 'by_guild', 'guild_id, message_id')
+
+        # Counters behind `$quotestats`, kept up to date as quotes are saved/removed
+        stats_cols = """
+            guild_id BIGINT NOT NULL,
+            kind TINYINT NOT NULL,
+            key_id BIGINT NOT NULL,
+            count INT NOT NULL,
+            PRIMARY KEY (guild_id, kind, key_id),
+            INDEX by_count (guild_id, kind, count)
+        """
+        # A brand new stats table needs to count up the quotes that already exist
+        if db.create_table(self.conn, self.stats_table, stats_cols) == 0:
+            db.transaction(self.conn, self._rebuild_stats_queries())
+
+        reminder_cols = """
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            guild_id BIGINT NOT NULL,
+            channel_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            message_id BIGINT NOT NULL,
+            due_at BIGINT NOT NULL,
+            memo TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
+        """
+        db.create_table(self.conn, self.reminders_table, reminder_cols)
+        # For listing a user's reminders (ignore the error if it already exists)
+        db.add_index(self.conn, self.reminders_table, 'by_user', 'guild_id, user_id, due_at, id')
+
+        # Where each guild's quote of the day goes, and the last day it was posted
+        qotd_cols = """
+            guild_id BIGINT PRIMARY KEY,
+            channel_id BIGINT NOT NULL,
+            last_day INT NOT NULL DEFAULT 0
+        """
+        db.create_table(self.conn, self.qotd_table, qotd_cols)
+
+        # Settings each guild changed from the defaults (see guildsettings)
+        settings_cols = """
+            guild_id BIGINT PRIMARY KEY,
+            settings TEXT NOT NULL,
+            version BIGINT NOT NULL,
+            INDEX by_version (version)
+        """
+        db.create_table(self.conn, self.settings_table, settings_cols)
+
+    async def drop_tables(self):
+        def drop():
+            for table in (self.quotes_table, self.stats_table, self.reminders_table,
+                    self.qotd_table, self.settings_table):
+                db.drop_table(self.conn, table)
+        await self._run(drop)
+
+    ############################################################################
+    # Stats queries
+    ############################################################################
+
+    def _stats_queries(self, guild_id, author_id, quoter_id, channel_id, delta):
+        """Build the queries that adjust a guild's counters for one quote
+
+        These are meant to be run in the same transaction as the insert/delete
+        of the quote itself, so the counters never drift from the quotes table.
+
+        Parameters
+        ==========
+        guild_id, author_id, quoter_id, channel_id : int
+            IDs describing the quote. quoter_id may be None.
+        delta : int
+            1 if the quote is being saved, -1 if it is being removed.
+
+        Returns
+        =======
+        [(str, tuple)]
+            List of (query, params) pairs, for db.transaction().
+        """
+        keys = [(STATS_TOTAL, 0), (STATS_AUTHOR, author_id), (STATS_CHANNEL, channel_id)]
+        if quoter_id != None:
+            keys.append((STATS_QUOTER, quoter_id))
+        queries = []
+        for kind, key_id in keys:
+            if delta > 0:
+                q = ('INSERT INTO {} (guild_id, kind, key_id, count) VALUES (%s, %s, %s, %s) '
+                     'ON DUPLICATE KEY UPDATE count = count + %s;').format(self.stats_table)
+                queries.append((q, (guild_id, kind, key_id, delta, delta)))
+            else:
+                q = ('UPDATE {} SET count = count + %s '
+                     'WHERE guild_id = %s AND kind = %s AND key_id = %s;').format(self.stats_table)
+                queries.append((q, (delta, guild_id, kind, key_id)))
+                # Don't keep around counters for users/channels with no quotes left
+                q = ('DELETE FROM {} WHERE guild_id = %s AND kind = %s AND key_id = %s '
+                     'AND count <= 0;').format(self.stats_table)
+                queries.append((q, (guild_id, kind, key_id)))
+        return queries
+
+    def _rebuild_stats_queries(self, guild_id=None):
+        """Build the queries that recount a guild's counters from scratch
+
+        Parameters
+        ==========
+        guild_id : int
+            Guild to recount. If None, then every guild is recounted.
+
+        Returns
+        =======
+        [(str, tuple)]
+            List of (query, params) pairs, for db.transaction().
+        """
+        conds = []
+        params = None
+        if guild_id != None:
+            conds.append('guild_id = %s')
+            params = (guild_id,)
+        where = ' WHERE ' + ' AND '.join(conds) if conds else ''
+        queries = [('DELETE FROM {}{};'.format(self.stats_table, where), params)]
+
+        groups = [(STATS_TOTAL, None), (STATS_AUTHOR, 'author_id'),
+            (STATS_QUOTER, 'quoter_id'), (STATS_CHANNEL, 'channel_id')]
+        for kind, col in groups:
+            group_conds = list(conds)
+            # Imported quotes may not know who saved them
+            if kind == STATS_QUOTER:
+                group_conds.append('quoter_id IS NOT NULL')
+            where = ' WHERE ' + ' AND '.join(group_conds) if group_conds else ''
+            if col == None:
+                key, groupby = '0', 'guild_id'
+            else:
+                key, groupby = col, 'guild_id, {}'.format(col)
+            q = ('INSERT INTO {} (guild_id, kind, key_id, count) '
+                 'SELECT guild_id, {}, {}, COUNT(*) FROM {}{} GROUP BY {};').format(
+                    self.stats_table, kind, key, self.quotes_table, where, groupby)
+            queries.append((q, params))
+        return queries
+
+    ############################################################################
+    # Quotes
+    ############################################################################
+
+    def _save_quote(self, quote):
+        q = 'INSERT INTO {} ({}) VALUES (%s, %s, %s, %s, %s, %s);'.format(
+                self.quotes_table, ', '.join(QUOTE_FIELDS))
+        author_id, quoter_id, _, guild_id, channel_id, _ = quote
+        # Save the quote and bump the counters together, so that a duplicate
+        # save (which fails on the primary key) doesn't count twice
+        queries = [(q, tuple(quote))] + self._stats_queries(guild_id, author_id,
+                quoter_id, channel_id, 1)
+        return db.transaction(self.conn, queries) == 0
+
+    async def save_quote(self, quote):
+        return await self._run(self._save_quote, quote)
+
+    def _remove_quote(self, message_id):
+        # Need the saved entry to know which counters to take the quote off of
+        where = 'message_id = {}'.format(int(message_id))
+        results = db.select(self.conn, self.quotes_table, ', '.join(QUOTE_FIELDS), where)
+        queries = [('DELETE FROM {} WHERE {};'.format(self.quotes_table, where), None)]
+        if results:
+            author_id, quoter_id, _, guild_id, channel_id, _ = results[0]
+            queries += self._stats_queries(guild_id, author_id, quoter_id, channel_id, -1)
+        return db.transaction(self.conn, queries) == 0
+
+    async def remove_quote(self, message_id):
+        return await self._run(self._remove_quote, message_id)
+
+    async def select_quotes(self, guild_id, author_id=None, channel_id=None, newest_first=False):
+        where = 'guild_id = {}'.format(int(guild_id))
+        if author_id != None:
+            where += ' AND author_id = {}'.format(int(author_id))
+        if channel_id != None:
+            where += ' AND channel_id = {}'.format(int(channel_id))
+        # Rely on discord message ID being sequential
+        orderby = 'message_id' if newest_first else None
+        # Everything but the text, which is fetched a page at a time
+        cols = ', '.join(QUOTE_FIELDS[0:5]) + ', NULL'
+        results = await self._query(db.select, self.quotes_table, cols, where,
+                orderby)
+        return results if results != None else []
+
+    async def quote_contents(self, message_ids):
+        if len(message_ids) == 0:
+            return {}
+        where = 'message_id IN ({})'.format(', '.join(str(int(i)) for i in message_ids))
+        results = await self._query(db.select, self.quotes_table,
+                'message_id, content', where)
+        return dict(results) if results != None else {}
+
+    async def count_quotes(self, guild_id):
+        results = await self._query(db.select, self.quotes_table, 'COUNT(*)',
+                'guild_id = {}'.format(int(guild_id)))
+        return results[0][0] if results else 0
+
+    async def search_quotes(self, guild_id, terms, limit):
+        match = 'MATCH(content) AGAINST (%s IN NATURAL LANGUAGE MODE)'
+        cols = '{}, {} AS score'.format(', '.join(QUOTE_FIELDS), match)
+        where = 'guild_id = {} AND {}'.format(int(guild_id), match)
+        results = await self._query(db.select, self.quotes_table, cols, where,
+                'score', False, limit, (terms, terms))
+        # Leave off the score
+        return [row[0:len(QUOTE_FIELDS)] for row in results] if results else []
+
+    async def update_quote_content(self, message_id, content):
+        where = 'message_id = {}'.format(int(message_id))
+        await self._query(db.update, self.quotes_table, 'content = %s', where,
+                (content,))
+
+    async def quote_chunk(self, guild_id, after_id, limit):
+        where = 'guild_id = {} AND message_id > {}'.format(int(guild_id), int(after_id))
+        return await self._query(db.select, self.quotes_table,
+                ', '.join(QUOTE_FIELDS), where, 'message_id', True, limit)
+
+    async def import_quotes(self, quotes):
+        return await self._query(db.insert_many, self.quotes_table,
+                ', '.join(QUOTE_FIELDS), quotes, True)
+
+    ############################################################################
+    # Stats
+    ############################################################################
+
+    async def top_stats(self, guild_id, kind, limit):
+        where = 'guild_id = {} AND kind = {}'.format(int(guild_id), int(kind))
+        results = await self._query(db.select, self.stats_table, 'key_id, count',
+                where, 'count', False, limit)
+        return results if results != None else []
+
+    async def rebuild_stats(self, guild_id=None):
+        queries = self._rebuild_stats_queries(guild_id)
+        return await self._query(db.transaction, queries) == 0
+
+    ############################################################################
+    # Reminders
+    ############################################################################
+
+    async def add_reminder(self, guild_id, channel_id, user_id, message_id, due_at, memo):
+        cols = ', '.join(REMINDER_FIELDS[1:])
+        return await self._query(db.insert_returning_id, self.reminders_table,
+                cols, '%s, %s, %s, %s, %s, %s',
+                (guild_id, channel_id, user_id, message_id, int(due_at), memo))
+
+    async def remove_reminder(self, reminder_id):
+        await self._query(db.delete, self.reminders_table,
+                'id = {}'.format(int(reminder_id)))
+
+    async def pending_reminders(self):
+        results = await self._query(db.select, self.reminders_table,
+                ', '.join(REMINDER_FIELDS), None, 'due_at', True)
+        return results if results != None else []
+
+    async def user_reminders(self, guild_id, user_id, after=None, limit=10):
+        where = 'guild_id = {} AND user_id = {}'.format(int(guild_id), int(user_id))
+        if after != None:
+            # Spelled out rather than as a row comparison, which MySQL can't
+            # always use the index for
+            due_at, reminder_id = int(after[0]), int(after[1])
+            where += ' AND (due_at > {0} OR (due_at = {0} AND id > {1}))'.format(
+                    due_at, reminder_id)
+        return await self._query(db.select, self.reminders_table,
+                ', '.join(REMINDER_FIELDS), where, 'due_at ASC, id', True, int(limit))
+
+    async def cancel_reminder(self, reminder_id, guild_id, user_id):
+        where = 'id = {} AND guild_id = {} AND user_id = {}'.format(int(reminder_id),
+                int(guild_id), int(user_id))
+        return await self._query(db.delete_count, self.reminders_table, where) == 1
+
+    async def snooze_reminder(self, reminder_id, guild_id, user_id, seconds):
+        where = 'id = {} AND guild_id = {} AND user_id = {}'.format(int(reminder_id),
+                int(guild_id), int(user_id))
+        return await self._query(db.update_count, self.reminders_table,
+                'due_at = due_at + {}'.format(int(seconds)), where) == 1
+
+    ############################################################################
+    # Quote of the day
+    ############################################################################
+
+    async def set_qotd_channel(self, guild_id, channel_id):
+        q = ('INSERT INTO {} (guild_id, channel_id) VALUES (%s, %s) '
+             'ON DUPLICATE KEY UPDATE channel_id = VALUES(channel_id);').format(self.qotd_table)
+        return await self._query(db.query, q, False, (guild_id, channel_id)) == 0
+
+    async def remove_qotd_channel(self, guild_id):
+        await self._query(db.delete, self.qotd_table,
+                'guild_id = {}'.format(int(guild_id)))
+
+    async def qotd_channels_due(self, day):
+        results = await self._query(db.select, self.qotd_table,
+                'guild_id, channel_id', 'last_day < {}'.format(int(day)))
+        return results if results != None else []
+
+    async def claim_qotd(self, guild_id, day):
+        where = 'guild_id = {} AND last_day < {}'.format(int(guild_id), int(day))
+        return await self._query(db.update_count, self.qotd_table,
+                'last_day = {}'.format(int(day)), where) == 1
+
+    async def random_quotes(self, guild_ids):
+        if len(guild_ids) == 0:
+            return {}
+        where = 'kind = {} AND key_id = 0 AND guild_id IN ({})'.format(int(STATS_TOTAL),
+                ', '.join(str(int(i)) for i in guild_ids))
+        counts = await self._query(db.select, self.stats_table, 'guild_id, count', where)
+        counts = [(guild_id, count) for guild_id, count in counts or [] if count > 0]
+        if len(counts) == 0:
+            return {}
+        # Skipping a random number of entries in the by_guild index picks
+        # uniformly. OFFSET still steps over that many entries, but only the
+        # message IDs are selected, so the index covers it and no rows are read
+        # on the way; then just the picked rows are looked up. One branch per guild
+        branch = '(SELECT message_id FROM {} WHERE guild_id = {{}} ORDER BY message_id LIMIT 1 OFFSET {{}})'.format(
+                self.quotes_table)
+        picked = ' UNION ALL '.join(branch.format(int(guild_id), random.randrange(count))
+                for guild_id, count in counts)
+        q = 'SELECT {} FROM ({}) AS picked JOIN {} AS q ON q.message_id = picked.message_id;'.format(
+                ', '.join('q.' + field for field in QUOTE_FIELDS), picked, self.quotes_table)
+        rows = await self._query(db.read_query, q)
+        # Guild ID is Index 3 of the results tuple
+        return {row[3]: row for row in rows} if rows != None else {}
+
+    ############################################################################
+    # Guild settings
+    ############################################################################
+
+    async def guild_settings(self, after_version=0):
+        results = await self._query(db.select, self.settings_table,
+                'guild_id, settings, version', 'version > {}'.format(int(after_version)),
+                'version', True)
+        return results if results != None else []
+
+    def _save_guild_settings(self, guild_id, settings):
+        # Picking the next version and saving with it is a single statement, so
+        # two processes saving at once can't both take the same version
+        q = ('INSERT INTO {0} (guild_id, settings, version) '
+             'SELECT %s, %s, COALESCE(MAX(version), 0) + 1 FROM {0} '
+             'ON DUPLICATE KEY UPDATE settings = VALUES(settings), version = VALUES(version);'
+             ).format(self.settings_table)
+        if db.query(self.conn, q, False, (guild_id, settings)) != 0:
+            return None
+        results = db.select(self.conn, self.settings_table, 'version',
+                'guild_id = {}'.format(int(guild_id)))
+        return results[0][0] if results else None
+
+    async def save_guild_settings(self, guild_id, settings):
+        return await self._run(self._save_guild_settings, guild_id, settings)
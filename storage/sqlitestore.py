@@ -0,0 +1,607 @@
+"""Storage in an embedded SQLite file
+
+The database runs in WAL mode, so reads never wait on writes. Reads go through
+their own connection on a worker thread. Writes are handed to a dedicated writer
+thread, which drains whatever has queued up (up to batch_size writes) and runs it
+all in a single transaction, so a burst of quote saves costs one commit (and
+one fsync) instead of one each. Every write gets its own savepoint inside the
+batch, so a write that fails is rolled back without taking the rest with it.
+"""
+
+import asyncio
+import logging
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from storage.base import (Storage, QUOTE_FIELDS, REMINDER_FIELDS,
+    STATS_TOTAL, STATS_AUTHOR, STATS_QUOTER, STATS_CHANNEL)
+
+
+LOGGER = logging.getLogger('chronicler.db')
+
+# The same metrics dbhelper keeps for MySQL: time spent in each kind of DB
+# call, and how many of them failed
+QUERY_SECONDS = metrics.histogram('chronicler_db_query_seconds',
+        'Time spent running DB queries', ('op',))
+QUERY_ERRORS = metrics.counter('chronicler_db_query_errors_total',
+        'DB queries that raised an error', ('op',))
+
+# Words in a search, for building an FTS5 query out of
+WORD_RE = re.compile(r'\w+')
+
+
+class SQLiteStorage(Storage):
+    """Storage in an embedded SQLite file
+
+    Parameters
+    ==========
+    path : str
+        The database file (created if it doesn't exist).
+    suffix : str
+        Appended to every table name (e.g. '_DBG' for debug mode).
+    batch_size : int
+        Most writes to commit together.
+    batch_wait : float
+        Time in seconds the writer waits for more writes to join a batch, once
+        it has one.
+    """
+    def __init__(self, path, suffix='', batch_size=100, batch_wait=0.002):
+        self.path = path
+        self.quotes_table = 'quotes' + suffix
+        self.fts_table = 'quotes_fts' + suffix
+        self.stats_table = 'quote_stats' + suffix
+        self.reminders_table = 'reminders' + suffix
+        self.qotd_table = 'qotd_channels' + suffix
+        self.settings_table = 'guild_settings' + suffix
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        # Set if this SQLite build has no FTS5, in which case search falls back to LIKE
+        self.fts = True
+        self._reader = None
+        self._read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-read')
+        self._writes = queue.SimpleQueue()
+        self._writer = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL;')
+        # Safe with WAL: a crash can lose the last commits, but never corrupts the DB
+        conn.execute('PRAGMA synchronous = NORMAL;')
+        conn.execute('PRAGMA busy_timeout = 5000;')
+        return conn
+
+    ############################################################################
+    # Threads
+    ############################################################################
+
+    async def _read(self, func, *args):
+        """Run func(conn, *args) on the reader thread, and wait for its result"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._read_executor, self._timed_read, func, args)
+
+    def _timed_read(self, func, args):
+        try:
+            with QUERY_SECONDS.time(op='read'):
+                return func(self._reader, *args)
+        except Exception:
+            QUERY_ERRORS.inc(op='read')
+            raise
+
+    async def _write(self, func, *args):
+        """Queue func(conn, *args) for the writer thread, and wait for its result"""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._writes.put((func, args, loop, future))
+        return await future
+
+    def _write_loop(self, conn):
+        while True:
+            item = self._writes.get()
+            if item == None:
+                break
+            batch = [item]
+            stopping = False
+            # Give writes that are about to arrive a moment to join the batch
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._writes.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item == None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._run_batch(conn, batch)
+            if stopping:
+                break
+        conn.close()
+
+    def _run_batch(self, conn, batch):
+        results = []
+        start = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE;')
+            for func, args, loop, future in batch:
+                conn.execute('SAVEPOINT write;')
+                try:
+                    with QUERY_SECONDS.time(op='write'):
+                        result = func(conn, *args)
+                    conn.execute('RELEASE write;')
+                    results.append((loop, future, result, None))
+                except Exception as err:
+                    QUERY_ERRORS.inc(op='write')
+                    conn.execute('ROLLBACK TO write;')
+                    conn.execute('RELEASE write;')
+                    results.append((loop, future, None, err))
+            conn.execute('COMMIT;')
+            # The whole batch, commit included
+            QUERY_SECONDS.observe(time.perf_counter() - start, op='transaction')
+        except sqlite3.Error as err:
+            # The whole batch is lost, so fail every write in it
+            QUERY_ERRORS.inc(op='transaction')
+            LOGGER.error('%s', err)
+            if conn.in_transaction:
+                conn.execute('ROLLBACK;')
+            results = [(loop, future, None, err) for _, _, loop, future in batch]
+        for loop, future, result, err in results:
+            loop.call_soon_threadsafe(_resolve, future, result, err)
+
+    ############################################################################
+    # Setup
+    ############################################################################
+
+    async def open(self):
+        try:
+            self._reader = self._connect()
+            writer_conn = self._connect()
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return False
+        LOGGER.info('Opened SQLite DB %s', self.path)
+        self._writer = threading.Thread(target=self._write_loop, args=(writer_conn,),
+                name='sqlite-write', daemon=True)
+        self._writer.start()
+        await self._write(self._create_tables)
+        return True
+
+    async def close(self):
+        if self._writer != None:
+            # Writes queued before this still get committed
+            self._writes.put(None)
+            await asyncio.get_event_loop().run_in_executor(None, self._writer.join)
+            self._writer = None
+        if self._reader != None:
+            await self._read(lambda conn: conn.close())
+            self._reader = None
+        self._read_executor.shutdown()
+
+    def _create_tables(self, conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS {} (
+            author_id INTEGER NOT NULL,
+            quoter_id INTEGER,
+            message_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            content TEXT
+        );""".format(self.quotes_table))
+        conn.execute('CREATE INDEX IF NOT EXISTS {0}_by_guild ON {0} (guild_id, message_id);'.format(
+            self.quotes_table))
+
+        # Full-text index over the quote text, kept in sync by triggers
+        try:
+            conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5(
+                content, content='{}', content_rowid='message_id');""".format(
+                    self.fts_table, self.quotes_table))
+        except sqlite3.OperationalError:
+            LOGGER.warning('SQLite has no FTS5, quote search will be slow')
+            self.fts = False
+        if self.fts:
+            conn.execute("""CREATE TRIGGER IF NOT EXISTS {0}_ai AFTER INSERT ON {0} BEGIN
+                INSERT INTO {1} (rowid, content) VALUES (new.message_id, new.content);
+            END;""".format(self.quotes_table, self.fts_table))
+            conn.execute("""CREATE TRIGGER IF NOT EXISTS {0}_ad AFTER DELETE ON {0} BEGIN
+                INSERT INTO {1} ({1}, rowid, content) VALUES ('delete', old.message_id, old.content);
+            END;""".format(self.quotes_table, self.fts_table))
+            conn.execute("""CREATE TRIGGER IF NOT EXISTS {0}_au AFTER UPDATE OF content ON {0} BEGIN
+                INSERT INTO {1} ({1}, rowid, content) VALUES ('delete', old.message_id, old.content);
+                INSERT INTO {1} (rowid, content) VALUES (new.message_id, new.content);
+            END;""".format(self.quotes_table, self.fts_table))
+
+        # Counters behind `$quotestats`, kept up to date as quotes are saved/removed
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;",
+                (self.stats_table,)).fetchone()
+        conn.execute("""CREATE TABLE IF NOT EXISTS {} (
+            guild_id INTEGER NOT NULL,
+            kind INTEGER NOT NULL,
+            key_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, kind, key_id)
+        ) WITHOUT ROWID;""".format(self.stats_table))
+        conn.execute('CREATE INDEX IF NOT EXISTS {0}_by_count ON {0} (guild_id, kind, count);'.format(
+            self.stats_table))
+        # A brand new stats table needs to count up the quotes that already exist
+        if exists == None:
+            self._rebuild_stats(conn)
+
+        conn.execute("""CREATE TABLE IF NOT EXISTS {} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            due_at INTEGER NOT NULL,
+            memo TEXT
+        );""".format(self.reminders_table))
+        conn.execute('CREATE INDEX IF NOT EXISTS {0}_by_user ON {0} (guild_id, user_id, due_at, id);'.format(
+            self.reminders_table))
+
+        # Where each guild's quote of the day goes, and the last day it was posted
+        conn.execute("""CREATE TABLE IF NOT EXISTS {} (
+            guild_id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            last_day INTEGER NOT NULL DEFAULT 0
+        );""".format(self.qotd_table))
+
+        # Settings each guild changed from the defaults (see guildsettings)
+        conn.execute("""CREATE TABLE IF NOT EXISTS {} (
+            guild_id INTEGER PRIMARY KEY,
+            settings TEXT NOT NULL,
+            version INTEGER NOT NULL
+        );""".format(self.settings_table))
+        conn.execute('CREATE INDEX IF NOT EXISTS {0}_by_version ON {0} (version);'.format(
+            self.settings_table))
+
+    async def drop_tables(self):
+        def drop(conn):
+            for table in (self.fts_table, self.quotes_table, self.stats_table,
+                    self.reminders_table, self.qotd_table, self.settings_table):
+                conn.execute('DROP TABLE IF EXISTS {};'.format(table))
+        await self._write(drop)
+
+    ############################################################################
+    # Stats queries
+    ############################################################################
+
+    def _bump_stats(self, conn, guild_id, author_id, quoter_id, channel_id, delta):
+        """Adjust a guild's counters for one quote, in the quote's transaction"""
+        keys = [(STATS_TOTAL, 0), (STATS_AUTHOR, author_id), (STATS_CHANNEL, channel_id)]
+        if quoter_id != None:
+            keys.append((STATS_QUOTER, quoter_id))
+        for kind, key_id in keys:
+            conn.execute(('INSERT INTO {} (guild_id, kind, key_id, count) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (guild_id, kind, key_id) DO UPDATE SET count = count + excluded.count;'
+                ).format(self.stats_table), (guild_id, kind, key_id, delta))
+        if delta < 0:
+            # Don't keep around counters for users/channels with no quotes left
+            for kind, key_id in keys:
+                conn.execute(('DELETE FROM {} WHERE guild_id = ? AND kind = ? AND key_id = ? '
+                    'AND count <= 0;').format(self.stats_table), (guild_id, kind, key_id))
+
+    def _rebuild_stats(self, conn, guild_id=None):
+        where, params = ('WHERE guild_id = ?', (guild_id,)) if guild_id != None else ('', ())
+        conn.execute('DELETE FROM {} {};'.format(self.stats_table, where), params)
+        groups = [(STATS_TOTAL, None), (STATS_AUTHOR, 'author_id'),
+            (STATS_QUOTER, 'quoter_id'), (STATS_CHANNEL, 'channel_id')]
+        for kind, col in groups:
+            conds = [where[len('WHERE '):]] if where else []
+            # Imported quotes may not know who saved them
+            if kind == STATS_QUOTER:
+                conds.append('quoter_id IS NOT NULL')
+            group_where = 'WHERE ' + ' AND '.join(conds) if conds else ''
+            if col == None:
+                key, groupby = '0', 'guild_id'
+            else:
+                key, groupby = col, 'guild_id, {}'.format(col)
+            conn.execute(('INSERT INTO {} (guild_id, kind, key_id, count) '
+                 'SELECT guild_id, {}, {}, COUNT(*) FROM {} {} GROUP BY {};').format(
+                    self.stats_table, kind, key, self.quotes_table, group_where, groupby),
+                params)
+
+    ############################################################################
+    # Quotes
+    ############################################################################
+
+    def _save_quote(self, conn, quote):
+        author_id, quoter_id, _, guild_id, channel_id, _ = quote
+        conn.execute('INSERT INTO {} ({}) VALUES (?, ?, ?, ?, ?, ?);'.format(
+            self.quotes_table, ', '.join(QUOTE_FIELDS)), tuple(quote))
+        self._bump_stats(conn, guild_id, author_id, quoter_id, channel_id, 1)
+
+    async def save_quote(self, quote):
+        try:
+            await self._write(self._save_quote, quote)
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return False
+        return True
+
+    def _remove_quote(self, conn, message_id):
+        # Need the saved entry to know which counters to take the quote off of
+        row = conn.execute('SELECT {} FROM {} WHERE message_id = ?;'.format(
+            ', '.join(QUOTE_FIELDS), self.quotes_table), (message_id,)).fetchone()
+        if row == None:
+            return
+        conn.execute('DELETE FROM {} WHERE message_id = ?;'.format(self.quotes_table),
+            (message_id,))
+        author_id, quoter_id, _, guild_id, channel_id, _ = row
+        self._bump_stats(conn, guild_id, author_id, quoter_id, channel_id, -1)
+
+    async def remove_quote(self, message_id):
+        try:
+            await self._write(self._remove_quote, message_id)
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return False
+        return True
+
+    async def select_quotes(self, guild_id, author_id=None, channel_id=None, newest_first=False):
+        # Everything but the text, which is fetched a page at a time
+        q = 'SELECT {}, NULL FROM {} WHERE guild_id = ?'.format(', '.join(QUOTE_FIELDS[0:5]),
+            self.quotes_table)
+        params = [guild_id]
+        if author_id != None:
+            q += ' AND author_id = ?'
+            params.append(author_id)
+        if channel_id != None:
+            q += ' AND channel_id = ?'
+            params.append(channel_id)
+        if newest_first:
+            q += ' ORDER BY message_id DESC'
+        return await self._read(_fetchall, q + ';', params)
+
+    async def quote_contents(self, message_ids):
+        if len(message_ids) == 0:
+            return {}
+        q = 'SELECT message_id, content FROM {} WHERE message_id IN ({});'.format(
+            self.quotes_table, ', '.join(['?'] * len(message_ids)))
+        return dict(await self._read(_fetchall, q, list(message_ids)))
+
+    async def count_quotes(self, guild_id):
+        q = 'SELECT COUNT(*) FROM {} WHERE guild_id = ?;'.format(self.quotes_table)
+        return (await self._read(_fetchall, q, (guild_id,)))[0][0]
+
+    async def search_quotes(self, guild_id, terms, limit):
+        words = WORD_RE.findall(terms)
+        if len(words) == 0:
+            return []
+        cols = ', '.join('q.' + field for field in QUOTE_FIELDS)
+        if self.fts:
+            # Match any of the words (quoted, so none are taken as FTS5 syntax),
+            # best bm25 score first
+            match = ' OR '.join('"{}"'.format(word) for word in words)
+            q = ('SELECT {0} FROM {1} JOIN {2} q ON q.message_id = {1}.rowid '
+                 'WHERE {1} MATCH ? AND q.guild_id = ? ORDER BY bm25({1}) LIMIT ?;').format(
+                    cols, self.fts_table, self.quotes_table)
+            params = (match, guild_id, limit)
+        else:
+            # Rank by how many of the words appear
+            score = ' + '.join(['(q.content LIKE ?)'] * len(words))
+            q = ('SELECT {} FROM {} q WHERE q.guild_id = ? AND ({}) > 0 '
+                 'ORDER BY ({}) DESC LIMIT ?;').format(cols, self.quotes_table, score, score)
+            likes = tuple('%{}%'.format(word) for word in words)
+            params = likes + (guild_id,) + likes + (limit,)
+        return await self._read(_fetchall, q, params)
+
+    async def update_quote_content(self, message_id, content):
+        def update(conn):
+            conn.execute('UPDATE {} SET content = ? WHERE message_id = ?;'.format(
+                self.quotes_table), (content, message_id))
+        try:
+            await self._write(update)
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+
+    async def quote_chunk(self, guild_id, after_id, limit):
+        q = ('SELECT {} FROM {} WHERE guild_id = ? AND message_id > ? '
+             'ORDER BY message_id ASC LIMIT ?;').format(', '.join(QUOTE_FIELDS), self.quotes_table)
+        try:
+            return await self._read(_fetchall, q, (guild_id, after_id, limit))
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return None
+
+    async def import_quotes(self, quotes):
+        def insert(conn):
+            # rowcount leaves out the FTS trigger's inserts, and the ignored rows
+            return conn.executemany('INSERT OR IGNORE INTO {} ({}) VALUES (?, ?, ?, ?, ?, ?);'.format(
+                self.quotes_table, ', '.join(QUOTE_FIELDS)), quotes).rowcount
+        if len(quotes) == 0:
+            return 0
+        try:
+            return await self._write(insert)
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return -1
+
+    ############################################################################
+    # Stats
+    ############################################################################
+
+    async def top_stats(self, guild_id, kind, limit):
+        q = ('SELECT key_id, count FROM {} WHERE guild_id = ? AND kind = ? '
+             'ORDER BY count DESC LIMIT ?;').format(self.stats_table)
+        return await self._read(_fetchall, q, (guild_id, kind, limit))
+
+    async def rebuild_stats(self, guild_id=None):
+        try:
+            await self._write(self._rebuild_stats, guild_id)
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return False
+        return True
+
+    ############################################################################
+    # Reminders
+    ############################################################################
+
+    async def add_reminder(self, guild_id, channel_id, user_id, message_id, due_at, memo):
+        def insert(conn):
+            cursor = conn.execute('INSERT INTO {} ({}) VALUES (?, ?, ?, ?, ?, ?);'.format(
+                self.reminders_table, ', '.join(REMINDER_FIELDS[1:])),
+                (guild_id, channel_id, user_id, message_id, int(due_at), memo))
+            return cursor.lastrowid
+        try:
+            return await self._write(insert)
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return None
+
+    async def remove_reminder(self, reminder_id):
+        def delete(conn):
+            conn.execute('DELETE FROM {} WHERE id = ?;'.format(self.reminders_table),
+                (reminder_id,))
+        try:
+            await self._write(delete)
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+
+    async def pending_reminders(self):
+        q = 'SELECT {} FROM {} ORDER BY due_at ASC;'.format(', '.join(REMINDER_FIELDS),
+            self.reminders_table)
+        return await self._read(_fetchall, q, ())
+
+    async def user_reminders(self, guild_id, user_id, after=None, limit=10):
+        q = 'SELECT {} FROM {} WHERE guild_id = ? AND user_id = ?'.format(
+            ', '.join(REMINDER_FIELDS), self.reminders_table)
+        params = [guild_id, user_id]
+        if after != None:
+            q += ' AND (due_at, id) > (?, ?)'
+            params += list(after)
+        q += ' ORDER BY due_at, id LIMIT ?;'
+        try:
+            return await self._read(_fetchall, q, params + [limit])
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return None
+
+    async def cancel_reminder(self, reminder_id, guild_id, user_id):
+        def delete(conn):
+            return conn.execute('DELETE FROM {} WHERE id = ? AND guild_id = ? AND user_id = ?;'.format(
+                self.reminders_table), (reminder_id, guild_id, user_id)).rowcount
+        try:
+            return await self._write(delete) == 1
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return False
+
+    async def snooze_reminder(self, reminder_id, guild_id, user_id, seconds):
+        def update(conn):
+            return conn.execute('UPDATE {} SET due_at = due_at + ? WHERE id = ? AND guild_id = ? AND user_id = ?;'.format(
+                self.reminders_table), (int(seconds), reminder_id, guild_id, user_id)).rowcount
+        try:
+            return await self._write(update) == 1
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return False
+
+
+    ############################################################################
+    # Quote of the day
+    ############################################################################
+
+    async def set_qotd_channel(self, guild_id, channel_id):
+        def upsert(conn):
+            conn.execute(('INSERT INTO {} (guild_id, channel_id) VALUES (?, ?) '
+                'ON CONFLICT (guild_id) DO UPDATE SET channel_id = excluded.channel_id;'
+                ).format(self.qotd_table), (guild_id, channel_id))
+        try:
+            await self._write(upsert)
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return False
+        return True
+
+    async def remove_qotd_channel(self, guild_id):
+        def delete(conn):
+            conn.execute('DELETE FROM {} WHERE guild_id = ?;'.format(self.qotd_table),
+                (guild_id,))
+        try:
+            await self._write(delete)
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+
+    async def qotd_channels_due(self, day):
+        q = 'SELECT guild_id, channel_id FROM {} WHERE last_day < ?;'.format(self.qotd_table)
+        return await self._read(_fetchall, q, (day,))
+
+    async def claim_qotd(self, guild_id, day):
+        def claim(conn):
+            return conn.execute('UPDATE {} SET last_day = ? WHERE guild_id = ? AND last_day < ?;'.format(
+                self.qotd_table), (day, guild_id, day)).rowcount
+        try:
+            return await self._write(claim) == 1
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return False
+
+    async def random_quotes(self, guild_ids):
+        if len(guild_ids) == 0:
+            return {}
+        q = 'SELECT guild_id, count FROM {} WHERE kind = ? AND key_id = 0 AND guild_id IN ({});'.format(
+            self.stats_table, ', '.join(['?'] * len(guild_ids)))
+        counts = await self._read(_fetchall, q, [STATS_TOTAL] + list(guild_ids))
+        counts = [(guild_id, count) for guild_id, count in counts if count > 0]
+        if len(counts) == 0:
+            return {}
+        # Skipping a random number of entries in the (guild_id, message_id)
+        # index picks uniformly. OFFSET still steps over that many entries, but
+        # only the message IDs are selected, so it's read from the index alone;
+        # then just the picked rows are looked up. One branch per guild
+        branch = 'SELECT * FROM (SELECT message_id FROM {} WHERE guild_id = ? ORDER BY message_id LIMIT 1 OFFSET ?)'.format(
+            self.quotes_table)
+        q = 'SELECT {} FROM ({}) AS picked JOIN {} AS q ON q.message_id = picked.message_id;'.format(
+            ', '.join('q.' + field for field in QUOTE_FIELDS),
+            ' UNION ALL '.join([branch] * len(counts)), self.quotes_table)
+        params = []
+        for guild_id, count in counts:
+            params += [guild_id, random.randrange(count)]
+        rows = await self._read(_fetchall, q, params)
+        # Guild ID is Index 3 of the results tuple
+        return {row[3]: row for row in rows}
+
+
+    ############################################################################
+    # Guild settings
+    ############################################################################
+
+    async def guild_settings(self, after_version=0):
+        q = 'SELECT guild_id, settings, version FROM {} WHERE version > ? ORDER BY version;'.format(
+            self.settings_table)
+        return await self._read(_fetchall, q, (after_version,))
+
+    async def save_guild_settings(self, guild_id, settings):
+        def save(conn):
+            # The writer's transaction is IMMEDIATE, so no other process can
+            # take the same version in between
+            version = conn.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM {};'.format(
+                self.settings_table)).fetchone()[0]
+            conn.execute(('INSERT INTO {} (guild_id, settings, version) VALUES (?, ?, ?) '
+                'ON CONFLICT (guild_id) DO UPDATE SET settings = excluded.settings, '
+                'version = excluded.version;').format(self.settings_table),
+                (guild_id, settings, version))
+            return version
+        try:
+            return await self._write(save)
+        except sqlite3.Error as err:
+            LOGGER.error('%s', err)
+            return None
+
+
+def _fetchall(conn, q, params):
+    return conn.execute(q, params).fetchall()
+
+def _resolve(future, result, err):
+    # The waiting coroutine may have been cancelled in the meantime
+    if future.cancelled():
+        return
+    if err != None:
+        future.set_exception(err)
+    else:
+        future.set_result(result)